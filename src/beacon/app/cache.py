@@ -0,0 +1,195 @@
+# app/cache.py
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .instrumentation import CACHE_LOOKUPS, CACHE_REFRESHES
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotCache:
+    """Process-wide TTL cache for computed API payloads"""
+
+    def __init__(self, ttl_seconds: float, max_entries: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key until the TTL elapses"""
+        with self._lock:
+            now = time.monotonic()
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl_seconds, value)
+            if self.max_entries is not None and len(self._entries) > self.max_entries:
+                # Expired entries go first, then the oldest insertions
+                for stale in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                    del self._entries[stale]
+                while len(self._entries) > self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one entry, or every entry when no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class SingleFlight:
+    """Async cache where concurrent misses for a key share one computation
+
+    A value is fresh for ttl_seconds. For a further stale_seconds it is still
+    served while a single background task recomputes it (stale-while-
+    revalidate). With refresh_ahead set (a fraction of the TTL, e.g. 0.8),
+    fresh values are also recomputed in the background once they pass that
+    age, so busy keys rarely go stale at all. Only when there is no usable
+    value do callers wait, and then all of them wait on the same task.
+
+    compute() must not depend on request-scoped resources such as the
+    request's DB session, because it may outlive the request that started it.
+
+    With max_entries set, the oldest stored keys are dropped beyond it, so
+    keys that embed a data version do not accumulate as the version moves.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        stale_seconds: float = 0.0,
+        refresh_ahead: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.refresh_ahead = refresh_ahead
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the value for key, computing it at most once concurrently"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl_seconds:
+                CACHE_LOOKUPS.inc(cache=self.name, outcome="hit")
+                if self.refresh_ahead is not None and age >= self.ttl_seconds * self.refresh_ahead:
+                    self._start(key, compute, "ahead")
+                return value
+            if age < self.ttl_seconds + self.stale_seconds:
+                CACHE_LOOKUPS.inc(cache=self.name, outcome="stale")
+                self._start(key, compute, "stale")
+                return value
+
+        coalesced = key in self._inflight
+        CACHE_LOOKUPS.inc(cache=self.name, outcome="coalesced" if coalesced else "miss")
+        task = self._start(key, compute, "miss")
+        # Shielded so a client disconnect does not cancel the shared work
+        return await asyncio.shield(task)
+
+    def _start(self, key: Hashable, compute, trigger: str) -> "asyncio.Task[Any]":
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._compute(key, compute, trigger))
+            self._inflight[key] = task
+            if trigger != "miss":
+                task.add_done_callback(self._log_failed_refresh)
+        return task
+
+    def _log_failed_refresh(self, task: "asyncio.Task[Any]") -> None:
+        # Nobody may await a background refresh; the old value keeps being served
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background refresh of %s failed", self.name, exc_info=task.exception())
+
+    async def _compute(self, key: Hashable, compute, trigger: str) -> Any:
+        generation = self._generation
+        try:
+            value = await compute()
+        except Exception:
+            CACHE_REFRESHES.inc(cache=self.name, trigger=trigger, result="error")
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        CACHE_REFRESHES.inc(cache=self.name, trigger=trigger, result="ok")
+        with self._lock:
+            # A write invalidated the cache while this ran; the value may
+            # predate it, so hand it to the waiters without storing it
+            if generation == self._generation:
+                self._entries.pop(key, None)
+                self._entries[key] = (time.monotonic(), value)
+                if self.max_entries is not None:
+                    while len(self._entries) > self.max_entries:
+                        del self._entries[next(iter(self._entries))]
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one entry, or every entry when no key is given"""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+def _write_pattern(tables) -> "re.Pattern[str]":
+    names = "|".join(re.escape(table) for table in tables)
+    return re.compile(
+        r"^\s*(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?|copy)"
+        r"\s+(?:only\s+)?(?:\w+\.)?\"?(?:%s)\"?\b" % names,
+        re.IGNORECASE,
+    )
+
+
+def invalidate_on_write(cache, *tables: str) -> None:
+    """Invalidate cache whenever any engine writes to one of the given tables
+
+    The cache is cleared as soon as the write statement runs and again when the
+    owning transaction commits, so a reader that repopulated the cache from the
+    pre-commit state does not keep serving it for a full TTL.
+    """
+    pattern = _write_pattern(tables)
+    info_key = ("snapshot_cache_dirty", id(cache))
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _mark_dirty(conn, cursor, statement, parameters, context, executemany):
+        if pattern.match(statement):
+            conn.info[info_key] = True
+            cache.invalidate()
+
+    @event.listens_for(Engine, "commit")
+    def _invalidate_on_commit(conn):
+        if conn.info.pop(info_key, False):
+            cache.invalidate()
+
+    @event.listens_for(Engine, "rollback")
+    def _clear_on_rollback(conn):
+        conn.info.pop(info_key, None)
@@ -0,0 +1,233 @@
+# app/cohorts.py
+"""Summaries of many device cohorts in one round trip
+
+A cohort is either an explicit list of device ids or a network/category
+filter over dim_device. All cohorts of a request are first resolved to their
+sorted device keys in one query. Each cohort's summary is cached under a hash
+of that membership, so two cohorts with the same members share an entry
+however they were defined and a cohort whose membership changed is never
+served a stale summary. The cohorts left uncached are summarised together in
+one grouped query over (cohort, device_key) pairs for status counts and
+averages of the latest readings of online devices, and the readings received
+over the last whole hours from agg_device_readings_hourly. Data completeness
+compares those readings with DEVICE_EXPECTED_READINGS_PER_HOUR for every hour
+of the window, each device capped at 100% as /performance does. Uptime comes
+from the hourly presence bitmaps of all those cohorts' devices, loaded once,
+so it is the figure /presence reports for the same devices and window.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import SnapshotCache
+from .latest_readings import ONLINE_SQL
+from .performance import DEVICE_EXPECTED_READINGS_PER_HOUR
+from .presence import PresenceBitmaps, load_presence
+
+COHORT_MAX_COHORTS = int(os.getenv("COHORT_MAX_COHORTS", "200"))
+COHORT_MAX_LISTED_DEVICES = int(os.getenv("COHORT_MAX_LISTED_DEVICES", "20000"))
+COHORT_CACHE_TTL = float(os.getenv("COHORT_CACHE_TTL", "60"))
+
+# Keyed by (membership hash, window start, hours)
+cohort_summary_cache = SnapshotCache(ttl_seconds=COHORT_CACHE_TTL, max_entries=10000)
+
+RESOLVE_COHORTS_SQL = text("""
+    WITH listed AS (
+        SELECT m.cohort, d.device_key, d.device_id
+        FROM unnest(CAST(:list_cohorts AS int[]), CAST(:list_device_ids AS text[])) AS m(cohort, device_id)
+        JOIN dim_device d ON d.device_id = m.device_id
+    ),
+    filtered AS (
+        SELECT f.cohort, d.device_key, d.device_id
+        FROM unnest(
+            CAST(:filter_cohorts AS int[]),
+            CAST(:filter_networks AS text[]),
+            CAST(:filter_categories AS text[])
+        ) AS f(cohort, network, category)
+        JOIN dim_device d
+          ON (f.network IS NULL OR d.network = f.network)
+         AND (f.category IS NULL OR d.category = f.category)
+    )
+    SELECT
+        cohort,
+        array_agg(DISTINCT device_key ORDER BY device_key) AS device_keys,
+        array_agg(DISTINCT device_id) AS device_ids
+    FROM (SELECT * FROM listed UNION ALL SELECT * FROM filtered) members
+    GROUP BY cohort
+""")
+
+COHORT_SUMMARY_SQL = text(f"""
+    WITH members AS (
+        SELECT cohort, device_key
+        FROM unnest(CAST(:cohorts AS int[]), CAST(:device_keys AS int[])) AS m(cohort, device_key)
+    ),
+    hourly AS (
+        SELECT device_key, SUM(reading_count) AS readings
+        FROM agg_device_readings_hourly
+        WHERE device_key IN (SELECT device_key FROM members)
+          AND hour >= :start AND hour < :end
+        GROUP BY device_key
+    )
+    SELECT
+        m.cohort,
+        COUNT(*) AS total_devices,
+        COUNT(*) FILTER (WHERE d.is_active) AS active_devices,
+        COUNT(*) FILTER (WHERE {ONLINE_SQL}) AS online_devices,
+        COUNT(*) FILTER (WHERE NOT {ONLINE_SQL}) AS offline_devices,
+        COUNT(*) FILTER (WHERE d.status = 'deployed') AS deployed_devices,
+        COUNT(*) FILTER (WHERE d.status = 'not deployed') AS not_deployed_devices,
+        COUNT(*) FILTER (WHERE d.status = 'recalled') AS recalled_devices,
+        AVG(lr.pm2_5) FILTER (WHERE {ONLINE_SQL}) AS latest_pm2_5_avg,
+        AVG(lr.pm10) FILTER (WHERE {ONLINE_SQL}) AS latest_pm10_avg,
+        MAX(lr.timestamp) AS last_reading_at,
+        COALESCE(SUM(LEAST(h.readings, :max_readings)), 0) AS readings
+    FROM members m
+    JOIN dim_device d ON d.device_key = m.device_key
+    LEFT JOIN device_latest_reading lr ON lr.device_key = m.device_key
+    LEFT JOIN hourly h ON h.device_key = m.device_key
+    GROUP BY m.cohort
+""")
+
+SUMMARY_COUNTS = (
+    "total_devices", "active_devices", "online_devices", "offline_devices",
+    "deployed_devices", "not_deployed_devices", "recalled_devices",
+)
+
+
+def parse_cohorts(definitions: Sequence[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+    """Validate cohort definitions; raises ValueError with the offending cohort"""
+    if not definitions:
+        raise ValueError("At least one cohort is required")
+    if len(definitions) > COHORT_MAX_COHORTS:
+        raise ValueError(f"At most {COHORT_MAX_COHORTS} cohorts per request")
+
+    cohorts = []
+    listed = 0
+    for i, definition in enumerate(definitions):
+        name = str(definition.get("name") or f"cohort_{i}")
+        device_ids = definition.get("device_ids")
+        network, category = definition.get("network"), definition.get("category")
+        if device_ids is not None:
+            if network is not None or category is not None:
+                raise ValueError(f"{name}: give either device_ids or network/category filters")
+            if not isinstance(device_ids, list) or not all(isinstance(d, str) for d in device_ids):
+                raise ValueError(f"{name}: device_ids must be a list of strings")
+            device_ids = list(dict.fromkeys(device_ids))
+            listed += len(device_ids)
+        elif not isinstance(network, (str, type(None))) or not isinstance(category, (str, type(None))):
+            raise ValueError(f"{name}: network and category must be strings")
+        cohorts.append({"name": name, "device_ids": device_ids, "network": network, "category": category})
+
+    if listed > COHORT_MAX_LISTED_DEVICES:
+        raise ValueError(f"At most {COHORT_MAX_LISTED_DEVICES} listed devices per request")
+    return cohorts
+
+
+def membership_hash(device_keys: Sequence[int]) -> str:
+    return hashlib.sha256(",".join(map(str, device_keys)).encode("ascii")).hexdigest()
+
+
+def completeness_window(hours: int, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """The last `hours` whole UTC hours, ending where the current hour starts"""
+    end = (now or datetime.now(timezone.utc)).replace(minute=0, second=0, microsecond=0)
+    return end - timedelta(hours=hours), end
+
+
+def _empty_summary() -> Dict[str, Any]:
+    return {
+        **dict.fromkeys(SUMMARY_COUNTS, 0),
+        "latest_pm2_5_avg": None,
+        "latest_pm10_avg": None,
+        "last_reading_at": None,
+        "uptime": None,
+        "data_completeness": None,
+    }
+
+
+def _summary(row, presence: PresenceBitmaps) -> Dict[str, Any]:
+    uptime = presence.uptime()
+    expected = row.total_devices * presence.hours * DEVICE_EXPECTED_READINGS_PER_HOUR
+    return {
+        **{name: getattr(row, name) for name in SUMMARY_COUNTS},
+        "latest_pm2_5_avg": None if row.latest_pm2_5_avg is None else round(float(row.latest_pm2_5_avg), 2),
+        "latest_pm10_avg": None if row.latest_pm10_avg is None else round(float(row.latest_pm10_avg), 2),
+        "last_reading_at": row.last_reading_at,
+        "uptime": round(sum(uptime.values()) / len(uptime), 2),
+        "data_completeness": round(float(row.readings) / expected * 100, 2),
+    }
+
+
+def _resolve_params(cohorts: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """RESOLVE_COHORTS_SQL parameters, cohorts numbered by position"""
+    params: Dict[str, List[Any]] = {
+        "list_cohorts": [], "list_device_ids": [],
+        "filter_cohorts": [], "filter_networks": [], "filter_categories": [],
+    }
+    for i, cohort in enumerate(cohorts):
+        if cohort["device_ids"] is not None:
+            params["list_cohorts"].extend([i] * len(cohort["device_ids"]))
+            params["list_device_ids"].extend(cohort["device_ids"])
+        else:
+            params["filter_cohorts"].append(i)
+            params["filter_networks"].append(cohort["network"])
+            params["filter_categories"].append(cohort["category"])
+    return params
+
+
+async def summarise_cohorts(db: AsyncSession, cohorts: List[Dict[str, Any]], hours: int) -> Dict[str, Any]:
+    """Summary of each parsed cohort over the last `hours` whole hours"""
+    start, end = completeness_window(hours)
+    members = {
+        row.cohort: row
+        for row in (await db.execute(RESOLVE_COHORTS_SQL, _resolve_params(cohorts))).fetchall()
+    }
+
+    summaries: Dict[int, Dict[str, Any]] = {}
+    keys: Dict[int, Tuple[str, datetime, int]] = {}
+    for i in range(len(cohorts)):
+        if i not in members:
+            summaries[i] = _empty_summary()
+            continue
+        keys[i] = (membership_hash(members[i].device_keys), start, hours)
+        cached = cohort_summary_cache.get(keys[i])
+        if cached is not None:
+            summaries[i] = cached
+
+    # Cohorts with identical members are computed once
+    missing: Dict[Tuple[str, datetime, int], int] = {}
+    for i, key in keys.items():
+        if i not in summaries:
+            missing.setdefault(key, i)
+    if missing:
+        cohort_index = list(missing.values())
+        rows = (await db.execute(COHORT_SUMMARY_SQL, {
+            "cohorts": [i for i in cohort_index for _ in members[i].device_keys],
+            "device_keys": [key for i in cohort_index for key in members[i].device_keys],
+            "start": start,
+            "end": end,
+            "max_readings": hours * DEVICE_EXPECTED_READINGS_PER_HOUR,
+        })).fetchall()
+        device_ids = sorted({device_id for i in cohort_index for device_id in members[i].device_ids})
+        presence = await load_presence(db, start, end, device_ids=device_ids)
+        computed = {
+            keys[row.cohort]: _summary(row, presence.subset(members[row.cohort].device_ids))
+            for row in rows
+        }
+        for key, summary in computed.items():
+            cohort_summary_cache.set(key, summary)
+        for i, key in keys.items():
+            if i not in summaries:
+                summaries[i] = computed[key]
+
+    results = []
+    for i, cohort in enumerate(cohorts):
+        result = {"name": cohort["name"], **summaries[i]}
+        if cohort["device_ids"] is not None:
+            found = set(members[i].device_ids) if i in members else set()
+            result["not_found"] = [name for name in cohort["device_ids"] if name not in found]
+        results.append(result)
+    return {"window_start": start, "window_end": end, "cohorts": results}
@@ -0,0 +1,293 @@
+# app/device_feed.py
+"""Shared change feed behind /api/devices/stream
+
+A single watcher task polls the device state and new failure events every
+DEVICE_FEED_POLL_SECONDS while at least one subscriber is connected, diffs
+them against the previous poll and fans the resulting delta out to every
+subscriber queue. Database load therefore depends on the poll interval, not
+on the number of open dashboards.
+
+Subscribers first receive a snapshot of the current state, then deltas with
+per-device status transitions, fleet count changes and failure events. A
+subscriber that falls DEVICE_FEED_QUEUE_SIZE events behind has its backlog
+replaced by a fresh snapshot instead of holding the others back.
+
+Failure events are read in (timestamp, device_key) order from a window that
+starts DEVICE_FEED_LATE_SECONDS before the newest event already sent, so
+events committed late, or sharing a timestamp with the last page, are still
+picked up; the events already sent from that window are excluded by key. A
+client whose feed has not produced its first snapshot within
+DEVICE_FEED_READY_SECONDS gets an ``error`` event instead of hanging.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from .http_cache import json_default
+from .latest_readings import ONLINE_SQL
+from .rollups import FAILURE_CATEGORY_SQL
+
+logger = logging.getLogger(__name__)
+
+DEVICE_FEED_POLL_SECONDS = float(os.getenv("DEVICE_FEED_POLL_SECONDS", "5"))
+DEVICE_FEED_QUEUE_SIZE = int(os.getenv("DEVICE_FEED_QUEUE_SIZE", "100"))
+DEVICE_FEED_KEEPALIVE_SECONDS = float(os.getenv("DEVICE_FEED_KEEPALIVE_SECONDS", "15"))
+DEVICE_FEED_LATE_SECONDS = float(os.getenv("DEVICE_FEED_LATE_SECONDS", "300"))
+DEVICE_FEED_READY_SECONDS = float(os.getenv("DEVICE_FEED_READY_SECONDS", "30"))
+DEVICE_FEED_FAILURE_BATCH = 1000
+
+# Only fields whose changes are worth pushing; last-seen moves with every
+# reading and is left to /list
+DEVICE_STATE_SQL = text(f"""
+    SELECT
+        d.device_id,
+        d.network,
+        d.category,
+        d.status,
+        d.is_active,
+        {ONLINE_SQL} AS is_online
+    FROM dim_device d
+    LEFT JOIN device_latest_reading lr ON lr.device_key = d.device_key
+""")
+
+# Failure events after :since, minus the (device_key, timestamp, status)
+# triples already sent
+NEW_FAILURES_SQL = text(f"""
+    SELECT s.device_key, d.device_id, s.timestamp, s.device_status, s.failure_category
+    FROM (
+        SELECT device_key, timestamp, device_status,{FAILURE_CATEGORY_SQL} AS failure_category
+        FROM fact_device_status
+        WHERE timestamp > :since
+    ) s
+    JOIN dim_device d ON d.device_key = s.device_key
+    WHERE s.failure_category IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1
+          FROM unnest(
+              CAST(:sent_keys AS int[]),
+              CAST(:sent_timestamps AS timestamptz[]),
+              CAST(:sent_statuses AS text[])
+          ) AS sent(device_key, timestamp, device_status)
+          WHERE sent.device_key = s.device_key
+            AND sent.timestamp = s.timestamp
+            AND sent.device_status IS NOT DISTINCT FROM s.device_status
+      )
+    ORDER BY s.timestamp, s.device_key
+    LIMIT :limit
+""")
+
+FAILURE_FIELDS = ("device_id", "timestamp", "device_status", "failure_category")
+
+STATE_FIELDS = ("network", "category", "status", "is_active", "is_online")
+
+
+def device_counts(devices: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Fleet-wide counters matching the /stats payload"""
+    counts = dict.fromkeys((
+        "total_devices", "active_devices", "online_devices", "offline_devices",
+        "deployed_devices", "not_deployed_devices", "recalled_devices",
+    ), 0)
+    for device in devices:
+        counts["total_devices"] += 1
+        counts["active_devices"] += bool(device["is_active"])
+        counts["online_devices" if device["is_online"] else "offline_devices"] += 1
+        if device["status"] == "deployed":
+            counts["deployed_devices"] += 1
+        elif device["status"] == "not deployed":
+            counts["not_deployed_devices"] += 1
+        elif device["status"] == "recalled":
+            counts["recalled_devices"] += 1
+    return counts
+
+
+def diff_devices(previous: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Changed fields per device, plus added and removed devices"""
+    changes = []
+    for device_id, state in current.items():
+        before = previous.get(device_id)
+        if before is None:
+            changes.append({"device_id": device_id, "added": True, **state})
+        elif before != state:
+            changes.append({
+                "device_id": device_id,
+                **{name: state[name] for name in STATE_FIELDS if before[name] != state[name]},
+            })
+    changes.extend(
+        {"device_id": device_id, "removed": True}
+        for device_id in previous if device_id not in current
+    )
+    return changes
+
+
+def encode_event(event: str, payload: Dict[str, Any], sequence: int) -> str:
+    data = json.dumps(payload, default=json_default, separators=(",", ":"))
+    return f"id: {sequence}\nevent: {event}\ndata: {data}\n\n"
+
+
+class DeviceChangeFeed:
+    """One polling watcher fanned out to any number of subscriber queues"""
+
+    def __init__(self, engine=None, poll_seconds: float = DEVICE_FEED_POLL_SECONDS):
+        self._engine = engine
+        self.poll_seconds = poll_seconds
+        self.sequence = 0
+        self._reset()
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._waiting = 0
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def _reset(self) -> None:
+        """Forget the watched state, so the next poll is a first poll again"""
+        self.polls = 0
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        # Failures before _failures_start are history and never replayed;
+        # _sent_failures holds the keys sent from the late window
+        self._failures_start = None
+        self._failures_latest = None
+        self._sent_failures: Set[Tuple[Any, ...]] = set()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from .async_database import async_engine
+            self._engine = async_engine
+        return self._engine
+
+    def snapshot(self) -> str:
+        devices = [{"device_id": device_id, **state} for device_id, state in sorted(self._devices.items())]
+        return encode_event("snapshot", {
+            "stats": device_counts(self._devices.values()),
+            "devices": devices,
+        }, self.sequence)
+
+    async def subscribe(self) -> asyncio.Queue:
+        """Register a subscriber whose queue starts with a snapshot
+
+        Raises asyncio.TimeoutError if the watcher has not completed a poll
+        within DEVICE_FEED_READY_SECONDS.
+        """
+        if self._task is None or self._task.done():
+            # Whatever happened while nobody watched is history, not a delta
+            self._reset()
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=DEVICE_FEED_READY_SECONDS)
+        finally:
+            self._waiting -= 1
+            if not self._ready.is_set():
+                self._stop_if_idle()
+        # Snapshot and registration happen without yielding to the loop, so
+        # no delta can slip in ahead of the snapshot
+        queue: asyncio.Queue = asyncio.Queue(maxsize=DEVICE_FEED_QUEUE_SIZE)
+        queue.put_nowait(self.snapshot())
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+        self._stop_if_idle()
+
+    def _stop_if_idle(self) -> None:
+        if not self._subscribers and not self._waiting and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def events(self, request) -> AsyncIterator[str]:
+        """Server-sent events for one client until it disconnects"""
+        try:
+            queue = await self.subscribe()
+        except asyncio.TimeoutError:
+            # The response has already started, so the failure goes in-band
+            yield encode_event("error", {"detail": "Device feed is unavailable, retry later"}, self.sequence)
+            return
+        try:
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=DEVICE_FEED_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+                self._ready.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Device change feed poll failed")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def poll(self) -> None:
+        """Read the current state once and broadcast what changed"""
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(DEVICE_STATE_SQL)).fetchall()
+            if self._failures_start is None:
+                # History is not replayed; only failures after the first poll
+                self._failures_start = (await conn.execute(text("SELECT now()"))).scalar()
+                self._failures_latest = self._failures_start
+                failures = []
+            else:
+                since = max(self._failures_start, self._failures_latest - timedelta(seconds=DEVICE_FEED_LATE_SECONDS))
+                self._sent_failures = {key for key in self._sent_failures if key[1] > since}
+                sent = list(self._sent_failures)
+                failures = (await conn.execute(NEW_FAILURES_SQL, {
+                    "since": since,
+                    "sent_keys": [key[0] for key in sent],
+                    "sent_timestamps": [key[1] for key in sent],
+                    "sent_statuses": [key[2] for key in sent],
+                    "limit": DEVICE_FEED_FAILURE_BATCH,
+                })).fetchall()
+        self.polls += 1
+
+        current = {row.device_id: {name: getattr(row, name) for name in STATE_FIELDS} for row in rows}
+        previous, self._devices = self._devices, current
+        if self.polls == 1:
+            return
+
+        changes = diff_devices(previous, current)
+        before, after = device_counts(previous.values()), device_counts(current.values())
+        count_deltas = {name: after[name] - before[name] for name in after if after[name] != before[name]}
+        for row in failures:
+            self._sent_failures.add((row.device_key, row.timestamp, row.device_status))
+        if failures:
+            self._failures_latest = max(self._failures_latest, failures[-1].timestamp)
+        if not (changes or failures):
+            return
+
+        self.sequence += 1
+        self._broadcast(encode_event("delta", {
+            "devices": changes,
+            "counts": count_deltas,
+            "stats": after,
+            "failures": [{name: getattr(row, name) for name in FAILURE_FIELDS} for row in failures],
+        }, self.sequence))
+
+    def _broadcast(self, message: str) -> None:
+        snapshot = None
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: its backlog is stale anyway, resync it
+                while not queue.empty():
+                    queue.get_nowait()
+                snapshot = snapshot or self.snapshot()
+                queue.put_nowait(snapshot)
+
+
+device_feed = DeviceChangeFeed()
@@ -0,0 +1,213 @@
+# app/device_map.py
+"""Viewport queries over device locations for the map
+
+DeviceLocationIndex keeps every located device in NumPy arrays sorted by a
+MAP_INDEX_CELL_DEGREES grid cell. A bounding box maps to one contiguous slice
+of the sorted arrays per grid row, so a viewport touches only the devices in
+the cells it overlaps, not the whole fleet.
+
+Above MAP_MAX_POINTS devices in view and below MAP_CLUSTER_MAX_ZOOM the
+devices are aggregated into clusters on a grid of MAP_CLUSTER_CELLS_PER_TILE
+cells per web-map tile at the requested zoom, each with its device count,
+centroid, extent and status mix. Payload size therefore follows what is on
+screen rather than the fleet size.
+
+The index is rebuilt from dim_location and device_latest_reading at most
+every MAP_INDEX_TTL seconds, by a single task shared by concurrent requests.
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from .cache import SingleFlight, invalidate_on_write
+from .latest_readings import ONLINE_SQL
+
+MAP_INDEX_TTL = float(os.getenv("MAP_INDEX_TTL", "60"))
+MAP_INDEX_CELL_DEGREES = float(os.getenv("MAP_INDEX_CELL_DEGREES", "1.0"))
+MAP_MAX_POINTS = int(os.getenv("MAP_MAX_POINTS", "500"))
+MAP_CLUSTER_MAX_ZOOM = int(os.getenv("MAP_CLUSTER_MAX_ZOOM", "14"))
+MAP_CLUSTER_CELLS_PER_TILE = int(os.getenv("MAP_CLUSTER_CELLS_PER_TILE", "4"))
+MAP_MAX_ZOOM = 22
+
+DEVICE_STATUSES = ("deployed", "not deployed", "recalled")
+
+# One location per device: the most recently added
+DEVICE_LOCATIONS_SQL = text(f"""
+    SELECT
+        d.device_id,
+        d.device_name,
+        d.status,
+        {ONLINE_SQL} AS is_online,
+        l.latitude,
+        l.longitude
+    FROM dim_device d
+    JOIN (
+        SELECT DISTINCT ON (device_key) device_key, latitude, longitude
+        FROM dim_location
+        WHERE latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180
+        ORDER BY device_key, location_key DESC
+    ) l ON l.device_key = d.device_key
+    LEFT JOIN device_latest_reading lr ON lr.device_key = d.device_key
+""")
+
+
+class DeviceLocationIndex:
+    """Grid-sorted arrays of device positions and statuses"""
+
+    def __init__(self, rows, cell_degrees: float = MAP_INDEX_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.columns = int(np.ceil(360 / cell_degrees))
+        self.rows_count = int(np.ceil(180 / cell_degrees))
+
+        latitude = np.array([row.latitude for row in rows], dtype=np.float64)
+        longitude = np.array([row.longitude for row in rows], dtype=np.float64)
+        cells = self._cell(latitude, longitude)
+        order = np.argsort(cells, kind="stable")
+
+        self.cells = cells[order]
+        self.latitude = latitude[order]
+        self.longitude = longitude[order]
+        self.device_id = np.array([row.device_id for row in rows], dtype=object)[order]
+        self.device_name = np.array([row.device_name for row in rows], dtype=object)[order]
+        self.is_online = np.array([bool(row.is_online) for row in rows], dtype=bool)[order]
+        status_index = {status: i for i, status in enumerate(DEVICE_STATUSES)}
+        # len(DEVICE_STATUSES) stands for any other or missing status
+        self.status = np.array(
+            [status_index.get(row.status, len(DEVICE_STATUSES)) for row in rows], dtype=np.int8
+        )[order]
+
+    def __len__(self) -> int:
+        return self.cells.size
+
+    def _cell_row(self, latitude):
+        return np.clip(np.floor((latitude + 90) / self.cell_degrees), 0, self.rows_count - 1).astype(np.int64)
+
+    def _cell_column(self, longitude):
+        return np.clip(np.floor((longitude + 180) / self.cell_degrees), 0, self.columns - 1).astype(np.int64)
+
+    def _cell(self, latitude, longitude):
+        return self._cell_row(latitude) * self.columns + self._cell_column(longitude)
+
+    def query(self, west: float, south: float, east: float, north: float) -> np.ndarray:
+        """Positions of the devices inside the box; west > east crosses the antimeridian"""
+        if west > east:
+            return np.concatenate((self.query(west, south, 180.0, north), self.query(-180.0, south, east, north)))
+
+        first_row, last_row = int(self._cell_row(south)), int(self._cell_row(north))
+        first_column, last_column = int(self._cell_column(west)), int(self._cell_column(east))
+        rows = np.arange(first_row, last_row + 1) * self.columns
+        starts = np.searchsorted(self.cells, rows + first_column, side="left")
+        stops = np.searchsorted(self.cells, rows + last_column, side="right")
+        candidates = np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)] or [np.empty(0, np.int64)])
+
+        latitude, longitude = self.latitude[candidates], self.longitude[candidates]
+        inside = (latitude >= south) & (latitude <= north) & (longitude >= west) & (longitude <= east)
+        return candidates[inside]
+
+    def points(self, positions: np.ndarray) -> List[Dict[str, Any]]:
+        return [
+            {
+                "device_id": self.device_id[i],
+                "device_name": self.device_name[i],
+                "latitude": float(self.latitude[i]),
+                "longitude": float(self.longitude[i]),
+                "status": DEVICE_STATUSES[self.status[i]] if self.status[i] < len(DEVICE_STATUSES) else None,
+                "is_online": bool(self.is_online[i]),
+            }
+            for i in positions.tolist()
+        ]
+
+    def clusters(self, positions: np.ndarray, zoom: int) -> List[Dict[str, Any]]:
+        """Aggregate positions on a grid of MAP_CLUSTER_CELLS_PER_TILE cells per tile"""
+        size = 360 / (2 ** zoom) / MAP_CLUSTER_CELLS_PER_TILE
+        latitude, longitude = self.latitude[positions], self.longitude[positions]
+        keys = np.stack((np.floor(latitude / size), np.floor(longitude / size)), axis=1)
+        _, group, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        group = group.reshape(-1)
+        groups = counts.size
+
+        online = np.bincount(group, weights=self.is_online[positions], minlength=groups)
+        status_counts = np.zeros((groups, len(DEVICE_STATUSES) + 1), dtype=np.int64)
+        np.add.at(status_counts, (group, self.status[positions]), 1)
+        extent = np.empty((groups, 4))
+        extent[:, 0], extent[:, 1] = np.inf, np.inf
+        extent[:, 2], extent[:, 3] = -np.inf, -np.inf
+        np.minimum.at(extent[:, 0], group, longitude)
+        np.minimum.at(extent[:, 1], group, latitude)
+        np.maximum.at(extent[:, 2], group, longitude)
+        np.maximum.at(extent[:, 3], group, latitude)
+        centre_latitude = np.bincount(group, weights=latitude, minlength=groups) / counts
+        centre_longitude = np.bincount(group, weights=longitude, minlength=groups) / counts
+
+        # A cluster of one is sent as the device itself
+        member = np.empty(groups, dtype=np.int64)
+        member[group] = positions
+        singles = dict(zip(np.flatnonzero(counts == 1).tolist(), self.points(member[counts == 1])))
+        return [
+            {"type": "device", **singles[g]} if g in singles else {
+                "type": "cluster",
+                "count": int(counts[g]),
+                "latitude": round(float(centre_latitude[g]), 6),
+                "longitude": round(float(centre_longitude[g]), 6),
+                "bbox": [round(float(value), 6) for value in extent[g]],
+                "online": int(online[g]),
+                "offline": int(counts[g] - online[g]),
+                "status": {
+                    **{name: int(status_counts[g, i]) for i, name in enumerate(DEVICE_STATUSES)},
+                    "other": int(status_counts[g, -1]),
+                },
+            }
+            for g in range(groups)
+        ]
+
+    def viewport(self, west: float, south: float, east: float, north: float, zoom: int,
+                 cluster: Optional[bool] = None) -> Dict[str, Any]:
+        """Devices in the box, or clusters of them when there are too many"""
+        positions = self.query(west, south, east, north)
+        if cluster is None:
+            cluster = positions.size > MAP_MAX_POINTS and zoom < MAP_CLUSTER_MAX_ZOOM
+        body: Dict[str, Any] = {
+            "bbox": [west, south, east, north],
+            "zoom": zoom,
+            "total": int(positions.size),
+            "clustered": bool(cluster),
+        }
+        if cluster:
+            body["features"] = self.clusters(positions, zoom)
+        else:
+            body["features"] = [{"type": "device", **point} for point in self.points(positions)]
+        return body
+
+
+async def _build_index() -> DeviceLocationIndex:
+    from .async_database import read_session
+
+    async with read_session() as session:
+        rows = (await session.execute(DEVICE_LOCATIONS_SQL)).fetchall()
+    return DeviceLocationIndex(rows)
+
+
+# Rebuilt on device and location writes; online flags age with the TTL
+device_map_index = SingleFlight(
+    "device_map_index", ttl_seconds=MAP_INDEX_TTL, stale_seconds=MAP_INDEX_TTL * 5
+)
+invalidate_on_write(device_map_index, "dim_device", "dim_location")
+
+
+async def get_device_map_index() -> DeviceLocationIndex:
+    return await device_map_index.get("index", _build_index)
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """west,south,east,north in degrees; raises ValueError"""
+    try:
+        west, south, east, north = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north")
+    if not (-90 <= south <= north <= 90):
+        raise ValueError("bbox latitudes must satisfy -90 <= south <= north <= 90")
+    if not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox longitudes must be within -180..180")
+    return west, south, east, north
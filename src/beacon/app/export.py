@@ -0,0 +1,185 @@
+# app/export.py
+"""Columnar export of device readings as Arrow IPC streams or Parquet
+
+Rows are read from a server-side cursor in chunks of EXPORT_CHUNK_ROWS and
+each chunk becomes one Arrow record batch (one Parquet row group), so memory
+stays bounded by the chunk size whatever the range requested. Output is
+produced incrementally and can be streamed straight into an HTTP response.
+
+CLI::
+
+    python -m app.export --start 2025-01-01 --end 2025-04-01 \\
+        --network airqo --format parquet --output readings.parquet
+"""
+import argparse
+import io
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "65536"))
+
+EXPORT_FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Exportable columns: SQL expression and Arrow type
+EXPORT_COLUMNS = {
+    "device_key": ("r.device_key", pa.int32()),
+    "device_id": ("d.device_id", pa.string()),
+    "device_name": ("d.device_name", pa.string()),
+    "network": ("d.network", pa.string()),
+    "category": ("d.category", pa.string()),
+    "timestamp": ("r.timestamp", pa.timestamp("us", tz="UTC")),
+    "pm2_5": ("r.pm2_5::double precision", pa.float64()),
+    "pm10": ("r.pm10::double precision", pa.float64()),
+    "battery_voltage": ("r.battery_voltage::double precision", pa.float64()),
+}
+
+DEFAULT_EXPORT_COLUMNS = ["device_id", "network", "category", "timestamp", "pm2_5", "pm10", "battery_voltage"]
+
+
+def export_schema(columns: Sequence[str]) -> pa.Schema:
+    return pa.schema([(name, EXPORT_COLUMNS[name][1]) for name in columns])
+
+
+def build_export_query(
+    columns: Sequence[str],
+    start: datetime,
+    end: datetime,
+    device_ids: Optional[List[str]] = None,
+    network: Optional[str] = None,
+    category: Optional[str] = None,
+):
+    """Readings joined to dim_device for the given filters, in no particular order"""
+    unknown = [name for name in columns if name not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+    select_list = ", ".join(f"{EXPORT_COLUMNS[name][0]} AS {name}" for name in columns)
+    sql = f"""
+        SELECT {select_list}
+        FROM fact_device_readings r
+        JOIN dim_device d ON d.device_key = r.device_key
+        WHERE r.timestamp >= :start AND r.timestamp < :end
+    """
+    params: Dict[str, Any] = {"start": start, "end": end}
+    if device_ids:
+        sql += " AND d.device_id = ANY(:device_ids)"
+        params["device_ids"] = list(device_ids)
+    if network is not None:
+        sql += " AND d.network = :network"
+        params["network"] = network
+    if category is not None:
+        sql += " AND d.category = :category"
+        params["category"] = category
+    return text(sql), params
+
+
+def iter_record_batches(conn, query, params, schema: pa.Schema, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pa.RecordBatch]:
+    """Yield record batches built from a server-side cursor"""
+    result = conn.execution_options(stream_results=True).execute(query, params)
+    while True:
+        rows = result.fetchmany(chunk_rows)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _open_writer(sink, schema: pa.Schema, fmt: str):
+    if fmt == "arrow":
+        return pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema, compression="zstd")
+    raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+
+def encode_batches(batches: Iterator[pa.RecordBatch], schema: pa.Schema, fmt: str) -> Iterator[bytes]:
+    """Encode record batches as an Arrow IPC stream or Parquet file, chunk by chunk"""
+    sink = _ChunkSink()
+    writer = _open_writer(sink, schema, fmt)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def stream_export(engine, columns, start, end, fmt, **filters) -> Iterator[bytes]:
+    """Encoded export of one range on a dedicated connection"""
+    query, params = build_export_query(columns, start, end, **filters)
+    schema = export_schema(columns)
+    with engine.connect() as conn:
+        yield from encode_batches(iter_record_batches(conn, query, params, schema), schema, fmt)
+
+
+def _parse_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Export device readings as Arrow IPC or Parquet")
+    parser.add_argument("--start", required=True, type=_parse_datetime)
+    parser.add_argument("--end", required=True, type=_parse_datetime)
+    parser.add_argument("--device-id", action="append", dest="device_ids")
+    parser.add_argument("--network")
+    parser.add_argument("--category")
+    parser.add_argument("--columns", default=",".join(DEFAULT_EXPORT_COLUMNS))
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="parquet")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    from .database import engine
+
+    columns = [name.strip() for name in args.columns.split(",") if name.strip()]
+    with open(args.output, "wb") as output:
+        for chunk in stream_export(
+            engine, columns, args.start, args.end, args.format,
+            device_ids=args.device_ids, network=args.network, category=args.category,
+        ):
+            output.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
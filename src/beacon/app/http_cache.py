@@ -0,0 +1,212 @@
+# app/http_cache.py
+"""Conditional GET and pre-compressed response caching for JSON endpoints
+
+A cached entry is keyed by route and normalised query parameters and is valid
+while the data version of the tables it was built from is unchanged and its
+per-route TTL has not elapsed. The data version is the sum of the insert,
+update and delete counters PostgreSQL keeps in pg_stat_user_tables, so
+checking it is one catalog read instead of re-running the endpoint query.
+Those counters are not replicated, so the version is always read on the
+primary, together with the primary's WAL position. A route that builds its
+body on a replica passes that position to read_session(min_lsn=...), so the
+body is built from a replica that has replayed at least the writes the
+version counts, or else from the primary.
+
+ETags are weak hashes of the JSON body: a poll carrying a matching
+If-None-Match gets a bodyless 304, anything else gets the cached body in the
+best encoding the client accepts (brotli when the brotli package is
+installed, then gzip, then identity).
+
+Per-route TTLs default to ROUTE_CACHE_TTLS and can be overridden with
+RESPONSE_CACHE_TTL_<ROUTE> environment variables, e.g.
+RESPONSE_CACHE_TTL_DEVICES_STATS=30.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import text
+
+from .async_database import async_engine
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+
+# Seconds a cached body may be served while its data version is unchanged.
+# Last-seen values from device_latest_reading are deliberately left out of the
+# data version (ingestion writes it constantly), so these TTLs bound their age
+ROUTE_CACHE_TTLS = {
+    "devices_stats": 60,
+    "devices_list": 60,
+    "devices_failures": 300,
+    "readings_heatmap": 300,
+    "devices_health": 300,
+    "devices_completeness": 300,
+}
+
+DATA_VERSION_SQL = text("""
+    SELECT
+        COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)::bigint AS changes,
+        (pg_current_wal_lsn() - '0/0'::pg_lsn)::bigint AS lsn
+    FROM pg_stat_user_tables
+    WHERE relname = ANY(:tables) OR relname LIKE ANY(:partitions)
+""")
+
+
+class DataVersion(NamedTuple):
+    """Change counter of a set of tables and the primary WAL position it was read at
+
+    Only changes identifies cached entries; lsn moves with every write to
+    any table and is the position a replica must have replayed to build one.
+    """
+    changes: int
+    lsn: int
+
+
+def json_default(value):
+    """json.dumps fallback for values the database driver returns"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def route_ttl(route: str) -> float:
+    override = os.getenv(f"RESPONSE_CACHE_TTL_{route.upper()}")
+    if override is not None:
+        return float(override)
+    return ROUTE_CACHE_TTLS.get(route, 60)
+
+
+class CachedBody:
+    """A serialised response body with its pre-compressed variants"""
+
+    __slots__ = ("version", "expires_at", "etag", "identity", "gzip", "br", "headers")
+
+    def __init__(self, payload: Any, version: Hashable, ttl: float, headers: Mapping[str, str]):
+        body = json.dumps(payload, default=json_default, separators=(",", ":")).encode("utf-8")
+        self.version = version
+        self.expires_at = time.monotonic() + ttl
+        self.etag = 'W/"%s"' % hashlib.sha1(body).hexdigest()
+        self.identity = body
+        self.gzip = gzip.compress(body, compresslevel=6)
+        self.br = brotli.compress(body, quality=5) if brotli is not None else None
+        self.headers = dict(headers)
+
+    def encoded(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        accepted = {
+            token.split(";")[0].strip().lower()
+            for token in accept_encoding.split(",")
+            if token.strip() and not token.strip().endswith("q=0")
+        }
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+class ResponseCache:
+    """Bounded LRU of CachedBody entries keyed by route and parameters"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Hashable) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.version != version or entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, entry: CachedBody) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+async def data_version(tables: Iterable[str]) -> DataVersion:
+    """Change counter over tables and their range partitions, read on the primary"""
+    tables = list(tables)
+    async with async_engine.connect() as conn:
+        result = await conn.execute(
+            DATA_VERSION_SQL,
+            {"tables": tables, "partitions": [f"{table}\\_p%" for table in tables]}
+        )
+        return DataVersion(*result.one())
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: ignore W/ prefixes on either side
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+async def cached_json_response(
+    request: Request,
+    route: str,
+    tables: Iterable[str],
+    build: Callable[[DataVersion], Awaitable[Tuple[Any, Dict[str, str]]]],
+) -> Response:
+    """Serve build(version)'s JSON payload with ETag/304 handling and compression
+
+    build receives the data version the entry will be stored under and
+    returns the payload and any extra headers to cache alongside it. Any
+    cache build consults must be keyed on version.changes too, or a body
+    computed before a write can be stored under the version after it, and
+    replica reads must pass min_lsn=version.lsn to read_session.
+    """
+    key = (route, tuple(sorted(request.query_params.multi_items())))
+    version = await data_version(tables)
+
+    entry = response_cache.get(key, version.changes)
+    if entry is None:
+        payload, headers = await build(version)
+        entry = CachedBody(payload, version.changes, route_ttl(route), headers)
+        response_cache.put(key, entry)
+
+    headers = {
+        **entry.headers,
+        "ETag": entry.etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = entry.encoded(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
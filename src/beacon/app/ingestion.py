@@ -0,0 +1,316 @@
+# app/ingestion.py
+"""Bulk ingestion of device readings into fact_device_readings
+
+Readings are validated in Python, written to a session-local staging table
+with PostgreSQL COPY and merged into fact_device_readings in one
+INSERT ... SELECT per batch, which also advances device_latest_reading and
+sets the batch's hours in the presence bitmaps. Each batch is committed on its
+own so a bad batch does not discard the ones before it, and each reports how
+many rows were accepted, skipped as duplicates or rejected.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .latest_readings import UPSERT_LATEST_SUFFIX, ensure_latest_table
+from .presence import UPSERT_PRESENCE_SQL, ensure_presence_table
+from .rollups import MARK_DIRTY_HOURS_SQL, ensure_dirty_hours_table
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50000"))
+
+# Rejection reasons kept per batch; the counts are always exact
+MAX_REPORTED_ERRORS = 20
+
+CONFLICT_MODES = ("ignore", "update")
+
+# Engines whose side tables already exist, so the DDL stays off the per-batch path
+_prepared_engines: Set[Any] = set()
+_prepared_lock = threading.Lock()
+
+STAGING_COLUMNS = ("device_key", "device_id", "timestamp", "pm2_5", "pm10", "battery_voltage")
+
+# position keeps the order rows were copied in, which the UPDATE that
+# resolves device keys does not preserve physically
+CREATE_STAGING_SQL = text("""
+    CREATE TEMP TABLE IF NOT EXISTS staging_device_readings (
+        device_key INTEGER,
+        device_id TEXT,
+        timestamp TIMESTAMPTZ NOT NULL,
+        pm2_5 DOUBLE PRECISION,
+        pm10 DOUBLE PRECISION,
+        battery_voltage DOUBLE PRECISION,
+        position BIGINT GENERATED ALWAYS AS IDENTITY
+    ) ON COMMIT DELETE ROWS
+""")
+
+COPY_STAGING_SQL = (
+    "COPY staging_device_readings (%s) FROM STDIN WITH (FORMAT csv)" % ", ".join(STAGING_COLUMNS)
+)
+
+# Rows are matched to dim_device by device_key when given, else by device_id;
+# anything that resolves to no device is left with a NULL device_key and
+# counted as rejected. Runs once per batch, so the statements below read
+# resolved keys straight from staging
+RESOLVE_STAGING_SQL = text("""
+    UPDATE staging_device_readings s
+    SET device_key = CASE
+        WHEN s.device_key IS NULL THEN (SELECT d.device_key FROM dim_device d WHERE d.device_id = s.device_id)
+    END
+    WHERE s.device_key IS NULL
+       OR NOT EXISTS (SELECT 1 FROM dim_device d WHERE d.device_key = s.device_key)
+""")
+
+MERGE_IGNORE_SQL = text("""
+    WITH merged AS (
+        INSERT INTO fact_device_readings (device_key, timestamp, pm2_5, pm10, battery_voltage)
+        SELECT device_key, timestamp, pm2_5, pm10, battery_voltage
+        FROM staging_device_readings
+        WHERE device_key IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT
+        (SELECT COUNT(*) FROM staging_device_readings WHERE device_key IS NULL) AS unknown_devices,
+        (SELECT COUNT(*) FROM merged) AS inserted,
+        0 AS updated
+""")
+
+# ON CONFLICT DO UPDATE cannot touch the same row twice in one statement, so
+# in-batch duplicates are collapsed first (last one in the batch wins)
+MERGE_UPDATE_SQL = text("""
+    WITH deduplicated AS (
+        SELECT DISTINCT ON (device_key, timestamp)
+            device_key, timestamp, pm2_5, pm10, battery_voltage
+        FROM staging_device_readings
+        WHERE device_key IS NOT NULL
+        ORDER BY device_key, timestamp, position DESC
+    ),
+    merged AS (
+        INSERT INTO fact_device_readings AS r (device_key, timestamp, pm2_5, pm10, battery_voltage)
+        SELECT device_key, timestamp, pm2_5, pm10, battery_voltage
+        FROM deduplicated
+        ON CONFLICT (device_key, timestamp) DO UPDATE SET
+            pm2_5 = EXCLUDED.pm2_5,
+            pm10 = EXCLUDED.pm10,
+            battery_voltage = EXCLUDED.battery_voltage
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        (SELECT COUNT(*) FROM staging_device_readings WHERE device_key IS NULL) AS unknown_devices,
+        (SELECT COUNT(*) FROM merged WHERE inserted) AS inserted,
+        (SELECT COUNT(*) FROM merged WHERE NOT inserted) AS updated
+""")
+
+
+# Newest staged reading per device; duplicates are harmless because the
+# upsert only ever moves a device's last-seen time forward
+UPDATE_LATEST_SQL = text(f"""
+    INSERT INTO device_latest_reading (device_key, timestamp, pm2_5, pm10, battery_voltage)
+    SELECT DISTINCT ON (device_key) device_key, timestamp, pm2_5, pm10, battery_voltage
+    FROM staging_device_readings
+    WHERE device_key IS NOT NULL
+    ORDER BY device_key, timestamp DESC
+    {UPSERT_LATEST_SUFFIX}
+""")
+
+# Duplicates count too: the hour had a reading either way
+UPDATE_PRESENCE_SQL = text(UPSERT_PRESENCE_SQL.format(readings="staging_device_readings"))
+
+# Hours the hourly rollup has already folded; refreshed again on its next run
+UPDATE_DIRTY_HOURS_SQL = text(MARK_DIRTY_HOURS_SQL.format(readings="staging_device_readings"))
+
+
+def _parse_timestamp(value: Any) -> str:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, str) and value.strip():
+        value = value.strip()
+        try:
+            return datetime.fromtimestamp(float(value), tz=timezone.utc).isoformat()
+        except ValueError:
+            pass
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.isoformat()
+    raise ValueError("missing timestamp")
+
+
+def _parse_number(record: Mapping[str, Any], name: str) -> Optional[float]:
+    value = record.get(name)
+    if value is None or value == "":
+        return None
+    number = float(value)
+    if number != number:
+        return None
+    return number
+
+
+def normalise_reading(record: Mapping[str, Any]) -> tuple:
+    """Validate one reading and return it as a staging row
+
+    Raises ValueError with a short reason when the reading cannot be loaded.
+    """
+    device_key = record.get("device_key")
+    device_id = record.get("device_id")
+    if device_key in (None, ""):
+        device_key = None
+    else:
+        device_key = int(device_key)
+    if device_id in (None, ""):
+        device_id = None
+    if device_key is None and device_id is None:
+        raise ValueError("missing device_key or device_id")
+
+    return (
+        device_key,
+        device_id,
+        _parse_timestamp(record.get("timestamp")),
+        _parse_number(record, "pm2_5"),
+        _parse_number(record, "pm10"),
+        _parse_number(record, "battery_voltage"),
+    )
+
+
+def parse_readings(body: bytes, content_type: str) -> Iterator[Mapping[str, Any]]:
+    """Decode a request body holding a JSON array, NDJSON or CSV readings"""
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    payload = body.decode("utf-8")
+
+    if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        for line in payload.splitlines():
+            if line.strip():
+                yield json.loads(line)
+    elif media_type in ("text/csv", "application/csv"):
+        yield from csv.DictReader(io.StringIO(payload))
+    elif media_type == "application/json":
+        records = json.loads(payload)
+        if not isinstance(records, list):
+            raise ValueError("JSON body must be an array of readings")
+        yield from records
+    else:
+        raise ValueError(f"Unsupported content type: {media_type}")
+
+
+def ensure_ingestion_tables(conn: Connection) -> None:
+    """Create the tables load_batch maintains next to fact_device_readings"""
+    ensure_latest_table(conn)
+    ensure_presence_table(conn)
+    ensure_dirty_hours_table(conn)
+
+
+def prepare_ingestion(engine) -> None:
+    """Run ensure_ingestion_tables once per engine for the life of the process"""
+    with _prepared_lock:
+        if engine in _prepared_engines:
+            return
+        with engine.begin() as conn:
+            ensure_ingestion_tables(conn)
+        _prepared_engines.add(engine)
+
+
+def load_batch(conn: Connection, records: Iterable[Mapping[str, Any]], on_conflict: str = "ignore") -> Dict[str, Any]:
+    """COPY one batch into staging and merge it into fact_device_readings
+
+    Runs inside the caller's transaction. The tables from
+    ensure_ingestion_tables must already exist (see prepare_ingestion).
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"on_conflict must be one of {', '.join(CONFLICT_MODES)}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    received = 0
+    staged = 0
+    invalid = 0
+    errors: List[str] = []
+    for position, record in enumerate(records):
+        received += 1
+        try:
+            writer.writerow(normalise_reading(record))
+            staged += 1
+        except (ValueError, TypeError, AttributeError) as e:
+            invalid += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"row {position}: {e}")
+
+    result = {
+        "received": received,
+        "accepted": 0,
+        "updated": 0,
+        "duplicates": 0,
+        "rejected": invalid,
+        "errors": errors,
+    }
+    if not staged:
+        return result
+
+    conn.execute(CREATE_STAGING_SQL)
+    conn.execute(text("TRUNCATE staging_device_readings"))
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(COPY_STAGING_SQL, buffer)
+    finally:
+        cursor.close()
+
+    conn.execute(RESOLVE_STAGING_SQL)
+    merge_sql = MERGE_UPDATE_SQL if on_conflict == "update" else MERGE_IGNORE_SQL
+    merged = conn.execute(merge_sql).one()
+
+    conn.execute(UPDATE_LATEST_SQL)
+    conn.execute(UPDATE_PRESENCE_SQL)
+    conn.execute(UPDATE_DIRTY_HOURS_SQL)
+
+    result["accepted"] = merged.inserted + merged.updated
+    result["updated"] = merged.updated
+    result["rejected"] = invalid + merged.unknown_devices
+    result["duplicates"] = staged - merged.unknown_devices - merged.inserted - merged.updated
+    if merged.unknown_devices and len(errors) < MAX_REPORTED_ERRORS:
+        errors.append(f"{merged.unknown_devices} rows reference unknown devices")
+    return result
+
+
+def ingest_readings(
+    engine,
+    records: Iterable[Mapping[str, Any]],
+    batch_size: int = INGEST_BATCH_SIZE,
+    on_conflict: str = "ignore",
+) -> Dict[str, Any]:
+    """Load readings in batches, committing each batch separately
+
+    Returns overall totals plus the per-batch reports.
+    """
+    prepare_ingestion(engine)
+    records = iter(records)
+    batches = []
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            break
+        with engine.begin() as conn:
+            report = load_batch(conn, chunk, on_conflict=on_conflict)
+        report["batch"] = len(batches)
+        batches.append(report)
+        logger.debug("Ingested batch %s: %s", report["batch"], report)
+
+    totals = {
+        name: sum(batch[name] for batch in batches)
+        for name in ("received", "accepted", "updated", "duplicates", "rejected")
+    }
+    return {**totals, "batches": batches}
@@ -0,0 +1,286 @@
+# app/instrumentation.py
+"""Request and SQL instrumentation exposed in Prometheus text format
+
+MetricsMiddleware times every request and, through SQLAlchemy engine events,
+counts the statements it sends and the rows they return. Each request is
+attributed to its route template (e.g. /api/devices/list) rather than the raw
+path. Statements slower than SLOW_QUERY_MS are logged with the route that
+issued them. The collected metrics are rendered by render_metrics() and
+served on /metrics by app.routes.metrics.
+
+Wire it up in the application factory with ``instrument_app(app)``.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            '%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(_Metric):
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (per-bucket counts incl. +Inf, sum, count)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+REQUEST_LATENCY = Histogram(
+    "beacon_http_request_duration_seconds",
+    "Request latency by route template",
+    ["method", "route", "status"],
+)
+REQUEST_STATEMENTS = Histogram(
+    "beacon_http_request_sql_statements",
+    "SQL statements executed per request",
+    ["method", "route"],
+    buckets=STATEMENT_BUCKETS,
+)
+REQUEST_ROWS = Histogram(
+    "beacon_http_request_sql_rows",
+    "Rows returned by SQL statements per request",
+    ["method", "route"],
+    buckets=ROW_BUCKETS,
+)
+SQL_DURATION = Histogram(
+    "beacon_sql_statement_duration_seconds",
+    "SQL statement execution time by issuing route",
+    ["route"],
+)
+SLOW_QUERIES = Counter(
+    "beacon_sql_slow_queries_total",
+    "Statements slower than SLOW_QUERY_MS",
+    ["route"],
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "beacon_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+)
+DB_SESSIONS = Counter(
+    "beacon_db_sessions_total",
+    "Request sessions by target (primary, replica, primary_fallback)",
+    ["target"],
+)
+CACHE_LOOKUPS = Counter(
+    "beacon_cache_lookups_total",
+    "Single-flight cache lookups by outcome (hit, stale, coalesced, miss)",
+    ["cache", "outcome"],
+)
+CACHE_REFRESHES = Counter(
+    "beacon_cache_refreshes_total",
+    "Single-flight computations by trigger (miss, stale, ahead) and result",
+    ["cache", "trigger", "result"],
+)
+
+
+class _RequestStats:
+    __slots__ = ("scope", "statements", "rows")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+        self.rows = 0
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the scope once it resolves it
+        return getattr(self.scope.get("route"), "path", None) or "unmatched"
+
+
+_current_request: contextvars.ContextVar[Optional[_RequestStats]] = contextvars.ContextVar(
+    "beacon_current_request", default=None
+)
+
+
+def render_metrics() -> str:
+    """All registered metrics in Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def observe_pool_wait(seconds: float) -> None:
+    POOL_CHECKOUT_WAIT.observe(seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("beacon_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["beacon_query_start"].pop()
+    elapsed = time.perf_counter() - started
+
+    stats = _current_request.get()
+    route = stats.route if stats else "background"
+    SQL_DURATION.observe(elapsed, route=route)
+    if stats is not None:
+        stats.statements += 1
+        # Server-side cursors report -1 until they are exhausted
+        if cursor.rowcount and cursor.rowcount > 0 and cursor.description is not None:
+            stats.rows += cursor.rowcount
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(route=route)
+        logger.warning(
+            "Slow query on %s (%.1f ms): %s",
+            route, elapsed * 1000, " ".join(statement.split())[:500]
+        )
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute does not fire for failed statements
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("beacon_query_start"):
+        conn.info["beacon_query_start"].pop()
+
+
+def listen_engine_events() -> None:
+    """Attach the statement hooks to every engine, sync or async"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL counts per route"""
+
+    def __init__(self, app, exclude_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        stats = _RequestStats(scope)
+        token = _current_request.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            route_path = stats.route
+            method = scope.get("method", "")
+            REQUEST_LATENCY.observe(elapsed, method=method, route=route_path, status=str(status["code"]))
+            REQUEST_STATEMENTS.observe(stats.statements, method=method, route=route_path)
+            REQUEST_ROWS.observe(stats.rows, method=method, route=route_path)
+
+
+def instrument_app(app) -> None:
+    """Install the middleware, engine hooks and /metrics route on app"""
+    from .routes.metrics import router as metrics_router
+
+    listen_engine_events()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
@@ -0,0 +1,86 @@
+# app/latest_readings.py
+"""Last-value store of each device's most recent reading
+
+device_latest_reading holds one row per device and is upserted by ingestion
+with a forward-only condition, so late or replayed batches never move a
+device's last-seen time backwards. Reading it is O(devices) regardless of
+how many readings sit in fact_device_readings.
+
+A device counts as online when its last reading is newer than
+DEVICE_ONLINE_WINDOW_MINUTES.
+
+Populate it for existing data with ``python -m app.latest_readings``.
+"""
+import logging
+import os
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+DEVICE_ONLINE_WINDOW_MINUTES = int(os.getenv("DEVICE_ONLINE_WINDOW_MINUTES", "60"))
+
+# SQL predicate over a device_latest_reading alias "lr"
+ONLINE_SQL = (
+    f"COALESCE(lr.timestamp >= now() - interval '{DEVICE_ONLINE_WINDOW_MINUTES} minutes', FALSE)"
+)
+
+CREATE_LATEST_READING_SQL = text("""
+    CREATE TABLE IF NOT EXISTS device_latest_reading (
+        device_key INTEGER PRIMARY KEY,
+        timestamp TIMESTAMPTZ NOT NULL,
+        pm2_5 DOUBLE PRECISION,
+        pm10 DOUBLE PRECISION,
+        battery_voltage DOUBLE PRECISION,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+""")
+
+# Appended to a SELECT yielding (device_key, timestamp, pm2_5, pm10,
+# battery_voltage); the WHERE on the update keeps it forward-only
+UPSERT_LATEST_SUFFIX = """
+    ON CONFLICT (device_key) DO UPDATE SET
+        timestamp = EXCLUDED.timestamp,
+        pm2_5 = EXCLUDED.pm2_5,
+        pm10 = EXCLUDED.pm10,
+        battery_voltage = EXCLUDED.battery_voltage,
+        updated_at = now()
+    WHERE EXCLUDED.timestamp > device_latest_reading.timestamp
+"""
+
+# One index probe per device on (device_key, timestamp) instead of a scan
+BACKFILL_LATEST_SQL = text(f"""
+    INSERT INTO device_latest_reading (device_key, timestamp, pm2_5, pm10, battery_voltage)
+    SELECT d.device_key, r.timestamp, r.pm2_5, r.pm10, r.battery_voltage
+    FROM dim_device d
+    CROSS JOIN LATERAL (
+        SELECT timestamp, pm2_5, pm10, battery_voltage
+        FROM fact_device_readings
+        WHERE device_key = d.device_key
+        ORDER BY timestamp DESC
+        LIMIT 1
+    ) r
+    {UPSERT_LATEST_SUFFIX}
+""")
+
+
+def ensure_latest_table(conn: Connection) -> None:
+    """Create device_latest_reading if it does not exist"""
+    conn.execute(CREATE_LATEST_READING_SQL)
+
+
+def backfill_latest_readings(conn: Connection) -> int:
+    """Seed device_latest_reading from fact_device_readings"""
+    ensure_latest_table(conn)
+    result = conn.execute(BACKFILL_LATEST_SQL)
+    logger.info("Backfilled latest readings for %s devices", result.rowcount)
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.begin() as conn:
+        backfill_latest_readings(conn)
@@ -0,0 +1,329 @@
+# app/partitions.py
+"""Time-range partitioning and retention for the device fact tables
+
+fact_device_readings and fact_device_status are range-partitioned on their
+timestamp column into monthly or weekly partitions named
+``<table>_pYYYYMMDD`` after the first day they cover. Recent-window queries
+are pruned to the partitions they overlap, and retention becomes a
+DETACH/DROP of whole partitions instead of a large DELETE.
+
+Each table also has a DEFAULT partition, ``<table>_default``, that catches
+rows outside every range (old backfills, clock-skewed devices, or ``ensure``
+not having run), so such rows never fail an insert. Creating a range
+partition moves any of its rows out of the default partition.
+
+Configuration (environment):
+
+    PARTITION_INTERVAL        month or week (default month)
+    PARTITION_PREMAKE         partitions to create ahead of now (default 3)
+    PARTITION_RETENTION_DAYS  keep partitions newer than this, 0 keeps all (default 0)
+    PARTITION_RETENTION_MODE  detach or drop (default detach)
+
+Usage::
+
+    python -m app.partitions migrate   # convert existing tables, copying data
+    python -m app.partitions ensure    # create upcoming partitions
+    python -m app.partitions retain    # detach/drop expired partitions
+"""
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("fact_device_readings", "fact_device_status")
+PARTITION_COLUMN = "timestamp"
+# Tables that get a unique (device_key, timestamp) index, the ingestion
+# conflict target. Status events may legitimately share a timestamp
+UNIQUE_KEY_TABLES = ("fact_device_readings",)
+
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month")
+PARTITION_PREMAKE = int(os.getenv("PARTITION_PREMAKE", "3"))
+PARTITION_RETENTION_DAYS = int(os.getenv("PARTITION_RETENTION_DAYS", "0"))
+PARTITION_RETENTION_MODE = os.getenv("PARTITION_RETENTION_MODE", "detach")
+
+INTERVALS = ("month", "week")
+RETENTION_MODES = ("detach", "drop")
+
+_PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<start>\d{8})$")
+
+
+def period_start(day: date, interval: str) -> date:
+    """First day of the month or ISO week containing day"""
+    if interval == "month":
+        return day.replace(day=1)
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+
+
+def next_period(start: date, interval: str) -> date:
+    """First day of the period following the one starting at start"""
+    if interval == "month":
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=7)
+
+
+def partition_name(table: str, start: date) -> str:
+    return f"{table}_p{start:%Y%m%d}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+class PartitionManager:
+    """Creates, migrates and expires range partitions of one table"""
+
+    def __init__(
+        self,
+        table: str,
+        interval: str = PARTITION_INTERVAL,
+        premake: int = PARTITION_PREMAKE,
+        column: str = PARTITION_COLUMN,
+        unique_key: Optional[bool] = None,
+    ):
+        if interval not in INTERVALS:
+            raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+        self.table = table
+        self.interval = interval
+        self.premake = premake
+        self.column = column
+        self.unique_key = table in UNIQUE_KEY_TABLES if unique_key is None else unique_key
+        self.default_partition = default_partition_name(table)
+
+    def is_partitioned(self, conn: Connection) -> bool:
+        return bool(conn.execute(
+            text("""
+                SELECT 1 FROM pg_partitioned_table p
+                JOIN pg_class c ON c.oid = p.partrelid
+                WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace
+            """),
+            {"table": self.table}
+        ).scalar())
+
+    def existing_partitions(self, conn: Connection) -> List[Tuple[str, date]]:
+        """Attached partitions created by this manager, oldest first"""
+        rows = conn.execute(
+            text("""
+                SELECT child.relname
+                FROM pg_inherits i
+                JOIN pg_class parent ON parent.oid = i.inhparent
+                JOIN pg_class child ON child.oid = i.inhrelid
+                WHERE parent.relname = :table
+            """),
+            {"table": self.table}
+        ).fetchall()
+        partitions = []
+        for (name,) in rows:
+            match = _PARTITION_NAME.match(name)
+            if match and match.group("table") == self.table:
+                partitions.append((name, datetime.strptime(match.group("start"), "%Y%m%d").date()))
+        return sorted(partitions, key=lambda item: item[1])
+
+    def ensure_default_partition(self, conn: Connection) -> Optional[str]:
+        """Create the DEFAULT partition if it does not exist"""
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": self.default_partition}).scalar()
+        if exists:
+            return None
+        conn.execute(text(f"CREATE TABLE {self.default_partition} PARTITION OF {self.table} DEFAULT"))
+        logger.info("Created default partition %s", self.default_partition)
+        return self.default_partition
+
+    def create_partition(self, conn: Connection, start: date) -> Optional[str]:
+        """Create the partition covering the period starting at start
+
+        Rows of that period already in the default partition are moved into
+        it, since PostgreSQL refuses a new range that the default still holds.
+        """
+        end = next_period(start, self.interval)
+        name = partition_name(self.table, start)
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        if exists:
+            return None
+        bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        in_range = f"{self.column} >= :start AND {self.column} < :end"
+
+        has_default = conn.execute(text("SELECT to_regclass(:name)"), {"name": self.default_partition}).scalar()
+        stranded = has_default and conn.execute(
+            text(f"SELECT EXISTS (SELECT 1 FROM {self.default_partition} WHERE {in_range})"),
+            {"start": start, "end": end}
+        ).scalar()
+        if not stranded:
+            conn.execute(text(f"CREATE TABLE {name} PARTITION OF {self.table} {bounds}"))
+            logger.info("Created partition %s [%s, %s)", name, start, end)
+            return name
+
+        conn.execute(text(
+            f"CREATE TABLE {name} "
+            f"(LIKE {self.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)"
+        ))
+        moved = conn.execute(
+            text(f"""
+                WITH moved AS (DELETE FROM {self.default_partition} WHERE {in_range} RETURNING *)
+                INSERT INTO {name} SELECT * FROM moved
+            """),
+            {"start": start, "end": end}
+        ).rowcount
+        conn.execute(text(f"ALTER TABLE {self.table} ATTACH PARTITION {name} {bounds}"))
+        logger.info("Created partition %s [%s, %s) with %s rows from %s", name, start, end, moved, self.default_partition)
+        return name
+
+    def ensure_partitions(self, conn: Connection, since: Optional[date] = None) -> List[str]:
+        """Create missing partitions from since (default: now) through the premake window"""
+        today = datetime.now(timezone.utc).date()
+        start = period_start(since or today, self.interval)
+        last = period_start(today, self.interval)
+        for _ in range(self.premake):
+            last = next_period(last, self.interval)
+
+        created = []
+        if self.ensure_default_partition(conn):
+            created.append(self.default_partition)
+        while start <= last:
+            name = self.create_partition(conn, start)
+            if name:
+                created.append(name)
+            start = next_period(start, self.interval)
+
+        stray = conn.execute(text(f"SELECT COUNT(*) FROM {self.default_partition}")).scalar()
+        if stray:
+            logger.warning("%s rows of %s fall outside every range partition", stray, self.table)
+        return created
+
+    def migrate(self, conn: Connection, keep_legacy: bool = True) -> dict:
+        """Convert a plain table into a partitioned one, copying its rows
+
+        The original table is renamed to <table>_legacy and, unless
+        keep_legacy is False, left in place for verification. Runs in the
+        caller's transaction, which holds an exclusive lock on the table for
+        the duration of the copy.
+        """
+        if self.is_partitioned(conn):
+            return {"table": self.table, "migrated": False, "rows": 0, "duplicates": 0}
+
+        legacy = f"{self.table}_legacy"
+        conn.execute(text(f"LOCK TABLE {self.table} IN ACCESS EXCLUSIVE MODE"))
+        bounds = conn.execute(text(
+            f"SELECT MIN({self.column}), MAX({self.column}) FROM {self.table}"
+        )).one()
+
+        conn.execute(text(f"ALTER TABLE {self.table} RENAME TO {legacy}"))
+        conn.execute(text(
+            f"CREATE TABLE {self.table} "
+            f"(LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+            f"PARTITION BY RANGE ({self.column})"
+        ))
+        # Unique indexes on a partitioned table must contain the partition key;
+        # (device_key, timestamp) is the conflict target used by ingestion
+        if self.unique_key:
+            conn.execute(text(
+                f"CREATE UNIQUE INDEX {self.table}_device_ts_key "
+                f"ON {self.table} (device_key, {self.column})"
+            ))
+        conn.execute(text(
+            f"CREATE INDEX {self.table}_ts_idx ON {self.table} ({self.column} DESC)"
+        ))
+
+        since = bounds[0].date() if bounds[0] is not None else None
+        self.ensure_partitions(conn, since=since)
+        if bounds[1] is not None:
+            # Rows stamped beyond the premake window still need a home
+            start = period_start(since, self.interval)
+            while start <= bounds[1].date():
+                self.create_partition(conn, start)
+                start = next_period(start, self.interval)
+
+        # Duplicate legacy readings keep their first copy instead of failing
+        # the migration; the rest stay in the legacy table for inspection
+        on_conflict = " ON CONFLICT DO NOTHING" if self.unique_key else ""
+        copied = 0
+        for name, start in self.existing_partitions(conn):
+            end = next_period(start, self.interval)
+            result = conn.execute(
+                text(
+                    f"INSERT INTO {self.table} SELECT * FROM {legacy} "
+                    f"WHERE {self.column} >= :start AND {self.column} < :end{on_conflict}"
+                ),
+                {"start": start, "end": end}
+            )
+            copied += result.rowcount
+            logger.info("Copied %s rows into %s", result.rowcount, name)
+
+        legacy_rows = conn.execute(text(f"SELECT COUNT(*) FROM {legacy}")).scalar()
+        duplicates = legacy_rows - copied
+        if duplicates:
+            logger.warning(
+                "Skipped %s duplicate (device_key, %s) rows of %s; they remain in %s",
+                duplicates, self.column, self.table, legacy
+            )
+
+        # Serial defaults were copied by LIKE but their sequences are still
+        # owned by the legacy table; move them so dropping it is safe
+        owned_sequences = conn.execute(
+            text("""
+                SELECT seq.relname, col.attname
+                FROM pg_depend dep
+                JOIN pg_class seq ON seq.oid = dep.objid AND seq.relkind = 'S'
+                JOIN pg_attribute col ON col.attrelid = dep.refobjid AND col.attnum = dep.refobjsubid
+                WHERE dep.refobjid = CAST(:legacy AS regclass) AND dep.deptype = 'a'
+            """),
+            {"legacy": legacy}
+        ).fetchall()
+        for sequence, column in owned_sequences:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {self.table}.{column}"))
+
+        if not keep_legacy and not duplicates:
+            conn.execute(text(f"DROP TABLE {legacy}"))
+        return {"table": self.table, "migrated": True, "rows": copied, "duplicates": duplicates}
+
+    def apply_retention(
+        self,
+        conn: Connection,
+        retention: timedelta,
+        mode: str = PARTITION_RETENTION_MODE,
+    ) -> List[str]:
+        """Detach or drop partitions that end before now - retention"""
+        if mode not in RETENTION_MODES:
+            raise ValueError(f"mode must be one of {', '.join(RETENTION_MODES)}")
+        cutoff = datetime.now(timezone.utc).date() - retention
+
+        expired = []
+        for name, start in self.existing_partitions(conn):
+            if next_period(start, self.interval) > cutoff:
+                continue
+            conn.execute(text(f"ALTER TABLE {self.table} DETACH PARTITION {name}"))
+            if mode == "drop":
+                conn.execute(text(f"DROP TABLE {name}"))
+            logger.info("%s partition %s", "Dropped" if mode == "drop" else "Detached", name)
+            expired.append(name)
+        return expired
+
+
+def run(engine, command: str) -> None:
+    """Run one maintenance command against every partitioned fact table"""
+    for table in PARTITIONED_TABLES:
+        manager = PartitionManager(table)
+        with engine.begin() as conn:
+            if command == "migrate":
+                logger.info("%s", manager.migrate(conn))
+            elif command == "ensure":
+                manager.ensure_partitions(conn)
+            elif command == "retain":
+                if PARTITION_RETENTION_DAYS > 0:
+                    manager.apply_retention(conn, timedelta(days=PARTITION_RETENTION_DAYS))
+            else:
+                raise ValueError(f"Unknown command: {command}")
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    run(engine, sys.argv[1] if len(sys.argv) > 1 else "ensure")
@@ -0,0 +1,144 @@
+# app/performance.py
+"""Uptime, data completeness and reporting interval for a set of devices
+
+One query returns reading counts per device per hour of the window; the
+metrics for every device are then computed together on a devices x hours
+NumPy matrix, so the cost of a fleet-wide request is one index range scan
+and a few array reductions rather than a query per device.
+
+A device-hour counts towards uptime when it holds at least one reading.
+Completeness compares the readings received with
+DEVICE_EXPECTED_READINGS_PER_HOUR for every hour of the window.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEVICE_EXPECTED_READINGS_PER_HOUR = float(os.getenv("DEVICE_EXPECTED_READINGS_PER_HOUR", "30"))
+
+PERFORMANCE_MAX_DEVICES = int(os.getenv("PERFORMANCE_MAX_DEVICES", "500"))
+PERFORMANCE_MAX_WINDOW_DAYS = int(os.getenv("PERFORMANCE_MAX_WINDOW_DAYS", "366"))
+
+HOUR = timedelta(hours=1)
+
+HOURLY_READING_COUNTS_SQL = text("""
+    SELECT
+        d.device_id,
+        FLOOR(EXTRACT(EPOCH FROM r.timestamp - CAST(:start AS TIMESTAMPTZ)) / 3600)::int AS hour_index,
+        COUNT(*) AS readings,
+        EXTRACT(EPOCH FROM MIN(r.timestamp)) AS first_epoch,
+        EXTRACT(EPOCH FROM MAX(r.timestamp)) AS last_epoch
+    FROM dim_device d
+    JOIN fact_device_readings r ON r.device_key = d.device_key
+    WHERE d.device_id = ANY(:device_ids)
+      AND r.timestamp >= CAST(:start AS TIMESTAMPTZ)
+      AND r.timestamp < CAST(:end AS TIMESTAMPTZ)
+    GROUP BY d.device_id, hour_index
+""")
+
+KNOWN_DEVICES_SQL = text("""
+    SELECT device_id FROM dim_device WHERE device_id = ANY(:device_ids)
+""")
+
+
+def window_bucket(start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """Widen [start, end) to whole UTC hours, the granularity results are cached at"""
+    start = start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    end = end.astimezone(timezone.utc)
+    floored = end.replace(minute=0, second=0, microsecond=0)
+    return start, floored if floored == end else floored + HOUR
+
+
+def summarise_hourly_counts(
+    device_ids: Sequence[str],
+    rows: Sequence[Any],
+    start: datetime,
+    end: datetime,
+    expected_per_hour: float = DEVICE_EXPECTED_READINGS_PER_HOUR,
+) -> Dict[str, Dict[str, Any]]:
+    """Compute the performance payload of each device from hourly count rows
+
+    rows carry device_id, hour_index, readings, first_epoch and last_epoch;
+    start and end must already be hour-aligned.
+    """
+    hours = int((end - start) / HOUR)
+    position = {device_id: i for i, device_id in enumerate(device_ids)}
+    rows = [row for row in rows if row.device_id in position and 0 <= row.hour_index < hours]
+
+    device_index = np.fromiter((position[row.device_id] for row in rows), dtype=np.intp, count=len(rows))
+    hour_index = np.fromiter((row.hour_index for row in rows), dtype=np.intp, count=len(rows))
+    counts = np.zeros((len(device_ids), hours), dtype=np.int64)
+    counts[device_index, hour_index] = np.fromiter((row.readings for row in rows), dtype=np.int64, count=len(rows))
+
+    first_epoch = np.full(len(device_ids), np.inf)
+    last_epoch = np.full(len(device_ids), -np.inf)
+    np.minimum.at(first_epoch, device_index, np.fromiter((row.first_epoch for row in rows), dtype=np.float64, count=len(rows)))
+    np.maximum.at(last_epoch, device_index, np.fromiter((row.last_epoch for row in rows), dtype=np.float64, count=len(rows)))
+
+    reporting = counts > 0
+    readings = counts.sum(axis=1)
+    hours_with_data = reporting.sum(axis=1)
+    uptime = hours_with_data / hours * 100
+    completeness = np.minimum(readings / (hours * expected_per_hour), 1.0) * 100
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_interval = np.where(readings > 1, (last_epoch - first_epoch) / (readings - 1), np.nan)
+
+    # Daily uptime over whole UTC days: pad the window out to midnight on both
+    # sides and count only the hours that fall inside it
+    lead = start.hour
+    trail = (-(lead + hours)) % 24
+    padded = np.pad(reporting, ((0, 0), (lead, trail)))
+    in_window = np.pad(np.ones(hours, dtype=bool), (lead, trail))
+    daily_hours = padded.reshape(len(device_ids), -1, 24).sum(axis=2)
+    daily_expected = in_window.reshape(-1, 24).sum(axis=1)
+    daily_uptime = daily_hours / daily_expected * 100
+    first_day = start.replace(hour=0)
+    days = [(first_day + timedelta(days=i)).date().isoformat() for i in range(daily_expected.size)]
+
+    def _timestamp(epoch: float):
+        return datetime.fromtimestamp(epoch, tz=timezone.utc) if np.isfinite(epoch) else None
+
+    return {
+        device_id: {
+            "device_id": device_id,
+            "window_start": start,
+            "window_end": end,
+            "readings": int(readings[i]),
+            "hours_with_data": int(hours_with_data[i]),
+            "expected_hours": hours,
+            "uptime": round(float(uptime[i]), 2),
+            "data_completeness": round(float(completeness[i]), 2),
+            "mean_reporting_interval_seconds": (
+                None if np.isnan(mean_interval[i]) else round(float(mean_interval[i]), 1)
+            ),
+            "first_seen": _timestamp(first_epoch[i]),
+            "last_seen": _timestamp(last_epoch[i]),
+            "daily_uptime": [
+                {"date": day, "uptime": round(float(value), 2)}
+                for day, value in zip(days, daily_uptime[i])
+            ],
+        }
+        for device_id, i in position.items()
+    }
+
+
+async def compute_device_performance(
+    db: AsyncSession,
+    device_ids: List[str],
+    start: datetime,
+    end: datetime,
+) -> Dict[str, Dict[str, Any]]:
+    """Performance of every known device in device_ids over an hour-aligned window
+
+    Unknown device ids are left out of the result.
+    """
+    params = {"device_ids": device_ids, "start": start, "end": end}
+    known = [row.device_id for row in (await db.execute(KNOWN_DEVICES_SQL, params)).fetchall()]
+    if not known:
+        return {}
+    rows = (await db.execute(HOURLY_READING_COUNTS_SQL, {**params, "device_ids": known})).fetchall()
+    return summarise_hourly_counts(known, rows, start, end)
@@ -0,0 +1,264 @@
+# app/presence.py
+"""Hourly presence bitmaps: one bit per device per UTC hour
+
+device_hourly_presence holds one BIT(744) row per device and calendar month,
+bit n set when the device reported in hour n of the month (744 = 31 x 24;
+the tail of shorter months stays zero). Ingestion ORs each batch's hours in,
+so the bitmaps stay current without ever rescanning fact_device_readings. A
+year of history is twelve 93-byte rows per device.
+
+PresenceBitmaps loads a window of them into a packed devices x hours NumPy
+array, from which uptime, gap lists and completeness matrices come from
+popcounts and bitwise reductions.
+
+Populate it for existing data with ``python -m app.presence [--since DATE]``.
+"""
+import argparse
+import calendar
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+MONTH_BITS = 31 * 24
+
+HOUR = timedelta(hours=1)
+
+# Set bits per byte value, for popcounts over packed rows
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+CREATE_PRESENCE_TABLE_SQL = text(f"""
+    CREATE TABLE IF NOT EXISTS device_hourly_presence (
+        device_key INTEGER NOT NULL,
+        month DATE NOT NULL,
+        hours BIT({MONTH_BITS}) NOT NULL,
+        PRIMARY KEY (device_key, month)
+    )
+""")
+
+# Folds the rows of {readings} (device_key, timestamp) into the bitmaps.
+# B'1' cast to BIT(744) is hour 0 of the month; >> moves it to hour n
+UPSERT_PRESENCE_SQL = f"""
+    INSERT INTO device_hourly_presence (device_key, month, hours)
+    SELECT device_key, month, bit_or(B'1'::bit({MONTH_BITS}) >> hour_of_month)
+    FROM (
+        SELECT DISTINCT
+            device_key,
+            date_trunc('month', utc)::date AS month,
+            (EXTRACT(DAY FROM utc)::int - 1) * 24 + EXTRACT(HOUR FROM utc)::int AS hour_of_month
+        FROM (
+            SELECT device_key, timestamp AT TIME ZONE 'UTC' AS utc
+            FROM {{readings}}
+            WHERE device_key IS NOT NULL
+        ) r
+    ) h
+    GROUP BY device_key, month
+    ON CONFLICT (device_key, month) DO UPDATE SET
+        hours = device_hourly_presence.hours | EXCLUDED.hours
+"""
+
+BACKFILL_PRESENCE_SQL = text(UPSERT_PRESENCE_SQL.format(readings="""(
+                SELECT device_key, timestamp FROM fact_device_readings
+                WHERE CAST(:since AS TIMESTAMPTZ) IS NULL OR timestamp >= CAST(:since AS TIMESTAMPTZ)
+            ) readings"""))
+
+PRESENCE_ROWS_SQL = """
+    SELECT d.device_id, p.month, p.hours::text AS hours
+    FROM device_hourly_presence p
+    JOIN dim_device d ON d.device_key = p.device_key
+    WHERE p.month BETWEEN :first_month AND :last_month
+    {filters}
+"""
+
+FLEET_DEVICES_SQL = """
+    SELECT d.device_id FROM dim_device d
+    WHERE TRUE
+    {filters}
+    ORDER BY d.device_id
+"""
+
+
+def ensure_presence_table(conn: Connection) -> None:
+    """Create device_hourly_presence if it does not exist"""
+    conn.execute(CREATE_PRESENCE_TABLE_SQL)
+
+
+def backfill_presence(conn: Connection, since: Optional[datetime] = None) -> int:
+    """OR the hours of fact_device_readings (optionally from since) into the bitmaps"""
+    ensure_presence_table(conn)
+    result = conn.execute(BACKFILL_PRESENCE_SQL, {"since": since})
+    logger.info("Backfilled %s device-months of presence", result.rowcount)
+    return result.rowcount
+
+
+def _months(start: datetime, end: datetime) -> List[date]:
+    """First days of the UTC months overlapping [start, end)"""
+    month = date(start.year, start.month, 1)
+    last = (end - HOUR).date()
+    months = []
+    while month <= last:
+        months.append(month)
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return months
+
+
+def _runs(bits: np.ndarray, value: bool) -> List[Tuple[int, int]]:
+    """[first, stop) index pairs of the runs equal to value in a bool array"""
+    edges = np.diff(np.concatenate(([not value], bits, [not value])).astype(np.int8))
+    starts = np.flatnonzero(edges == (1 if value else -1))
+    stops = np.flatnonzero(edges == (-1 if value else 1))
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+class PresenceBitmaps:
+    """Packed device x hour presence over an hour-aligned UTC window"""
+
+    def __init__(self, device_ids: Sequence[str], start: datetime, hours: int, packed: np.ndarray):
+        self.device_ids = list(device_ids)
+        self.start = start
+        self.hours = hours
+        # uint8 (devices, ceil(hours / 8)); bits past `hours` are zero
+        self.packed = packed
+        self._position = {device_id: i for i, device_id in enumerate(self.device_ids)}
+
+    @classmethod
+    def from_rows(cls, device_ids: Sequence[str], rows: Sequence[Any], start: datetime, end: datetime) -> "PresenceBitmaps":
+        """Build from (device_id, month, hours-as-bit-text) rows"""
+        months = _months(start, end)
+        offsets, cursor = {}, 0
+        for month in months:
+            offsets[month] = cursor
+            cursor += calendar.monthrange(month.year, month.month)[1] * 24
+
+        position = {device_id: i for i, device_id in enumerate(device_ids)}
+        bits = np.zeros((len(device_ids), cursor), dtype=bool)
+        for row in rows:
+            i, offset = position.get(row.device_id), offsets.get(row.month)
+            if i is None or offset is None:
+                continue
+            month_hours = calendar.monthrange(row.month.year, row.month.month)[1] * 24
+            bits[i, offset:offset + month_hours] = (
+                np.frombuffer(row.hours.encode("ascii"), dtype=np.uint8)[:month_hours] == ord("1")
+            )
+
+        lead = int((start - datetime(months[0].year, months[0].month, 1, tzinfo=timezone.utc)) / HOUR)
+        hours = int((end - start) / HOUR)
+        return cls(device_ids, start, hours, np.packbits(bits[:, lead:lead + hours], axis=1))
+
+    def subset(self, device_ids: Sequence[str]) -> "PresenceBitmaps":
+        """The same window for some of the devices; each must be loaded"""
+        rows = [self._position[device_id] for device_id in device_ids]
+        return PresenceBitmaps(device_ids, self.start, self.hours, self.packed[rows])
+
+    def device_bits(self, device_id: str) -> np.ndarray:
+        """Bool array of the device's hours"""
+        return np.unpackbits(self.packed[self._position[device_id]], count=self.hours).astype(bool)
+
+    def hours_with_data(self) -> np.ndarray:
+        return POPCOUNT[self.packed].sum(axis=1, dtype=np.int64)
+
+    def uptime(self) -> Dict[str, float]:
+        """Percentage of the window's hours each device reported in"""
+        percent = self.hours_with_data() / max(self.hours, 1) * 100
+        return {device_id: round(float(value), 2) for device_id, value in zip(self.device_ids, percent)}
+
+    def gaps(self, device_id: str, min_hours: int = 1) -> List[Dict[str, Any]]:
+        """Runs of at least min_hours hours without data"""
+        return [
+            {
+                "start": self.start + first * HOUR,
+                "end": self.start + stop * HOUR,
+                "hours": stop - first,
+            }
+            for first, stop in _runs(self.device_bits(device_id), False)
+            if stop - first >= min_hours
+        ]
+
+    def any_reporting(self) -> np.ndarray:
+        """Packed hours in which at least one device reported"""
+        return np.bitwise_or.reduce(self.packed, axis=0)
+
+    def all_reporting(self) -> np.ndarray:
+        """Packed hours in which every device reported"""
+        return np.bitwise_and.reduce(self.packed, axis=0)
+
+    def completeness_matrix(self, bucket_hours: int = 24) -> np.ndarray:
+        """devices x buckets percentage of hours with data
+
+        The last bucket may be shorter than bucket_hours.
+        """
+        buckets = -(-self.hours // bucket_hours)
+        bits = np.unpackbits(self.packed, axis=1, count=self.hours)
+        padded = np.pad(bits, ((0, 0), (0, buckets * bucket_hours - self.hours)))
+        counts = padded.reshape(len(self.device_ids), buckets, bucket_hours).sum(axis=2)
+        sizes = np.minimum(bucket_hours, self.hours - np.arange(buckets) * bucket_hours)
+        return counts / sizes * 100
+
+    def fleet_completeness(self, bucket_hours: int = 24) -> np.ndarray:
+        """Per bucket, the percentage of device-hours with data"""
+        if not self.device_ids:
+            return np.zeros(-(-self.hours // bucket_hours))
+        return self.completeness_matrix(bucket_hours).mean(axis=0)
+
+
+def _filters(network: Optional[str], category: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+    filters = []
+    params: Dict[str, Any] = {}
+    if network is not None:
+        filters.append("AND d.network = :network")
+        params["network"] = network
+    if category is not None:
+        filters.append("AND d.category = :category")
+        params["category"] = category
+    return "\n    ".join(filters), params
+
+
+async def load_presence(
+    db: AsyncSession,
+    start: datetime,
+    end: datetime,
+    device_ids: Optional[List[str]] = None,
+    network: Optional[str] = None,
+    category: Optional[str] = None,
+) -> PresenceBitmaps:
+    """Bitmaps of device_ids, or of every matching device, over an hour-aligned window
+
+    With device_ids, unknown devices are kept with no hours set.
+    """
+    filters, params = _filters(network, category)
+    if device_ids is not None:
+        filters += "\n    AND d.device_id = ANY(:device_ids)"
+        params["device_ids"] = device_ids
+    else:
+        device_ids = [row.device_id for row in (await db.execute(
+            text(FLEET_DEVICES_SQL.format(filters=filters)), params
+        )).fetchall()]
+
+    months = _months(start, end)
+    rows = (await db.execute(text(PRESENCE_ROWS_SQL.format(filters=filters)), {
+        **params, "first_month": months[0], "last_month": months[-1],
+    })).fetchall()
+    return PresenceBitmaps.from_rows(device_ids, rows, start, end)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Backfill hourly presence bitmaps from fact_device_readings")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                        help="Only fold readings from this timestamp on")
+    args = parser.parse_args(argv)
+
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.begin() as conn:
+        backfill_presence(conn, args.since)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# app/rollups.py
+"""Incrementally maintained rollup tables over the device fact tables
+
+Each rollup keeps a watermark in rollup_watermarks and only folds in fact rows
+newer than it, so a refresh costs in proportion to what arrived since the last
+run rather than to the size of the fact table. Rows newer than
+ROLLUP_SAFETY_LAG are left for the next run to give in-flight transactions
+time to commit.
+
+The watermarks are on event time, and events can arrive after the watermark
+has passed them (ETL backfills, replayed batches). Every failure refresh
+therefore also recomputes a trailing window behind its watermark, replacing
+the rollup rows there instead of adding to them. For the hourly rollup,
+ingestion records the (device, hour) pairs it writes behind the watermark in
+rollup_dirty_hours and the next refresh recomputes exactly those. Backfills
+that bypass ingestion, or are older than the failure window, are re-folded
+with ``--refold-since``.
+
+Run a refresh with ``python -m app.rollups`` (e.g. from an Airflow task), or
+``python -m app.rollups --refold-since 2024-01-01`` after a backfill.
+"""
+import argparse
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SAFETY_LAG = timedelta(seconds=int(os.getenv("ROLLUP_SAFETY_LAG_SECONDS", "300")))
+# Trailing window recomputed on every failure refresh, widened to whole months
+ROLLUP_FAILURES_REFOLD = timedelta(days=int(os.getenv("ROLLUP_FAILURES_REFOLD_DAYS", "7")))
+
+# Failure categories reported by /api/devices/failures, in payload order
+FAILURE_CATEGORIES = [
+    "connectivity_issues",
+    "sensor_failures",
+    "power_issues",
+    "physical_damage",
+]
+
+# Tables maintained here, for tooling that needs to rebuild them from scratch
+ROLLUP_TABLES = ["agg_device_failures_monthly", "agg_device_readings_hourly", "rollup_dirty_hours"]
+
+CREATE_WATERMARKS_SQL = text("""
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        rollup_name TEXT PRIMARY KEY,
+        watermark TIMESTAMPTZ
+    )
+""")
+
+CREATE_FAILURE_ROLLUP_SQL = text("""
+    CREATE TABLE IF NOT EXISTS agg_device_failures_monthly (
+        month DATE NOT NULL,
+        device_key INTEGER NOT NULL,
+        failure_category TEXT NOT NULL,
+        failure_count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, device_key, failure_category)
+    )
+""")
+
+# One row per device per UTC hour; the PM2.5 count, sum, min and max roll up
+# exactly to any coarser grid (mean = sum / count)
+CREATE_HOURLY_ROLLUP_SQL = text("""
+    CREATE TABLE IF NOT EXISTS agg_device_readings_hourly (
+        hour TIMESTAMPTZ NOT NULL,
+        device_key INTEGER NOT NULL,
+        reading_count BIGINT NOT NULL,
+        pm2_5_count BIGINT NOT NULL,
+        pm2_5_sum DOUBLE PRECISION,
+        pm2_5_min DOUBLE PRECISION,
+        pm2_5_max DOUBLE PRECISION,
+        PRIMARY KEY (device_key, hour)
+    )
+""")
+
+CREATE_HOURLY_ROLLUP_INDEX_SQL = text("""
+    CREATE INDEX IF NOT EXISTS agg_device_readings_hourly_hour_idx
+    ON agg_device_readings_hourly (hour)
+""")
+
+CREATE_DIRTY_HOURS_SQL = text("""
+    CREATE TABLE IF NOT EXISTS rollup_dirty_hours (
+        device_key INTEGER NOT NULL,
+        hour TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (device_key, hour)
+    )
+""")
+
+# Records the hours of {readings} (device_key, timestamp) that the hourly
+# watermark has already passed. FOR SHARE on the watermark row makes this
+# wait for a running refresh to commit, and a refresh wait for this batch,
+# so every hour is either folded by the refresh or marked for the next one
+MARK_DIRTY_HOURS_SQL = """
+    INSERT INTO rollup_dirty_hours (device_key, hour)
+    SELECT DISTINCT device_key, date_trunc('hour', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+    FROM {readings}
+    WHERE device_key IS NOT NULL
+      AND timestamp < (
+          SELECT watermark FROM rollup_watermarks
+          WHERE rollup_name = 'device_readings_hourly'
+          FOR SHARE
+      )
+    ON CONFLICT DO NOTHING
+"""
+
+ADVANCE_WATERMARK_SQL = text("""
+    UPDATE rollup_watermarks SET watermark = :watermark WHERE rollup_name = :name
+""")
+
+# Same classification as the original FILTER aggregates; the branches are
+# mutually exclusive because each one matches a different device_status.
+# Evaluated over fact_device_status columns
+FAILURE_CATEGORY_SQL = """
+            CASE
+                WHEN device_status = 'offline' AND is_online = FALSE THEN 'connectivity_issues'
+                WHEN device_status = 'maintenance' AND is_online = FALSE THEN 'sensor_failures'
+                WHEN device_status = 'low_battery' THEN 'power_issues'
+                WHEN device_status = 'damaged' THEN 'physical_damage'
+            END"""
+
+# Failure counts are replaced for every month from :from_month on, so events
+# that arrived late inside that range are counted and nothing twice
+DELETE_FAILURE_MONTHS_SQL = text("""
+    DELETE FROM agg_device_failures_monthly
+    WHERE CAST(:from_month AS DATE) IS NULL OR month >= :from_month
+""")
+
+FOLD_FAILURES_SQL = text(f"""
+    INSERT INTO agg_device_failures_monthly
+        (month, device_key, failure_category, failure_count)
+    SELECT month, device_key, failure_category, COUNT(*)
+    FROM (
+        SELECT
+            date_trunc('month', timestamp)::date AS month,
+            device_key,{FAILURE_CATEGORY_SQL} AS failure_category
+        FROM fact_device_status
+        WHERE (CAST(:from_month AS DATE) IS NULL OR timestamp >= CAST(:from_month AS DATE))
+          AND timestamp <= :until
+    ) classified
+    WHERE failure_category IS NOT NULL
+    GROUP BY month, device_key, failure_category
+""")
+
+
+UPSERT_HOURLY_SUFFIX = """
+    ON CONFLICT (device_key, hour) DO UPDATE SET
+        reading_count = EXCLUDED.reading_count,
+        pm2_5_count = EXCLUDED.pm2_5_count,
+        pm2_5_sum = EXCLUDED.pm2_5_sum,
+        pm2_5_min = EXCLUDED.pm2_5_min,
+        pm2_5_max = EXCLUDED.pm2_5_max
+"""
+
+# Whole hours are recomputed and replaced rather than added to, so a refresh
+# can be re-run over the same range without double counting
+FOLD_HOURLY_READINGS_SQL = text(f"""
+    INSERT INTO agg_device_readings_hourly AS agg
+        (hour, device_key, reading_count, pm2_5_count, pm2_5_sum, pm2_5_min, pm2_5_max)
+    SELECT
+        date_trunc('hour', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS hour,
+        device_key,
+        COUNT(*),
+        COUNT(pm2_5),
+        SUM(pm2_5),
+        MIN(pm2_5),
+        MAX(pm2_5)
+    FROM fact_device_readings
+    WHERE (CAST(:since AS TIMESTAMPTZ) IS NULL OR timestamp >= :since)
+      AND timestamp < :until
+    GROUP BY 1, 2
+    {UPSERT_HOURLY_SUFFIX}
+""")
+
+# Drains the dirty hours the watermark has passed and recomputes each one
+REFOLD_DIRTY_HOURS_SQL = text(f"""
+    WITH dirty AS (
+        DELETE FROM rollup_dirty_hours
+        WHERE hour < :until
+        RETURNING device_key, hour
+    )
+    INSERT INTO agg_device_readings_hourly AS agg
+        (hour, device_key, reading_count, pm2_5_count, pm2_5_sum, pm2_5_min, pm2_5_max)
+    SELECT
+        dirty.hour,
+        dirty.device_key,
+        COUNT(*),
+        COUNT(r.pm2_5),
+        SUM(r.pm2_5),
+        MIN(r.pm2_5),
+        MAX(r.pm2_5)
+    FROM dirty
+    JOIN fact_device_readings r
+      ON r.device_key = dirty.device_key
+     AND r.timestamp >= dirty.hour
+     AND r.timestamp < dirty.hour + interval '1 hour'
+    GROUP BY 1, 2
+    {UPSERT_HOURLY_SUFFIX}
+""")
+
+
+def ensure_dirty_hours_table(conn: Connection) -> None:
+    """Create the tables ingestion marks late hours in if they do not exist"""
+    conn.execute(CREATE_WATERMARKS_SQL)
+    conn.execute(CREATE_DIRTY_HOURS_SQL)
+
+
+def ensure_rollup_tables(conn: Connection) -> None:
+    """Create the rollup and watermark tables if they do not exist"""
+    ensure_dirty_hours_table(conn)
+    conn.execute(CREATE_FAILURE_ROLLUP_SQL)
+    conn.execute(CREATE_HOURLY_ROLLUP_SQL)
+    conn.execute(CREATE_HOURLY_ROLLUP_INDEX_SQL)
+
+
+def _lock_watermark(conn: Connection, name: str):
+    conn.execute(
+        text("""
+            INSERT INTO rollup_watermarks (rollup_name, watermark)
+            VALUES (:name, NULL)
+            ON CONFLICT (rollup_name) DO NOTHING
+        """),
+        {"name": name}
+    )
+    return conn.execute(
+        text("SELECT watermark FROM rollup_watermarks WHERE rollup_name = :name FOR UPDATE"),
+        {"name": name}
+    ).scalar()
+
+
+def refresh_failure_rollup(conn: Connection, refold_since: Optional[datetime] = None) -> Dict[str, object]:
+    """Recompute the failure counts of every month from the refold window on
+
+    The window starts ROLLUP_FAILURES_REFOLD before the watermark, or at
+    refold_since when that is earlier, and is widened to the start of its
+    month. Must run inside a transaction; the watermark row lock serialises
+    concurrent refreshes.
+    """
+    since = _lock_watermark(conn, "device_failures_monthly")
+    until = conn.execute(text("SELECT now() - :lag"), {"lag": ROLLUP_SAFETY_LAG}).scalar()
+    refold_from = None if since is None else since - ROLLUP_FAILURES_REFOLD
+    if refold_from is not None and refold_since is not None:
+        refold_from = min(refold_from, refold_since)
+    from_month = conn.execute(
+        text("SELECT date_trunc('month', CAST(:refold_from AS TIMESTAMPTZ))::date"),
+        {"refold_from": refold_from}
+    ).scalar()
+
+    conn.execute(DELETE_FAILURE_MONTHS_SQL, {"from_month": from_month})
+    result = conn.execute(FOLD_FAILURES_SQL, {"from_month": from_month, "until": until})
+    conn.execute(ADVANCE_WATERMARK_SQL, {"name": "device_failures_monthly", "watermark": until})
+
+    logger.info("Refolded %s failure groups from %s up to %s", result.rowcount, from_month, until)
+    return {"rollup": "device_failures_monthly", "since": from_month, "until": until, "groups": result.rowcount}
+
+
+def refresh_hourly_rollup(conn: Connection, refold_since: Optional[datetime] = None) -> Dict[str, object]:
+    """Recompute the complete hours of readings since the watermark, and the dirty ones
+
+    The watermark only ever sits on an hour boundary, so each hour is folded
+    once it is older than ROLLUP_SAFETY_LAG and never partially. Hours that
+    ingestion marked in rollup_dirty_hours are recomputed too, and with
+    refold_since every hour from its hour on.
+    """
+    since = _lock_watermark(conn, "device_readings_hourly")
+    until = conn.execute(
+        text("SELECT date_trunc('hour', (now() - :lag) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"),
+        {"lag": ROLLUP_SAFETY_LAG}
+    ).scalar()
+    fold_from = since
+    if refold_since is not None and since is not None:
+        fold_from = min(since, refold_since.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0))
+
+    groups = 0
+    if fold_from is None or fold_from < until:
+        groups += conn.execute(FOLD_HOURLY_READINGS_SQL, {"since": fold_from, "until": until}).rowcount
+    if since is None or until > since:
+        conn.execute(ADVANCE_WATERMARK_SQL, {"name": "device_readings_hourly", "watermark": until})
+    else:
+        until = since
+    dirty = conn.execute(REFOLD_DIRTY_HOURS_SQL, {"until": until}).rowcount
+
+    logger.info("Folded %s device-hours from %s up to %s and %s dirty ones", groups, fold_from, until, dirty)
+    return {"rollup": "device_readings_hourly", "since": fold_from, "until": until, "groups": groups, "dirty": dirty}
+
+
+def refresh_all(engine, refold_since: Optional[datetime] = None) -> None:
+    """Create missing rollup tables and refresh every rollup"""
+    if refold_since is not None and refold_since.tzinfo is None:
+        refold_since = refold_since.replace(tzinfo=timezone.utc)
+    with engine.begin() as conn:
+        ensure_rollup_tables(conn)
+    with engine.begin() as conn:
+        refresh_failure_rollup(conn, refold_since)
+    with engine.begin() as conn:
+        refresh_hourly_rollup(conn, refold_since)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Refresh the rollup tables")
+    parser.add_argument("--refold-since", type=datetime.fromisoformat, default=None,
+                        help="Also recompute everything from this timestamp on, e.g. after a backfill")
+    args = parser.parse_args(argv)
+
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    refresh_all(engine, args.refold_since)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,102 +1,647 @@
 # app/routes/devices.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+import json
+import os
+from datetime import datetime, timedelta, timezone
 
-from ..database import get_db
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional
+
+from ..cache import SingleFlight, SnapshotCache, invalidate_on_write
+from ..http_cache import cached_json_response, json_default
+from ..latest_readings import ONLINE_SQL
+from ..async_database import async_engine, get_async_read_db, read_session, replica_router
+from ..cohorts import parse_cohorts, summarise_cohorts
+from ..device_feed import device_feed
+from ..device_map import MAP_MAX_ZOOM, get_device_map_index, parse_bbox
 from ..models import DeviceSchema
+from ..performance import (
+    PERFORMANCE_MAX_DEVICES,
+    PERFORMANCE_MAX_WINDOW_DAYS,
+    compute_device_performance,
+    window_bucket,
+)
+from ..presence import load_presence
+from ..rollups import FAILURE_CATEGORIES
+from ..sensor_health import HEALTH_FLAGS
 
 router = APIRouter(prefix="/api/devices", tags=["devices"])
 
+# Single pass over dim_device: the empty grouping set carries the fleet-wide
+# counters, the (network) and (category) sets carry the breakdowns. Online
+# status comes from each device's last reading in device_latest_reading
+DEVICE_STATS_SQL = text(f"""
+    SELECT
+        GROUPING(d.network) AS by_network,
+        GROUPING(d.category) AS by_category,
+        d.network,
+        d.category,
+        COUNT(*) AS total_devices,
+        COUNT(*) FILTER (WHERE d.is_active = TRUE) AS active_devices,
+        COUNT(*) FILTER (WHERE {ONLINE_SQL}) AS online_devices,
+        COUNT(*) FILTER (WHERE NOT {ONLINE_SQL}) AS offline_devices,
+        COUNT(*) FILTER (WHERE d.status = 'deployed') AS deployed_devices,
+        COUNT(*) FILTER (WHERE d.status = 'not deployed') AS not_deployed_devices,
+        COUNT(*) FILTER (WHERE d.status = 'recalled') AS recalled_devices,
+        MAX(lr.timestamp) AS last_reading_at
+    FROM dim_device d
+    LEFT JOIN device_latest_reading lr ON lr.device_key = d.device_key
+    GROUP BY GROUPING SETS ((), (d.network), (d.category))
+""")
+
+DEVICE_STATS_CACHE_TTL = float(os.getenv("DEVICE_STATS_CACHE_TTL", "60"))
+DEVICE_FAILURES_CACHE_TTL = float(os.getenv("DEVICE_FAILURES_CACHE_TTL", "300"))
+# Seconds past the TTL an aggregate may still be served while it is recomputed
+AGGREGATE_STALE_SECONDS = float(os.getenv("AGGREGATE_STALE_SECONDS", "300"))
+# /stats online counts come from device_latest_reading, so its stale window is short
+DEVICE_STATS_STALE_SECONDS = float(os.getenv("DEVICE_STATS_STALE_SECONDS", "30"))
+# Fraction of the TTL after which busy aggregates are refreshed in the background
+AGGREGATE_REFRESH_AHEAD = float(os.getenv("AGGREGATE_REFRESH_AHEAD", "0")) or None
+
+# Both are keyed on the response cache's data version first, so a value
+# computed before a write is never served under the version after it
+#
+# device_latest_reading is left out of the /stats data version and write
+# invalidation because every ingest batch touches it. Online counts and
+# last_reading_at are instead bounded by age: DEVICE_STATS_CACHE_TTL plus
+# DEVICE_STATS_STALE_SECONDS here, plus the devices_stats response TTL on
+# top (150 seconds in all by default)
+device_stats_cache = SingleFlight(
+    "devices_stats",
+    ttl_seconds=DEVICE_STATS_CACHE_TTL,
+    stale_seconds=DEVICE_STATS_STALE_SECONDS,
+    refresh_ahead=AGGREGATE_REFRESH_AHEAD,
+    max_entries=8,
+)
+invalidate_on_write(device_stats_cache, "dim_device")
+
+device_failures_cache = SingleFlight(
+    "devices_failures",
+    ttl_seconds=DEVICE_FAILURES_CACHE_TTL,
+    stale_seconds=AGGREGATE_STALE_SECONDS,
+    refresh_ahead=AGGREGATE_REFRESH_AHEAD,
+    max_entries=256,
+)
+invalidate_on_write(device_failures_cache, "agg_device_failures_monthly", "dim_device")
+
+
+async def compute_device_stats(db: AsyncSession) -> Dict[str, Any]:
+    """Build the /stats payload from one aggregation query"""
+    rows = (await db.execute(DEVICE_STATS_SQL)).fetchall()
+
+    totals = None
+    networks = []
+    categories = []
+    for row in rows:
+        if row.by_network and row.by_category:
+            totals = row
+        elif not row.by_network:
+            networks.append({"name": row.network, "count": row.total_devices})
+        else:
+            categories.append({"name": row.category, "count": row.total_devices})
+
+    networks.sort(key=lambda item: item["count"], reverse=True)
+    categories.sort(key=lambda item: item["count"], reverse=True)
+
+    return {
+        "total_devices": totals.total_devices if totals else 0,
+        "active_devices": totals.active_devices if totals else 0,
+        "online_devices": totals.online_devices if totals else 0,
+        "offline_devices": totals.offline_devices if totals else 0,
+        "deployed_devices": totals.deployed_devices if totals else 0,
+        "not_deployed_devices": totals.not_deployed_devices if totals else 0,
+        "recalled_devices": totals.recalled_devices if totals else 0,
+        "last_reading_at": totals.last_reading_at if totals else None,
+        "networks": networks,
+        "categories": categories
+    }
+
 @router.get("/stats", response_model=Dict[str, Any])
-def get_device_stats(db: Session = Depends(get_db)):
+async def get_device_stats(request: Request):
     """Get aggregate statistics for devices"""
     
-    # Get total devices count
-    total_devices = db.execute("SELECT COUNT(*) FROM dim_device").scalar()
-    
-    # Get count of active devices
-    active_devices = db.execute("SELECT COUNT(*) FROM dim_device WHERE is_active = TRUE").scalar()
+    async def build(version):
+        async def compute():
+            # Own session: a shared or background computation can outlive this request
+            async with read_session(min_lsn=version.lsn) as session:
+                return await compute_device_stats(session)
+        
+        return await device_stats_cache.get(version.changes, compute), {}
     
-    # Get count of offline devices
-    offline_devices = db.execute("SELECT COUNT(*) FROM dim_device WHERE is_online = FALSE").scalar()
+    return await cached_json_response(request, "devices_stats", ["dim_device"], build)
+
+@router.get("/stream")
+async def stream_device_changes(request: Request):
+    """Stream a device snapshot, then status, count and failure deltas (SSE)
     
-    # Get count of deployed devices
-    deployed_devices = db.execute("SELECT COUNT(*) FROM dim_device WHERE status = 'deployed'").scalar()
+    Every client shares one database watcher, so open dashboards no longer
+    re-poll /stats and /list.
+    """
+    return StreamingResponse(
+        device_feed.events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Columns exposed by /list, keyed by the name used in the payload and in fields=
+DEVICE_LIST_COLUMNS = {
+    "device_key": "d.device_key",
+    "device_id": "d.device_id",
+    "device_name": "d.device_name",
+    "network": "d.network",
+    "category": "d.category",
+    "status": "d.status",
+    "is_active": "d.is_active",
+    "is_online": ONLINE_SQL,
+    "last_seen": "lr.timestamp",
+    "latest_pm2_5": "lr.pm2_5",
+    "latest_pm10": "lr.pm10",
+    "latitude": "l.latitude",
+    "longitude": "l.longitude",
+}
+
+DEVICE_LIST_MAX_LIMIT = 5000
+DEVICE_LIST_STREAM_BATCH = 1000
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(DEVICE_LIST_COLUMNS)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in DEVICE_LIST_COLUMNS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    return requested
+
+
+def _device_list_query(columns: List[str], after: Optional[int], limit: Optional[int]):
+    # device_key is always selected so the next cursor can be derived
+    select_list = ", ".join(
+        f"{DEVICE_LIST_COLUMNS[name]} AS {name}"
+        for name in ["device_key"] + [c for c in columns if c != "device_key"]
+    )
+    sql = f"""
+        SELECT {select_list}
+        FROM dim_device d
+        LEFT JOIN dim_location l ON d.device_key = l.device_key
+        LEFT JOIN device_latest_reading lr ON d.device_key = lr.device_key
+    """
+    params: Dict[str, Any] = {}
+    if after is not None:
+        sql += " WHERE d.device_key > :after"
+        params["after"] = after
+    if after is not None or limit is not None:
+        sql += " ORDER BY d.device_key"
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params["limit"] = limit
+    return text(sql), params
+
+
+async def _stream_device_list(columns: List[str], after: Optional[int], limit: Optional[int]):
+    """Yield devices as NDJSON lines from a server-side cursor
+
+    The stream owns its connection, on a healthy replica when there is one
+    and on the primary otherwise, for as long as the response is sent.
+    """
+    query, params = _device_list_query(columns, after, limit)
+    replica = replica_router.pick()
+    conn = None
+    if replica is not None:
+        try:
+            conn = await replica.engine.connect()
+        except (OSError, SQLAlchemyError) as e:
+            replica.mark_down(e)
+    if conn is None:
+        conn = await async_engine.connect()
+    try:
+        result = await conn.stream(query, params)
+        async for rows in result.partitions(DEVICE_LIST_STREAM_BATCH):
+            yield "".join(
+                json.dumps({name: row._mapping[name] for name in columns}, default=json_default) + "\n"
+                for row in rows
+            )
+    finally:
+        await conn.close()
+
+@router.get("/list", response_model=List[Dict[str, Any]])
+async def get_device_list(
+    request: Request,
+    cursor: Optional[int] = Query(None, description="Return devices with device_key greater than this value"),
+    limit: Optional[int] = Query(None, ge=1, le=DEVICE_LIST_MAX_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    """Get the list of all devices with their key details
+
+    Without cursor/limit the full list is returned as a single JSON array.
+    With limit the list is paged by device_key and the cursor for the next page
+    is returned in the X-Next-Cursor header. format=ndjson streams one device
+    per line from a server-side cursor.
+    """
+    columns = _parse_fields(fields)
     
-    # Get count of not deployed devices
-    not_deployed_devices = db.execute("SELECT COUNT(*) FROM dim_device WHERE status = 'not deployed'").scalar()
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_device_list(columns, cursor, limit),
+            media_type="application/x-ndjson"
+        )
     
-    # Get count of recalled devices
-    recalled_devices = db.execute("SELECT COUNT(*) FROM dim_device WHERE status = 'recalled'").scalar()
+    async def build(version):
+        query, params = _device_list_query(columns, cursor, limit)
+        async with read_session(min_lsn=version.lsn) as session:
+            devices = (await session.execute(query, params)).fetchall()
+        
+        # A full page means there may be more; hand back the last key as the cursor
+        headers = {}
+        if limit is not None and len(devices) == limit:
+            headers["X-Next-Cursor"] = str(devices[-1].device_key)
+        
+        return [{name: device._mapping[name] for name in columns} for device in devices], headers
     
-    # Get network breakdown
-    networks = db.execute("""
-        SELECT network, COUNT(*) as count 
-        FROM dim_device 
-        GROUP BY network
-        ORDER BY count DESC
-    """).fetchall()
+    return await cached_json_response(
+        request, "devices_list", ["dim_device", "dim_location"], build
+    )
+
+@router.get("/map", response_model=Dict[str, Any])
+async def get_device_map(
+    bbox: str = Query(..., description="west,south,east,north in degrees"),
+    zoom: int = Query(..., ge=0, le=MAP_MAX_ZOOM),
+    cluster: Optional[bool] = Query(None, description="Force clustering on or off"),
+):
+    """Get the devices inside a map viewport, clustered when there are too many
     
-    # Get category breakdown
-    categories = db.execute("""
-        SELECT category, COUNT(*) as count 
-        FROM dim_device 
-        GROUP BY category
-        ORDER BY count DESC
-    """).fetchall()
+    Features are devices or clusters with a count, centroid, extent and
+    online/status mix. west > east selects a box across the antimeridian.
+    """
+    try:
+        west, south, east, north = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return {
-        "total_devices": total_devices,
-        "active_devices": active_devices,
-        "offline_devices": offline_devices,
-        "deployed_devices": deployed_devices,
-        "not_deployed_devices": not_deployed_devices,
-        "recalled_devices": recalled_devices,
-        "networks": [{"name": network, "count": count} for network, count in networks],
-        "categories": [{"name": category, "count": count} for category, count in categories]
-    }
+    index = await get_device_map_index()
+    return index.viewport(west, south, east, north, zoom, cluster)
 
-@router.get("/list", response_model=List[Dict[str, Any]])
-def get_device_list(db: Session = Depends(get_db)):
-    """Get the list of all devices with their key details"""
-    
-    devices = db.execute("""
-        SELECT d.device_key, d.device_id, d.device_name, d.network, d.category, 
-               d.status, d.is_active, d.is_online, l.latitude, l.longitude
-        FROM dim_device d
-        LEFT JOIN dim_location l ON d.device_key = l.device_key
-    """).fetchall()
+# Reads the monthly failure rollup maintained by app.rollups; the month series
+# keeps months without any failures in the chart
+DEVICE_FAILURES_SQL = """
+    WITH months AS (
+        SELECT generate_series(
+            date_trunc('month', now() - make_interval(months => :months)),
+            date_trunc('month', now()),
+            interval '1 month'
+        )::date AS month
+    ),
+    failures AS (
+        SELECT f.month, f.failure_category, SUM(f.failure_count) AS failure_count
+        FROM agg_device_failures_monthly f
+        JOIN dim_device d ON d.device_key = f.device_key
+        WHERE f.month >= (SELECT MIN(month) FROM months)
+        {filters}
+        GROUP BY f.month, f.failure_category
+    )
+    SELECT
+        to_char(m.month, 'Mon') AS month,
+        {category_columns}
+    FROM months m
+    LEFT JOIN failures f ON f.month = m.month
+    GROUP BY m.month
+    ORDER BY m.month
+"""
+
+
+def _device_failures_query(months: int, network: Optional[str], category: Optional[str]):
+    filters = []
+    params: Dict[str, Any] = {"months": months}
+    if network is not None:
+        filters.append("AND d.network = :network")
+        params["network"] = network
+    if category is not None:
+        filters.append("AND d.category = :category")
+        params["category"] = category
     
-    return [dict(device) for device in devices]
+    category_columns = ",\n        ".join(
+        f"COALESCE(SUM(f.failure_count) FILTER (WHERE f.failure_category = '{name}'), 0) AS {name}"
+        for name in FAILURE_CATEGORIES
+    )
+    query = text(DEVICE_FAILURES_SQL.format(
+        filters="\n        ".join(filters),
+        category_columns=category_columns
+    ))
+    return query, params
 
 @router.get("/failures", response_model=Dict[str, Any])
-def get_device_failures(db: Session = Depends(get_db)):
+async def get_device_failures(
+    request: Request,
+    months: int = Query(6, ge=1, le=120, description="Number of months to look back"),
+    network: Optional[str] = Query(None),
+    category: Optional[str] = Query(None, description="Device category")
+):
     """Get device failure data over time"""
     
-    # This assumes you're tracking failures in fact_device_status
-    failure_data = db.execute("""
-        WITH monthly_stats AS (
-            SELECT 
-                date_trunc('month', timestamp) as month,
-                COUNT(*) FILTER (WHERE device_status = 'offline' AND is_online = FALSE) as connectivity_issues,
-                COUNT(*) FILTER (WHERE device_status = 'maintenance' AND is_online = FALSE) as sensor_failures,
-                COUNT(*) FILTER (WHERE device_status = 'low_battery') as power_issues,
-                COUNT(*) FILTER (WHERE device_status = 'damaged') as physical_damage
-            FROM fact_device_status
-            WHERE timestamp > now() - interval '6 months'
-            GROUP BY month
-            ORDER BY month
+    query, params = _device_failures_query(months, network, category)
+    
+    async def build(version):
+        async def compute():
+            async with read_session(min_lsn=version.lsn) as session:
+                failure_data = (await session.execute(query, params)).fetchall()
+            return {
+                "failure_data": [dict(row._mapping) for row in failure_data]
+            }
+        
+        # Keyed by the parsed parameters so equivalent query strings coalesce
+        return await device_failures_cache.get((version.changes, months, network, category), compute), {}
+
+    return await cached_json_response(
+        request, "devices_failures", ["agg_device_failures_monthly", "dim_device"], build
+    )
+
+DEVICE_PERFORMANCE_CACHE_TTL = float(os.getenv("DEVICE_PERFORMANCE_CACHE_TTL", "300"))
+DEVICE_PERFORMANCE_DEFAULT_DAYS = 7
+
+# Entries are per (device_id, window bucket) so overlapping device lists share them
+device_performance_cache = SnapshotCache(ttl_seconds=DEVICE_PERFORMANCE_CACHE_TTL, max_entries=50000)
+
+
+def _hour_window(start: Optional[datetime], end: Optional[datetime]):
+    """Validate a requested window and widen it to whole UTC hours"""
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=DEVICE_PERFORMANCE_DEFAULT_DAYS)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if end - start > timedelta(days=PERFORMANCE_MAX_WINDOW_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Window may span at most {PERFORMANCE_MAX_WINDOW_DAYS} days"
+        )
+    return window_bucket(start, end)
+
+
+async def _device_performance(
+    db: AsyncSession,
+    device_ids: List[str],
+    start: Optional[datetime],
+    end: Optional[datetime]
+) -> Dict[str, Dict[str, Any]]:
+    """Serve cached devices and compute the rest in one batch"""
+    start, end = _hour_window(start, end)
+    results = {}
+    missing = []
+    for device_id in device_ids:
+        cached = device_performance_cache.get((device_id, start, end))
+        if cached is None:
+            missing.append(device_id)
+        else:
+            results[device_id] = cached
+    
+    if missing:
+        computed = await compute_device_performance(db, missing, start, end)
+        for device_id, performance in computed.items():
+            device_performance_cache.set((device_id, start, end), performance)
+        results.update(computed)
+    return results
+
+@router.get("/performance", response_model=Dict[str, Any])
+async def get_devices_performance(
+    device_id: str = Query(..., description="Comma-separated list of device ids"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get uptime, data completeness and reporting interval for several devices
+    
+    The window defaults to the last 7 days and is widened to whole hours.
+    """
+    device_ids = list(dict.fromkeys(name.strip() for name in device_id.split(",") if name.strip()))
+    if not device_ids:
+        raise HTTPException(status_code=400, detail="device_id is required")
+    if len(device_ids) > PERFORMANCE_MAX_DEVICES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {PERFORMANCE_MAX_DEVICES} devices per request"
+        )
+    
+    results = await _device_performance(db, device_ids, start, end)
+    body = {
+        "devices": [results[name] for name in device_ids if name in results],
+        "not_found": [name for name in device_ids if name not in results]
+    }
+    return body
+
+@router.get("/performance/{device_id}", response_model=Dict[str, Any])
+async def get_device_performance(
+    device_id: str,
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get uptime, data completeness and reporting interval for one device"""
+    
+    results = await _device_performance(db, [device_id], start, end)
+    if device_id not in results:
+        raise HTTPException(status_code=404, detail=f"Device {device_id} not found")
+    return results[device_id]
+
+@router.get("/presence", response_model=Dict[str, Any])
+async def get_devices_presence(
+    device_id: str = Query(..., description="Comma-separated list of device ids"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    min_gap_hours: int = Query(1, ge=1, description="Shortest gap to list"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get hourly uptime and gaps for several devices from the presence bitmaps
+    
+    The window defaults to the last 7 days and is widened to whole hours.
+    """
+    device_ids = list(dict.fromkeys(name.strip() for name in device_id.split(",") if name.strip()))
+    if not device_ids:
+        raise HTTPException(status_code=400, detail="device_id is required")
+    if len(device_ids) > PERFORMANCE_MAX_DEVICES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {PERFORMANCE_MAX_DEVICES} devices per request"
         )
-        SELECT 
-            to_char(month, 'Mon') as month,
-            connectivity_issues,
-            sensor_failures,
-            power_issues,
-            physical_damage
-        FROM monthly_stats
-    """).fetchall()
     
+    start, end = _hour_window(start, end)
+    presence = await load_presence(db, start, end, device_ids=device_ids)
+    uptime = presence.uptime()
+    hours_with_data = presence.hours_with_data()
     return {
-        "failure_data": [dict(row) for row in failure_data]
-    }
\ No newline at end of file
+        "window_start": start,
+        "window_end": end,
+        "expected_hours": presence.hours,
+        "devices": [
+            {
+                "device_id": name,
+                "uptime": uptime[name],
+                "hours_with_data": int(hours_with_data[i]),
+                "gaps": presence.gaps(name, min_gap_hours),
+            }
+            for i, name in enumerate(device_ids)
+        ]
+    }
+
+@router.get("/completeness", response_model=Dict[str, Any])
+async def get_fleet_completeness(
+    request: Request,
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    bucket_hours: int = Query(24, ge=1, le=24 * 31),
+    network: Optional[str] = Query(None),
+    category: Optional[str] = Query(None, description="Device category"),
+    include_devices: bool = Query(False, description="Add the per-device matrix")
+):
+    """Get the share of device-hours with data per time bucket across the fleet"""
+    
+    start, end = _hour_window(start, end)
+    
+    async def build(version):
+        async with read_session(min_lsn=version.lsn) as session:
+            presence = await load_presence(session, start, end, network=network, category=category)
+        body: Dict[str, Any] = {
+            "window_start": start,
+            "window_end": end,
+            "bucket_hours": bucket_hours,
+            "devices_count": len(presence.device_ids),
+            "buckets": [
+                start + timedelta(hours=bucket_hours * i)
+                for i in range(-(-presence.hours // bucket_hours))
+            ],
+            "fleet": [round(float(value), 2) for value in presence.fleet_completeness(bucket_hours)],
+        }
+        if include_devices:
+            matrix = presence.completeness_matrix(bucket_hours).round(2)
+            body["devices"] = [
+                {"device_id": name, "completeness": row.tolist()}
+                for name, row in zip(presence.device_ids, matrix)
+            ]
+        return body, {}
+    
+    return await cached_json_response(
+        request, "devices_completeness", ["device_hourly_presence", "dim_device"], build
+    )
+
+@router.post("/cohorts/summary", response_model=Dict[str, Any])
+async def get_cohort_summaries(
+    cohorts: List[Dict[str, Any]] = Body(..., embed=True),
+    hours: int = Query(24, ge=1, le=24 * 90, description="Whole hours of uptime/completeness history"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Summarise many cohorts at once
+    
+    Each cohort is {"name", "device_ids": [...]} or {"name", "network", "category"}.
+    Returns status counts, averages of the online devices' latest readings and
+    uptime/completeness per cohort, in request order.
+    """
+    try:
+        parsed = parse_cohorts(cohorts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return await summarise_cohorts(db, parsed, hours)
+
+DEVICE_HEALTH_COLUMNS = """
+        d.device_id,
+        d.network,
+        d.category,
+        h.status,
+        h.flags,
+        h.readings,
+        h.stuck_fraction,
+        h.longest_stuck_run,
+        h.inversion_fraction,
+        h.dropout_gaps,
+        h.longest_gap_seconds,
+        h.battery_slope_v_per_day,
+        h.pm2_5_median,
+        h.neighbour_count,
+        h.neighbour_z,
+        h.window_start,
+        h.window_end,
+        h.computed_at
+"""
+
+# Written by app.sensor_health; devices it has not analysed yet are left out
+DEVICE_HEALTH_SQL = f"""
+    SELECT {DEVICE_HEALTH_COLUMNS}
+    FROM device_sensor_health h
+    JOIN dim_device d ON d.device_key = h.device_key
+    WHERE TRUE
+    {{filters}}
+    ORDER BY array_position(ARRAY['fault', 'warning', 'ok'], h.status), d.device_id
+"""
+
+
+def _device_health_query(
+    status: Optional[str],
+    flag: Optional[str],
+    network: Optional[str],
+    category: Optional[str]
+):
+    filters = []
+    params: Dict[str, Any] = {}
+    if status is not None:
+        filters.append("AND h.status = :status")
+        params["status"] = status
+    if flag is not None:
+        filters.append("AND :flag = ANY(h.flags)")
+        params["flag"] = flag
+    if network is not None:
+        filters.append("AND d.network = :network")
+        params["network"] = network
+    if category is not None:
+        filters.append("AND d.category = :category")
+        params["category"] = category
+    return text(DEVICE_HEALTH_SQL.format(filters="\n    ".join(filters))), params
+
+@router.get("/health", response_model=Dict[str, Any])
+async def get_devices_health(
+    request: Request,
+    status: Optional[str] = Query(None, pattern="^(ok|warning|fault)$"),
+    flag: Optional[str] = Query(None, pattern=f"^({'|'.join(HEALTH_FLAGS)})$"),
+    network: Optional[str] = Query(None),
+    category: Optional[str] = Query(None, description="Device category")
+):
+    """Get sensor health diagnostics, faults first"""
+    
+    async def build(version):
+        query, params = _device_health_query(status, flag, network, category)
+        async with read_session(min_lsn=version.lsn) as session:
+            devices = [dict(row._mapping) for row in (await session.execute(query, params)).fetchall()]
+        summary = dict.fromkeys(("ok", "warning", "fault"), 0)
+        for device in devices:
+            summary[device["status"]] += 1
+        return {"summary": summary, "devices": devices}, {}
+    
+    return await cached_json_response(
+        request, "devices_health", ["device_sensor_health", "dim_device"], build
+    )
+
+@router.get("/health/{device_id}", response_model=Dict[str, Any])
+async def get_device_health(
+    device_id: str,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get sensor health diagnostics for one device"""
+    
+    query = text(f"""
+        SELECT {DEVICE_HEALTH_COLUMNS}
+        FROM dim_device d
+        JOIN device_sensor_health h ON h.device_key = d.device_key
+        WHERE d.device_id = :device_id
+    """)
+    health = (await db.execute(query, {"device_id": device_id})).fetchone()
+    if health is None:
+        raise HTTPException(status_code=404, detail=f"No health data for device {device_id}")
+    return dict(health._mapping)
@@ -0,0 +1,295 @@
+# app/routes/readings.py
+import math
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Dict, Any, List, Optional
+
+from ..async_database import get_async_read_your_writes_db, read_session
+from ..database import get_db
+from ..downsampling import lttb
+from ..export import DEFAULT_EXPORT_COLUMNS, EXPORT_COLUMNS, EXPORT_FORMATS, stream_export
+from ..http_cache import cached_json_response
+from ..ingestion import CONFLICT_MODES, INGEST_BATCH_SIZE, ingest_readings, parse_readings
+
+router = APIRouter(prefix="/api/readings", tags=["readings"])
+
+@router.post("/ingest", response_model=Dict[str, Any])
+async def ingest_device_readings(
+    request: Request,
+    on_conflict: str = Query("ignore", pattern=f"^({'|'.join(CONFLICT_MODES)})$"),
+    batch_size: int = Query(INGEST_BATCH_SIZE, ge=1, le=500000),
+    db: Session = Depends(get_db)
+):
+    """Bulk-load readings sent as a JSON array, NDJSON or CSV
+
+    Returns accepted, duplicate and rejected counts overall and per batch.
+    """
+    body = await request.body()
+    try:
+        records = list(parse_readings(body, request.headers.get("content-type", "")))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # COPY goes through the blocking psycopg2 connection, keep it off the event loop
+    return await run_in_threadpool(
+        ingest_readings, db.get_bind(), records, batch_size, on_conflict
+    )
+
+SERIES_METRICS = ("pm2_5", "pm10")
+SERIES_MAX_POINTS = 10000
+
+# Fixed-width time buckets aligned to the epoch, aggregated in the database
+BUCKETED_SERIES_SQL = text("""
+    SELECT
+        to_timestamp(floor(extract(epoch FROM r.timestamp) / CAST(:width AS double precision))
+                     * CAST(:width AS double precision)) AS timestamp,
+        COUNT(*) AS count,
+        MIN(r.pm2_5) AS pm2_5_min,
+        AVG(r.pm2_5) AS pm2_5_avg,
+        MAX(r.pm2_5) AS pm2_5_max,
+        MIN(r.pm10) AS pm10_min,
+        AVG(r.pm10) AS pm10_avg,
+        MAX(r.pm10) AS pm10_max
+    FROM fact_device_readings r
+    JOIN dim_device d ON d.device_key = r.device_key
+    WHERE d.device_id = :device_id
+      AND r.timestamp >= :start AND r.timestamp < :end
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+RAW_SERIES_SQL = """
+    SELECT
+        extract(epoch FROM r.timestamp)::double precision AS epoch,
+        r.pm2_5,
+        r.pm10
+    FROM fact_device_readings r
+    JOIN dim_device d ON d.device_key = r.device_key
+    WHERE d.device_id = :device_id
+      AND r.timestamp >= :start AND r.timestamp < :end
+      AND r.{metric} IS NOT NULL
+    ORDER BY r.timestamp
+"""
+
+
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _lttb_points(rows, metric: str, points: int) -> List[Dict[str, Any]]:
+    epochs = np.fromiter((row.epoch for row in rows), dtype=np.float64, count=len(rows))
+    pm2_5 = np.array([row.pm2_5 for row in rows], dtype=np.float64)
+    pm10 = np.array([row.pm10 for row in rows], dtype=np.float64)
+    series = pm2_5 if metric == "pm2_5" else pm10
+
+    selected = lttb(epochs, series, points)
+    return [
+        {
+            "timestamp": datetime.fromtimestamp(epochs[i], tz=timezone.utc).isoformat(),
+            "pm2_5": None if np.isnan(pm2_5[i]) else float(pm2_5[i]),
+            "pm10": None if np.isnan(pm10[i]) else float(pm10[i]),
+        }
+        for i in selected
+    ]
+
+@router.get("/timeseries", response_model=Dict[str, Any])
+async def get_readings_timeseries(
+    device_id: str,
+    start: datetime,
+    end: datetime,
+    points: int = Query(1000, ge=10, le=SERIES_MAX_POINTS, description="Target number of points"),
+    method: str = Query("bucket", pattern="^(bucket|lttb)$"),
+    metric: str = Query("pm2_5", pattern=f"^({'|'.join(SERIES_METRICS)})$", description="Series LTTB selects points on"),
+    # Charts are often opened right after an ingest, which must show up in them
+    db: AsyncSession = Depends(get_async_read_your_writes_db)
+):
+    """Get a device's PM series downsampled to roughly the requested number of points
+
+    method=bucket returns min/avg/max per fixed-width time bucket computed in
+    the database. method=lttb returns raw readings chosen by
+    Largest-Triangle-Three-Buckets on the given metric.
+    """
+    start, end = _as_utc(start), _as_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    
+    params = {"device_id": device_id, "start": start, "end": end}
+    
+    if method == "bucket":
+        width = max(1, math.ceil((end - start).total_seconds() / points))
+        rows = (await db.execute(BUCKETED_SERIES_SQL, {**params, "width": width})).fetchall()
+        return {
+            "device_id": device_id,
+            "method": method,
+            "bucket_seconds": width,
+            "points": [dict(row._mapping) for row in rows]
+        }
+    
+    rows = (await db.execute(text(RAW_SERIES_SQL.format(metric=metric)), params)).fetchall()
+    return {
+        "device_id": device_id,
+        "method": method,
+        "raw_points": len(rows),
+        "points": await run_in_threadpool(_lttb_points, rows, metric, points)
+    }
+
+@router.get("/export")
+def export_readings(
+    start: datetime,
+    end: datetime,
+    format: str = Query("arrow", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    device_id: Optional[List[str]] = Query(None, description="Repeat to export several devices"),
+    network: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    columns: Optional[str] = Query(None, description="Comma-separated list of columns to export"),
+    db: Session = Depends(get_db)
+):
+    """Stream a filtered range of readings as an Arrow IPC stream or Parquet file"""
+    start, end = _as_utc(start), _as_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    
+    selected = DEFAULT_EXPORT_COLUMNS
+    if columns:
+        selected = [name.strip() for name in columns.split(",") if name.strip()]
+        unknown = [name for name in selected if name not in EXPORT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+    
+    filename = f"readings_{start:%Y%m%d}_{end:%Y%m%d}.{'arrows' if format == 'arrow' else 'parquet'}"
+    return StreamingResponse(
+        stream_export(
+            db.get_bind(), selected, start, end, format,
+            device_ids=device_id, network=network, category=category
+        ),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Cell dimensions of /heatmap, evaluated in the requested time zone
+HEATMAP_DIMENSIONS = {
+    "hour_of_day": "EXTRACT(HOUR FROM a.hour AT TIME ZONE :tz)::int",
+    "day_of_week": "EXTRACT(ISODOW FROM a.hour AT TIME ZONE :tz)::int",
+    "day_of_month": "EXTRACT(DAY FROM a.hour AT TIME ZONE :tz)::int",
+    "month": "EXTRACT(MONTH FROM a.hour AT TIME ZONE :tz)::int",
+    "date": "(a.hour AT TIME ZONE :tz)::date",
+}
+HEATMAP_GROUPS = {
+    "device": "d.device_id",
+    "network": "d.network",
+    "category": "d.category",
+}
+HEATMAP_DEFAULT_DAYS = 30
+
+# Reads the hourly rollup maintained by app.rollups, never the raw readings
+HEATMAP_SQL = """
+    SELECT
+        {select_list},
+        SUM(a.pm2_5_count) AS readings,
+        SUM(a.pm2_5_sum) / NULLIF(SUM(a.pm2_5_count), 0) AS pm2_5_mean,
+        MIN(a.pm2_5_min) AS pm2_5_min,
+        MAX(a.pm2_5_max) AS pm2_5_max
+    FROM agg_device_readings_hourly a
+    JOIN dim_device d ON d.device_key = a.device_key
+    WHERE a.hour >= :start AND a.hour < :end
+    {filters}
+    GROUP BY {positions}
+    ORDER BY {positions}
+"""
+
+
+def _heatmap_query(
+    dimensions: List[str],
+    group: Optional[str],
+    start: datetime,
+    end: datetime,
+    tz: str,
+    device_ids: Optional[List[str]] = None,
+    network: Optional[str] = None,
+    category: Optional[str] = None
+):
+    columns = ([f"{HEATMAP_GROUPS[group]} AS {group}"] if group else []) + [
+        f"{HEATMAP_DIMENSIONS[name]} AS {name}" for name in dimensions
+    ]
+    filters = []
+    params: Dict[str, Any] = {"start": start, "end": end, "tz": tz}
+    if device_ids:
+        filters.append("AND d.device_id = ANY(:device_ids)")
+        params["device_ids"] = device_ids
+    if network is not None:
+        filters.append("AND d.network = :network")
+        params["network"] = network
+    if category is not None:
+        filters.append("AND d.category = :category")
+        params["category"] = category
+    
+    positions = ", ".join(str(i) for i in range(1, len(columns) + 1))
+    query = text(HEATMAP_SQL.format(
+        select_list=",\n        ".join(columns),
+        filters="\n    ".join(filters),
+        positions=positions
+    ))
+    return query, params
+
+@router.get("/heatmap", response_model=Dict[str, Any])
+async def get_readings_heatmap(
+    request: Request,
+    grid: str = Query("day_of_week,hour_of_day", description="Comma-separated cell dimensions"),
+    group: Optional[str] = Query(None, pattern=f"^({'|'.join(HEATMAP_GROUPS)})$"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    tz: str = Query("UTC", description="IANA time zone the grid is laid out in"),
+    device_id: Optional[List[str]] = Query(None, description="Repeat to include several devices"),
+    network: Optional[str] = Query(None),
+    category: Optional[str] = Query(None)
+):
+    """Get PM2.5 mean/min/max per heatmap cell from the hourly rollup
+
+    The default grid is day of week (ISO, 1 = Monday) by hour of day over the
+    last 30 days. group adds a device, network or category series. Readings
+    from the current hour are not in the rollup yet.
+    """
+    dimensions = [name.strip() for name in grid.split(",") if name.strip()]
+    unknown = [name for name in dimensions if name not in HEATMAP_DIMENSIONS]
+    if unknown or not dimensions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"grid must list dimensions from {', '.join(HEATMAP_DIMENSIONS)}"
+        )
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown time zone: {tz}")
+    
+    end = _as_utc(end) if end else datetime.now(timezone.utc)
+    start = _as_utc(start) if start else end - timedelta(days=HEATMAP_DEFAULT_DAYS)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    
+    query, params = _heatmap_query(dimensions, group, start, end, tz, device_id, network, category)
+    
+    async def build(version):
+        async with read_session(min_lsn=version.lsn) as session:
+            rows = (await session.execute(query, params)).fetchall()
+        return {
+            "grid": dimensions,
+            "group": group,
+            "time_zone": tz,
+            "start": start,
+            "end": end,
+            "cells": [dict(row._mapping) for row in rows]
+        }, {}
+    
+    return await cached_json_response(
+        request, "readings_heatmap", ["agg_device_readings_hourly", "dim_device"], build
+    )
@@ -0,0 +1,354 @@
+# app/sensor_health.py
+"""Batch sensor-health diagnosis over recent device readings
+
+Devices are split into HEALTH_SHARDS shards and each shard is analysed in a
+worker process. A worker streams its devices' readings for the last
+HEALTH_WINDOW_HOURS from a server-side cursor, HEALTH_CHUNK_ROWS at a time,
+ordered by device, and computes with NumPy for each device:
+
+    stuck          share of PM2.5 readings in runs of HEALTH_STUCK_READINGS or
+                   more identical values (flatlined sensor)
+    inverted       share of readings where PM2.5 exceeds PM10
+    dropouts       gaps between readings longer than HEALTH_GAP_SECONDS
+    battery_decay  least-squares battery voltage slope in volts per day
+    neighbour      robust z-score of the device's median PM2.5 against the
+                   devices within HEALTH_NEIGHBOUR_RADIUS_KM
+
+The neighbour comparison needs every device, so it runs in the parent once
+the shards are done. Results replace the rows in device_sensor_health, which
+/api/devices/health serves; rows of devices no longer in dim_device are
+deleted.
+
+CLI::
+
+    python -m app.sensor_health --window-hours 72 --workers 8
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+
+HEALTH_WINDOW_HOURS = int(os.getenv("HEALTH_WINDOW_HOURS", "72"))
+HEALTH_WORKERS = int(os.getenv("HEALTH_WORKERS", str(os.cpu_count() or 1)))
+HEALTH_SHARDS_PER_WORKER = 4
+HEALTH_CHUNK_ROWS = int(os.getenv("HEALTH_CHUNK_ROWS", "100000"))
+
+HEALTH_STUCK_READINGS = int(os.getenv("HEALTH_STUCK_READINGS", "12"))
+HEALTH_STUCK_FRACTION = float(os.getenv("HEALTH_STUCK_FRACTION", "0.2"))
+HEALTH_INVERSION_TOLERANCE = float(os.getenv("HEALTH_INVERSION_TOLERANCE", "1.0"))
+HEALTH_INVERSION_FRACTION = float(os.getenv("HEALTH_INVERSION_FRACTION", "0.1"))
+HEALTH_GAP_SECONDS = float(os.getenv("HEALTH_GAP_SECONDS", "3600"))
+HEALTH_BATTERY_DECAY = float(os.getenv("HEALTH_BATTERY_DECAY_V_PER_DAY", "0.05"))
+HEALTH_MIN_BATTERY_POINTS = 10
+HEALTH_NEIGHBOUR_RADIUS_KM = float(os.getenv("HEALTH_NEIGHBOUR_RADIUS_KM", "10"))
+HEALTH_MIN_NEIGHBOURS = int(os.getenv("HEALTH_MIN_NEIGHBOURS", "3"))
+HEALTH_OUTLIER_Z = float(os.getenv("HEALTH_OUTLIER_Z", "3.5"))
+# Floor on the neighbours' spread so near-identical neighbours do not turn
+# small differences into huge scores (µg/m³)
+HEALTH_NEIGHBOUR_MIN_SCALE = 2.0
+
+HEALTH_FLAGS = ("no_data", "stuck", "inverted", "dropouts", "battery_decay", "neighbour_outlier")
+
+EARTH_RADIUS_KM = 6371.0088
+
+CREATE_HEALTH_TABLE_SQL = text("""
+    CREATE TABLE IF NOT EXISTS device_sensor_health (
+        device_key INTEGER PRIMARY KEY,
+        computed_at TIMESTAMPTZ NOT NULL,
+        window_start TIMESTAMPTZ NOT NULL,
+        window_end TIMESTAMPTZ NOT NULL,
+        readings INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        flags TEXT[] NOT NULL,
+        stuck_fraction DOUBLE PRECISION,
+        longest_stuck_run INTEGER,
+        inversion_fraction DOUBLE PRECISION,
+        dropout_gaps INTEGER,
+        longest_gap_seconds DOUBLE PRECISION,
+        battery_slope_v_per_day DOUBLE PRECISION,
+        pm2_5_median DOUBLE PRECISION,
+        neighbour_count INTEGER,
+        neighbour_z DOUBLE PRECISION
+    )
+""")
+
+# One location per device: the most recently added
+DEVICE_LOCATIONS_SQL = text("""
+    SELECT d.device_key, l.latitude, l.longitude
+    FROM dim_device d
+    LEFT JOIN LATERAL (
+        SELECT latitude, longitude
+        FROM dim_location
+        WHERE device_key = d.device_key
+        ORDER BY location_key DESC
+        LIMIT 1
+    ) l ON TRUE
+    ORDER BY d.device_key
+""")
+
+SHARD_READINGS_SQL = text("""
+    SELECT
+        device_key,
+        EXTRACT(EPOCH FROM timestamp)::double precision,
+        pm2_5::double precision,
+        pm10::double precision,
+        battery_voltage::double precision
+    FROM fact_device_readings
+    WHERE device_key = ANY(:device_keys)
+      AND timestamp >= :start AND timestamp < :end
+    ORDER BY device_key, timestamp
+""")
+
+HEALTH_COLUMNS = (
+    "device_key", "computed_at", "window_start", "window_end", "readings", "status", "flags",
+    "stuck_fraction", "longest_stuck_run", "inversion_fraction", "dropout_gaps",
+    "longest_gap_seconds", "battery_slope_v_per_day", "pm2_5_median", "neighbour_count", "neighbour_z",
+)
+
+UPSERT_HEALTH_SQL = text("""
+    INSERT INTO device_sensor_health (%s)
+    VALUES (%s)
+    ON CONFLICT (device_key) DO UPDATE SET %s
+""" % (
+    ", ".join(HEALTH_COLUMNS),
+    ", ".join(f":{name}" for name in HEALTH_COLUMNS),
+    ", ".join(f"{name} = EXCLUDED.{name}" for name in HEALTH_COLUMNS[1:]),
+))
+
+DELETE_DROPPED_HEALTH_SQL = text("""
+    DELETE FROM device_sensor_health WHERE device_key <> ALL(:device_keys)
+""")
+
+
+def ensure_health_table(conn) -> None:
+    conn.execute(CREATE_HEALTH_TABLE_SQL)
+
+
+def iter_device_series(conn, device_keys: Sequence[int], start: datetime, end: datetime,
+                       chunk_rows: int = HEALTH_CHUNK_ROWS) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yield (device_key, readings) with one float array per device
+
+    Columns are epoch seconds, pm2_5, pm10 and battery_voltage, NaN where
+    missing. Only the device spanning a chunk boundary is held across chunks.
+    """
+    result = conn.execution_options(stream_results=True).execute(
+        SHARD_READINGS_SQL, {"device_keys": list(device_keys), "start": start, "end": end}
+    )
+    carry_key, carry = None, []
+    while True:
+        rows = result.fetchmany(chunk_rows)
+        if not rows:
+            break
+        block = np.array(rows, dtype=np.float64)
+        boundaries = np.flatnonzero(np.diff(block[:, 0])) + 1
+        for segment in np.split(block, boundaries):
+            key = int(segment[0, 0])
+            if carry and key != carry_key:
+                yield carry_key, np.concatenate(carry)[:, 1:]
+                carry = []
+            carry_key = key
+            carry.append(segment)
+    if carry:
+        yield carry_key, np.concatenate(carry)[:, 1:]
+
+
+def _run_lengths(values: np.ndarray) -> np.ndarray:
+    change = np.flatnonzero(np.diff(values) != 0) + 1
+    return np.diff(np.concatenate(([0], change, [values.size])))
+
+
+def device_indicators(series: np.ndarray, start_epoch: float, end_epoch: float) -> Dict[str, Any]:
+    """Health indicators of one device from its time-ordered readings"""
+    epoch, pm2_5, pm10, battery = series.T
+    indicators: Dict[str, Any] = {
+        "readings": int(epoch.size),
+        "stuck_fraction": None,
+        "longest_stuck_run": None,
+        "inversion_fraction": None,
+        "battery_slope_v_per_day": None,
+        "pm2_5_median": None,
+    }
+
+    values = pm2_5[np.isfinite(pm2_5)]
+    if values.size:
+        runs = _run_lengths(values)
+        indicators["stuck_fraction"] = float(runs[runs >= HEALTH_STUCK_READINGS].sum() / values.size)
+        indicators["longest_stuck_run"] = int(runs.max())
+        indicators["pm2_5_median"] = float(np.median(values))
+
+    paired = np.isfinite(pm2_5) & np.isfinite(pm10)
+    if paired.any():
+        indicators["inversion_fraction"] = float(
+            np.mean(pm2_5[paired] > pm10[paired] + HEALTH_INVERSION_TOLERANCE)
+        )
+
+    # The window edges count, so a device that stopped reporting has a gap
+    intervals = np.diff(np.concatenate(([start_epoch], epoch, [end_epoch])))
+    indicators["dropout_gaps"] = int(np.count_nonzero(intervals > HEALTH_GAP_SECONDS))
+    indicators["longest_gap_seconds"] = float(intervals.max())
+
+    charged = np.isfinite(battery)
+    if np.count_nonzero(charged) >= HEALTH_MIN_BATTERY_POINTS:
+        days = (epoch[charged] - epoch[charged][0]) / 86400
+        if np.ptp(days) > 0:
+            indicators["battery_slope_v_per_day"] = float(np.polyfit(days, battery[charged], 1)[0])
+    return indicators
+
+
+def analyse_shard(database_url: str, device_keys: List[int], start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Indicators for every device in the shard; runs in a worker process"""
+    engine = create_engine(database_url, poolclass=NullPool)
+    start_epoch, end_epoch = start.timestamp(), end.timestamp()
+    results = {}
+    try:
+        with engine.connect() as conn:
+            for device_key, series in iter_device_series(conn, device_keys, start, end):
+                results[device_key] = device_indicators(series, start_epoch, end_epoch)
+    finally:
+        engine.dispose()
+
+    empty = np.empty((0, 4))
+    return [
+        {"device_key": key, **(results.get(key) or device_indicators(empty, start_epoch, end_epoch))}
+        for key in device_keys
+    ]
+
+
+def _haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def neighbour_scores(latitude: np.ndarray, longitude: np.ndarray, medians: np.ndarray,
+                     radius_km: float = HEALTH_NEIGHBOUR_RADIUS_KM) -> Tuple[np.ndarray, np.ndarray]:
+    """Neighbour counts and robust z-scores of each device's median PM2.5
+
+    The z-score uses the median and scaled MAD of the medians of the devices
+    within radius_km, and is NaN with fewer than HEALTH_MIN_NEIGHBOURS of
+    them. Distances are computed in row blocks to bound memory.
+    """
+    n = medians.size
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    usable = np.isfinite(medians) & np.isfinite(lat) & np.isfinite(lon)
+    counts = np.zeros(n, dtype=np.int64)
+    scores = np.full(n, np.nan)
+    block_rows = max(1, 4_000_000 // max(n, 1))
+
+    for first in range(0, n, block_rows):
+        rows = np.arange(first, min(n, first + block_rows))
+        near = _haversine_km(lat[rows, None], lon[rows, None], lat[None, :], lon[None, :]) <= radius_km
+        near &= usable[None, :]
+        near[np.arange(rows.size), rows] = False
+        values = np.where(near, medians[None, :], np.nan)
+        with warnings.catch_warnings():
+            # Rows without neighbours are all-NaN; their score stays NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            centre = np.nanmedian(values, axis=1)
+            spread = 1.4826 * np.nanmedian(np.abs(values - centre[:, None]), axis=1)
+        counts[rows] = near.sum(axis=1)
+        z = (medians[rows] - centre) / np.maximum(spread, HEALTH_NEIGHBOUR_MIN_SCALE)
+        scores[rows] = np.where(counts[rows] >= HEALTH_MIN_NEIGHBOURS, z, np.nan)
+    return counts, scores
+
+
+def classify(indicators: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """Flags raised by a device's indicators and the resulting status"""
+    flags = []
+    if indicators["readings"] == 0:
+        flags.append("no_data")
+    if (indicators["stuck_fraction"] or 0) >= HEALTH_STUCK_FRACTION:
+        flags.append("stuck")
+    if (indicators["inversion_fraction"] or 0) >= HEALTH_INVERSION_FRACTION:
+        flags.append("inverted")
+    if indicators["dropout_gaps"]:
+        flags.append("dropouts")
+    if (indicators["battery_slope_v_per_day"] or 0) <= -HEALTH_BATTERY_DECAY:
+        flags.append("battery_decay")
+    z = indicators.get("neighbour_z")
+    if z is not None and abs(z) >= HEALTH_OUTLIER_Z:
+        flags.append("neighbour_outlier")
+
+    if "no_data" in flags or "inverted" in flags or (indicators["stuck_fraction"] or 0) >= 0.5:
+        return "fault", flags
+    return ("warning" if flags else "ok"), flags
+
+
+def run_health_pipeline(
+    engine,
+    window_hours: int = HEALTH_WINDOW_HOURS,
+    workers: int = HEALTH_WORKERS,
+    end: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Analyse every device and replace device_sensor_health with the results"""
+    end = end or datetime.now(timezone.utc).replace(microsecond=0)
+    start = end - timedelta(hours=window_hours)
+    # Workers run in other processes and open their own connections from this
+    database_url = engine.url.render_as_string(hide_password=False)
+    with engine.begin() as conn:
+        ensure_health_table(conn)
+    with engine.connect() as conn:
+        devices = conn.execute(DEVICE_LOCATIONS_SQL).fetchall()
+    if not devices:
+        with engine.begin() as conn:
+            conn.execute(DELETE_DROPPED_HEALTH_SQL, {"device_keys": []})
+        return {"devices": 0, "statuses": {}}
+
+    keys = np.array([row.device_key for row in devices], dtype=np.int64)
+    shards = [shard.tolist() for shard in np.array_split(keys, max(1, workers * HEALTH_SHARDS_PER_WORKER)) if shard.size]
+    if workers > 1:
+        # spawn, not fork: workers must not inherit the parent's pooled connections
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            shard_results = list(pool.map(analyse_shard, *zip(*[(database_url, shard, start, end) for shard in shards])))
+    else:
+        shard_results = [analyse_shard(database_url, shard, start, end) for shard in shards]
+    by_key = {result["device_key"]: result for shard in shard_results for result in shard}
+
+    results = [by_key[key] for key in keys.tolist()]
+    medians = np.array([np.nan if r["pm2_5_median"] is None else r["pm2_5_median"] for r in results])
+    latitude = np.array([np.nan if row.latitude is None else row.latitude for row in devices], dtype=np.float64)
+    longitude = np.array([np.nan if row.longitude is None else row.longitude for row in devices], dtype=np.float64)
+    counts, scores = neighbour_scores(latitude, longitude, medians)
+
+    computed_at = datetime.now(timezone.utc)
+    statuses: Dict[str, int] = {}
+    for result, count, score in zip(results, counts.tolist(), scores.tolist()):
+        result["neighbour_count"] = count
+        result["neighbour_z"] = None if np.isnan(score) else round(score, 3)
+        result["status"], result["flags"] = classify(result)
+        result.update(computed_at=computed_at, window_start=start, window_end=end)
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+
+    with engine.begin() as conn:
+        conn.execute(UPSERT_HEALTH_SQL, results)
+        conn.execute(DELETE_DROPPED_HEALTH_SQL, {"device_keys": keys.tolist()})
+
+    logger.info("Sensor health for %s devices over %sh: %s", len(results), window_hours, statuses)
+    return {"devices": len(results), "window_start": start, "window_end": end, "statuses": statuses}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Compute sensor health indicators for every device")
+    parser.add_argument("--window-hours", type=int, default=HEALTH_WINDOW_HOURS)
+    parser.add_argument("--workers", type=int, default=HEALTH_WORKERS)
+    args = parser.parse_args(argv)
+
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    run_health_pipeline(engine, window_hours=args.window_hours, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
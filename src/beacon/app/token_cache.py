@@ -0,0 +1,211 @@
+# app/token_cache.py
+"""Caches for bearer-token verification and the upstream AirQo API token
+
+VerifiedTokenCache keeps the claims of tokens that already passed signature
+and expiry checks, keyed by a SHA-256 of the token so raw tokens are never
+held as dictionary keys. Entries are dropped at the token's own exp, and the
+cache is a bounded LRU. Tokens that fail verification are never cached, so
+they keep failing on every request.
+
+UpstreamToken wraps the function that fetches the AirQo API token. The token
+is reused until AIRQO_TOKEN_REFRESH_MARGIN before it expires. Inside that
+margin a single caller refreshes it while the others keep using the
+still-valid token. Once it has expired, concurrent callers block on one fetch
+rather than each issuing their own.
+
+Wire them into app.users like::
+
+    verified_tokens = VerifiedTokenCache()
+
+    def decode_token(token):
+        return verified_tokens.verify(
+            token, lambda t: jwt.decode(t, SECRET_KEY, algorithms=[ALGORITHM])
+        )
+
+    @upstream_token
+    def get_airqo_token():
+        ...
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from .instrumentation import CACHE_LOOKUPS, CACHE_REFRESHES
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# Upper bound on how long claims are reused, also applied to tokens without exp
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL_SECONDS", "300"))
+
+AIRQO_TOKEN_TTL = float(os.getenv("AIRQO_TOKEN_TTL_SECONDS", "3600"))
+AIRQO_TOKEN_REFRESH_MARGIN = float(os.getenv("AIRQO_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def unverified_expiry(token: str) -> Optional[float]:
+    """The exp claim of a JWT read without checking its signature, if any"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified JWT claims, evicted at each token's expiry"""
+
+    def __init__(
+        self,
+        max_entries: int = TOKEN_CACHE_MAX_ENTRIES,
+        max_ttl: float = TOKEN_CACHE_MAX_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = _token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                CACHE_LOOKUPS.inc(cache="jwt_claims", outcome="hit")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        CACHE_LOOKUPS.inc(cache="jwt_claims", outcome="miss")
+        return None
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        now = self._clock()
+        expires_at = now + self.max_ttl
+        if claims.get("exp") is not None:
+            expires_at = min(expires_at, float(claims["exp"]))
+        if expires_at <= now:
+            return
+        key = _token_key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def verify(self, token: str, decode: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+        """Cached claims for token, or decode(token) (which raises if invalid)"""
+        claims = self.get(token)
+        if claims is None:
+            claims = decode(token)
+            self.put(token, claims)
+        return claims
+
+    def clear(self) -> None:
+        """Forget every token, e.g. after rotating the signing key"""
+        with self._lock:
+            self._entries.clear()
+
+
+class UpstreamToken:
+    """Single-flight, refresh-ahead cache around an upstream token fetch
+
+    fetch returns the token, or (token, expires_in_seconds). Without an
+    explicit lifetime the token's own exp claim is used when it is a JWT,
+    otherwise AIRQO_TOKEN_TTL.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Union[str, Tuple[str, float]]],
+        refresh_margin: float = AIRQO_TOKEN_REFRESH_MARGIN,
+        default_ttl: float = AIRQO_TOKEN_TTL,
+        name: str = "airqo_token",
+        clock: Callable[[], float] = time.time,
+    ):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self.name = name
+        self._clock = clock
+        # (token, expires_at) swapped as one tuple so readers never see a mix
+        self._current: Tuple[Optional[str], float] = (None, 0.0)
+        self._refresh_lock = threading.Lock()
+
+    def get(self) -> str:
+        token, expires_at = self._current
+        now = self._clock()
+        if token is not None and now < expires_at - self.refresh_margin:
+            CACHE_LOOKUPS.inc(cache=self.name, outcome="hit")
+            return token
+        if token is not None and now < expires_at:
+            # Near expiry: one caller refreshes, the rest keep the valid token
+            if self._refresh_lock.acquire(blocking=False):
+                try:
+                    CACHE_LOOKUPS.inc(cache=self.name, outcome="refresh")
+                    return self._refresh("ahead", fallback=token)
+                finally:
+                    self._refresh_lock.release()
+            CACHE_LOOKUPS.inc(cache=self.name, outcome="hit")
+            return token
+
+        with self._refresh_lock:
+            # Another caller may have fetched it while this one waited
+            token, expires_at = self._current
+            if token is not None and self._clock() < expires_at:
+                CACHE_LOOKUPS.inc(cache=self.name, outcome="coalesced")
+                return token
+            CACHE_LOOKUPS.inc(cache=self.name, outcome="miss")
+            return self._refresh("miss")
+
+    def _refresh(self, trigger: str, fallback: Optional[str] = None) -> str:
+        try:
+            fetched = self.fetch()
+        except Exception:
+            CACHE_REFRESHES.inc(cache=self.name, trigger=trigger, result="error")
+            if fallback is None:
+                raise
+            logger.exception("Refreshing %s ahead of expiry failed; reusing the current one", self.name)
+            return fallback
+
+        if isinstance(fetched, tuple):
+            token, expires_in = fetched
+            expires_at = self._clock() + float(expires_in)
+        else:
+            token = fetched
+            expires_at = unverified_expiry(token) or self._clock() + self.default_ttl
+        self._current = (token, expires_at)
+        CACHE_REFRESHES.inc(cache=self.name, trigger=trigger, result="ok")
+        return token
+
+    def invalidate(self) -> None:
+        """Drop the token, e.g. after the upstream API rejected it"""
+        with self._refresh_lock:
+            self._current = (None, 0.0)
+
+
+def upstream_token(fetch: Callable[[], Union[str, Tuple[str, float]]]) -> Callable[[], str]:
+    """Decorate a token fetch function with an UpstreamToken cache"""
+    cache = UpstreamToken(fetch, name=fetch.__name__)
+
+    @wraps(fetch)
+    def get_token() -> str:
+        return cache.get()
+
+    get_token.cache = cache
+    return get_token
@@ -0,0 +1,227 @@
+"""Load harness for the beacon API routes
+
+Drives app.main.app in-process through httpx's ASGI transport, or a running
+server (e.g. a local uvicorn) when LOAD_TARGET_URL is set. A weighted mix of
+real endpoints is replayed by N concurrent workers for each concurrency level
+in a sweep, after an untimed warm-up, and per-endpoint throughput and latency
+percentiles are reported for every level.
+
+    LOAD_MIX="stats=3,list=1,failures=1" LOAD_CONCURRENCY=1,8,32 \\
+        python tests/performance/api_load/load_harness.py
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+LOAD_TARGET_URL = os.getenv("LOAD_TARGET_URL")
+LOAD_DURATION = float(os.getenv("LOAD_DURATION", "10"))
+LOAD_WARMUP = float(os.getenv("LOAD_WARMUP", "3"))
+LOAD_CONCURRENCY = [int(level) for level in os.getenv("LOAD_CONCURRENCY", "1,8,32").split(",")]
+LOAD_SEED = int(os.getenv("LOAD_SEED", "42"))
+
+
+@dataclass
+class Endpoint:
+    name: str
+    path: Callable[["LoadContext"], str]
+    headers: Callable[["LoadContext"], Dict[str, str]] = lambda context: {}
+    # JSON body; endpoints with one are POSTed
+    body: Optional[Callable[["LoadContext"], Any]] = None
+
+
+@dataclass
+class LoadContext:
+    """Values discovered from the API before the run (sample ids, ETags)"""
+
+    device_ids: List[str] = field(default_factory=list)
+    etags: Dict[str, str] = field(default_factory=dict)
+    rng: random.Random = field(default_factory=lambda: random.Random(LOAD_SEED))
+    # 90-day chart window ending now, as the telemetry view requests it
+    window_end: datetime = field(default_factory=lambda: datetime.now(timezone.utc).replace(microsecond=0))
+
+    @property
+    def window_start(self) -> datetime:
+        return self.window_end - timedelta(days=90)
+
+    def device_id(self) -> str:
+        return self.rng.choice(self.device_ids) if self.device_ids else "unknown"
+
+
+ENDPOINTS = {
+    "stats": Endpoint("stats", lambda c: "/api/devices/stats"),
+    "stats_conditional": Endpoint(
+        "stats_conditional",
+        lambda c: "/api/devices/stats",
+        lambda c: {"If-None-Match": c.etags.get("/api/devices/stats", "")},
+    ),
+    "list": Endpoint("list", lambda c: "/api/devices/list"),
+    "list_page": Endpoint("list_page", lambda c: "/api/devices/list?limit=100"),
+    "list_projection": Endpoint("list_projection", lambda c: "/api/devices/list?fields=device_id,latitude,longitude"),
+    "failures": Endpoint("failures", lambda c: "/api/devices/failures"),
+    "failures_filtered": Endpoint("failures_filtered", lambda c: "/api/devices/failures?months=12&network=airqo"),
+    "performance": Endpoint("performance", lambda c: f"/api/devices/performance/{c.device_id()}"),
+    "performance_batch": Endpoint(
+        "performance_batch",
+        lambda c: "/api/devices/performance?device_id=" + ",".join(c.device_ids[:20] or ["unknown"]),
+    ),
+    "map_world": Endpoint("map_world", lambda c: "/api/devices/map?bbox=-180,-85,180,85&zoom=2"),
+    "map_city": Endpoint("map_city", lambda c: "/api/devices/map?bbox=32.4,0.2,32.7,0.45&zoom=12"),
+    "cohorts": Endpoint(
+        "cohorts",
+        lambda c: "/api/devices/cohorts/summary",
+        body=lambda c: {"cohorts": [
+            {"name": "airqo", "network": "airqo"},
+            *({"name": f"site_{i}", "device_ids": c.device_ids[i * 10:(i + 1) * 10]} for i in range(5)),
+        ]},
+    ),
+    "timeseries": Endpoint(
+        "timeseries",
+        lambda c: f"/api/readings/timeseries?device_id={c.device_id()}"
+                  f"&start={c.window_start:%Y-%m-%dT%H:%M:%SZ}&end={c.window_end:%Y-%m-%dT%H:%M:%SZ}&points=1000",
+    ),
+}
+
+DEFAULT_MIX = "stats=3,stats_conditional=3,list=1,list_page=2,failures=2,performance=1,timeseries=1"
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def make_client() -> httpx.AsyncClient:
+    """Client for LOAD_TARGET_URL, or for app.main.app in-process"""
+    if LOAD_TARGET_URL:
+        return httpx.AsyncClient(base_url=LOAD_TARGET_URL, timeout=30)
+    from app.main import app
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://beacon", timeout=30)
+
+
+async def discover(client: httpx.AsyncClient) -> LoadContext:
+    context = LoadContext()
+    response = await client.get("/api/devices/list?limit=50&fields=device_id")
+    if response.status_code == 200:
+        context.device_ids = [device["device_id"] for device in response.json()]
+    response = await client.get("/api/devices/stats")
+    if "etag" in response.headers:
+        context.etags["/api/devices/stats"] = response.headers["etag"]
+    return context
+
+
+def _percentiles(latencies: Sequence[float]) -> Dict[str, float]:
+    if len(latencies) < 2:
+        value = latencies[0] if latencies else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50_ms": round(cuts[49], 2), "p95_ms": round(cuts[94], 2), "p99_ms": round(cuts[98], 2)}
+
+
+async def run_level(client, context, mix: Dict[str, int], concurrency: int, duration: float, record: bool = True):
+    """Run the mix with concurrency workers for duration seconds"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def worker(seed: int):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            endpoint = ENDPOINTS[rng.choices(names, weights)[0]]
+            started = time.perf_counter()
+            try:
+                if endpoint.body is None:
+                    response = await client.get(endpoint.path(context), headers=endpoint.headers(context))
+                else:
+                    response = await client.post(
+                        endpoint.path(context), headers=endpoint.headers(context), json=endpoint.body(context)
+                    )
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            elapsed = (time.perf_counter() - started) * 1000
+            if record:
+                latencies[endpoint.name].append(elapsed)
+                if failed:
+                    errors[endpoint.name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(LOAD_SEED + i) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    report = {}
+    for name in names:
+        count = len(latencies[name])
+        report[name] = {
+            "requests": count,
+            "errors": errors[name],
+            "rps": round(count / wall, 2),
+            **_percentiles(latencies[name]),
+        }
+    every = [latency for values in latencies.values() for latency in values]
+    report["total"] = {
+        "requests": len(every),
+        "errors": sum(errors.values()),
+        "rps": round(len(every) / wall, 2),
+        **_percentiles(every),
+    }
+    return report
+
+
+async def sweep(
+    mix: Optional[Dict[str, int]] = None,
+    levels: Sequence[int] = LOAD_CONCURRENCY,
+    duration: float = LOAD_DURATION,
+    warmup: float = LOAD_WARMUP,
+) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """Warm up once, then run every concurrency level and collect reports
+
+    Everything runs on one event loop so the app's async connection pool is
+    reused across levels.
+    """
+    mix = mix or parse_mix(os.getenv("LOAD_MIX", DEFAULT_MIX))
+    results = {}
+    async with make_client() as client:
+        context = await discover(client)
+        if warmup > 0:
+            await run_level(client, context, mix, max(levels), warmup, record=False)
+        for level in levels:
+            results[level] = await run_level(client, context, mix, level, duration)
+    return results
+
+
+def format_report(results) -> str:
+    lines = []
+    for level, report in results.items():
+        lines.append(f"concurrency {level}")
+        lines.append(f"  {'endpoint':<20}{'req':>8}{'err':>6}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name, stats in report.items():
+            lines.append(
+                f"  {name:<20}{stats['requests']:>8}{stats['errors']:>6}{stats['rps']:>10.1f}"
+                f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    results = asyncio.run(sweep())
+    print(format_report(results))
+    report_path = os.getenv("LOAD_REPORT_PATH")
+    if report_path:
+        with open(report_path, "w") as output:
+            json.dump(results, output, indent=2)
@@ -0,0 +1,245 @@
+"""Deterministic synthetic fleet for the scale benchmarks
+
+Every value is derived arithmetically from the device and row number, so two
+runs at the same scale produce identical tables regardless of how Postgres
+parallelises the inserts. Timestamps are laid out backwards from the hour the
+data was seeded so that NOW()-relative queries keep hitting data; the seed is
+refreshed once it is older than BENCH_MAX_AGE_DAYS.
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.latest_readings import backfill_latest_readings, ensure_latest_table
+from app.presence import backfill_presence, ensure_presence_table
+from app.rollups import ROLLUP_TABLES, ensure_rollup_tables, refresh_all
+
+
+@dataclass(frozen=True)
+class Scale:
+    name: str
+    devices: int
+    readings: int
+    # Span the readings of each device are spread over
+    days: int = 180
+
+    @property
+    def readings_per_device(self) -> int:
+        return max(1, self.readings // self.devices)
+
+    @property
+    def statuses_per_device(self) -> int:
+        return max(1, self.readings_per_device // 10)
+
+
+SCALES = {
+    "small": Scale("small", devices=1_000, readings=1_000_000),
+    "medium": Scale("medium", devices=5_000, readings=50_000_000),
+    "large": Scale("large", devices=20_000, readings=500_000_000),
+}
+
+# Devices per INSERT ... SELECT so large scales commit in manageable chunks
+SEED_CHUNK_DEVICES = int(os.getenv("BENCH_SEED_CHUNK_DEVICES", "200"))
+BENCH_MAX_AGE_DAYS = int(os.getenv("BENCH_MAX_AGE_DAYS", "7"))
+
+
+def scale_from_env() -> Scale:
+    """BENCH_SCALE picks a preset; BENCH_DEVICES/BENCH_READINGS define a custom one"""
+    devices = os.getenv("BENCH_DEVICES")
+    readings = os.getenv("BENCH_READINGS")
+    if devices and readings:
+        return Scale(f"custom-{devices}-{readings}", devices=int(devices), readings=int(readings))
+    name = os.getenv("BENCH_SCALE", "small")
+    if name not in SCALES:
+        raise ValueError(f"BENCH_SCALE must be one of {', '.join(SCALES)}")
+    return SCALES[name]
+
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS dim_device (
+        device_key SERIAL PRIMARY KEY,
+        device_id TEXT UNIQUE NOT NULL,
+        device_name TEXT,
+        network TEXT,
+        category TEXT,
+        status TEXT,
+        is_active BOOLEAN,
+        is_online BOOLEAN
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS dim_location (
+        location_key SERIAL PRIMARY KEY,
+        device_key INTEGER REFERENCES dim_device (device_key),
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fact_device_readings (
+        device_key INTEGER NOT NULL,
+        timestamp TIMESTAMPTZ NOT NULL,
+        pm2_5 DOUBLE PRECISION,
+        pm10 DOUBLE PRECISION,
+        battery_voltage DOUBLE PRECISION,
+        UNIQUE (device_key, timestamp)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS fact_device_readings_ts_idx ON fact_device_readings (timestamp DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS fact_device_status (
+        device_key INTEGER NOT NULL,
+        timestamp TIMESTAMPTZ NOT NULL,
+        device_status TEXT,
+        is_online BOOLEAN
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS fact_device_status_ts_idx ON fact_device_status (timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS bench_meta (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE,
+        scale TEXT NOT NULL,
+        seeded_at TIMESTAMPTZ NOT NULL
+    )
+    """,
+]
+
+SEED_DEVICES_SQL = text("""
+    INSERT INTO dim_device (device_key, device_id, device_name, network, category, status, is_active, is_online)
+    SELECT
+        d,
+        'bench-' || lpad(d::text, 6, '0'),
+        'Bench Device ' || d,
+        (ARRAY['airqo', 'kcca', 'iqair', 'tahmo'])[1 + d % 4],
+        (ARRAY['lowcost', 'lowcost', 'lowcost', 'bam', 'gas'])[1 + (d * 7) % 5],
+        CASE WHEN d % 10 < 7 THEN 'deployed' WHEN d % 10 < 9 THEN 'not deployed' ELSE 'recalled' END,
+        d % 10 < 8,
+        (d * 13) % 10 < 8
+    FROM generate_series(1, :devices) d
+""")
+
+SEED_LOCATIONS_SQL = text("""
+    INSERT INTO dim_location (device_key, latitude, longitude)
+    SELECT d, -5 + ((d * 7919) % 10000) / 1000.0, 29 + ((d * 104729) % 7000) / 1000.0
+    FROM generate_series(1, :devices) d
+""")
+
+SEED_READINGS_SQL = text("""
+    INSERT INTO fact_device_readings (device_key, timestamp, pm2_5, pm10, battery_voltage)
+    SELECT
+        d,
+        :anchor - n * make_interval(secs => :step_seconds),
+        5 + ((d * 7919 + n * 104729) % 1200) / 10.0,
+        10 + ((d * 7919 + n * 104729) % 1200) / 10.0 + ((d + n) % 150) / 10.0,
+        3.3 + ((d * 31 + n) % 100) / 100.0
+    FROM generate_series(:first_device, :last_device) d,
+         generate_series(0, :per_device - 1) n
+""")
+
+SEED_STATUS_SQL = text("""
+    INSERT INTO fact_device_status (device_key, timestamp, device_status, is_online)
+    SELECT
+        d,
+        :anchor - n * make_interval(secs => :step_seconds),
+        CASE (d * 31 + n * 17) % 20
+            WHEN 0 THEN 'offline'
+            WHEN 1 THEN 'maintenance'
+            WHEN 2 THEN 'low_battery'
+            WHEN 3 THEN 'damaged'
+            ELSE 'online'
+        END,
+        (d * 31 + n * 17) % 20 >= 2
+    FROM generate_series(:first_device, :last_device) d,
+         generate_series(0, :per_device - 1) n
+""")
+
+SEEDED_TABLES = [
+    "fact_device_readings",
+    "fact_device_status",
+    "dim_location",
+    "dim_device",
+]
+
+
+def _check_bench_database(engine) -> None:
+    # Seeding truncates the fact and dimension tables
+    database = engine.url.database or ""
+    if "bench" not in database and os.getenv("BENCH_ALLOW_TRUNCATE") != "1":
+        raise RuntimeError(
+            f"Refusing to seed '{database}': use a database whose name contains "
+            "'bench' or set BENCH_ALLOW_TRUNCATE=1"
+        )
+
+
+def is_seeded(engine, scale: Scale) -> bool:
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT to_regclass('bench_meta')")).scalar() is None:
+            return False
+        row = conn.execute(text(
+            "SELECT scale, seeded_at FROM bench_meta WHERE id"
+        )).first()
+    if row is None or row.scale != scale.name:
+        return False
+    return datetime.now(timezone.utc) - row.seeded_at < timedelta(days=BENCH_MAX_AGE_DAYS)
+
+
+def seed(engine, scale: Scale) -> None:
+    """Create the schema and load the fleet for scale, replacing any previous seed"""
+    _check_bench_database(engine)
+    with engine.begin() as conn:
+        for statement in SCHEMA_SQL:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "TRUNCATE %s RESTART IDENTITY CASCADE" % ", ".join(SEEDED_TABLES)
+        ))
+        conn.execute(text("DELETE FROM bench_meta"))
+        conn.execute(SEED_DEVICES_SQL, {"devices": scale.devices})
+        conn.execute(SEED_LOCATIONS_SQL, {"devices": scale.devices})
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('dim_device', 'device_key'), :devices)"
+        ), {"devices": scale.devices})
+
+    anchor = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    span_seconds = scale.days * 86400
+    for first in range(1, scale.devices + 1, SEED_CHUNK_DEVICES):
+        last = min(scale.devices, first + SEED_CHUNK_DEVICES - 1)
+        with engine.begin() as conn:
+            conn.execute(SEED_READINGS_SQL, {
+                "anchor": anchor,
+                "step_seconds": span_seconds / scale.readings_per_device,
+                "first_device": first,
+                "last_device": last,
+                "per_device": scale.readings_per_device,
+            })
+            conn.execute(SEED_STATUS_SQL, {
+                "anchor": anchor,
+                "step_seconds": span_seconds / scale.statuses_per_device,
+                "first_device": first,
+                "last_device": last,
+                "per_device": scale.statuses_per_device,
+            })
+
+    # Rebuild the rollups, last-value store and presence bitmaps from the new facts
+    with engine.begin() as conn:
+        ensure_rollup_tables(conn)
+        conn.execute(text("TRUNCATE %s" % ", ".join(ROLLUP_TABLES)))
+        conn.execute(text("DELETE FROM rollup_watermarks"))
+        ensure_latest_table(conn)
+        conn.execute(text("TRUNCATE device_latest_reading"))
+        backfill_latest_readings(conn)
+        ensure_presence_table(conn)
+        conn.execute(text("TRUNCATE device_hourly_presence"))
+        backfill_presence(conn)
+    refresh_all(engine)
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO bench_meta (scale, seeded_at) VALUES (:scale, now())"
+        ), {"scale": scale.name})
+
+    # VACUUM cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
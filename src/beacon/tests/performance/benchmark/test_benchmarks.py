@@ -0,0 +1,287 @@
+"""Scale benchmarks for the queries behind app/routes/devices.py and ingestion
+
+Each case runs BENCH_WARMUP untimed and BENCH_ITERATIONS timed times inside
+a transaction that is rolled back, so write cases leave the seeded fleet
+untouched. p50/p95/p99 are compared with baselines/<scale>.json and a case
+fails when p50 or p95 exceeds its baseline by more than BENCH_TOLERANCE
+(plus BENCH_MIN_SLACK_MS, so sub-millisecond cases do not flap).
+
+Record new baselines with BENCH_UPDATE_BASELINES=1; cases without a baseline
+record one on their first run.
+
+    BENCH_SCALE=small pytest tests/performance/benchmark -s
+"""
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+from app.cohorts import (
+    COHORT_SUMMARY_SQL,
+    RESOLVE_COHORTS_SQL,
+    _resolve_params,
+    _summary,
+    completeness_window,
+    parse_cohorts,
+)
+from app.device_map import DEVICE_LOCATIONS_SQL, DeviceLocationIndex
+from app.ingestion import load_batch
+from app.performance import DEVICE_EXPECTED_READINGS_PER_HOUR, HOURLY_READING_COUNTS_SQL, summarise_hourly_counts, window_bucket
+from app.presence import PRESENCE_ROWS_SQL, PresenceBitmaps
+from app.routes.devices import (
+    DEVICE_LIST_COLUMNS,
+    DEVICE_STATS_SQL,
+    _device_failures_query,
+    _device_list_query,
+)
+from app.routes.readings import _heatmap_query
+from app.sensor_health import device_indicators, iter_device_series
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+BENCH_ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "20"))
+BENCH_WARMUP = int(os.getenv("BENCH_WARMUP", "3"))
+BENCH_TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.25"))
+BENCH_MIN_SLACK_MS = float(os.getenv("BENCH_MIN_SLACK_MS", "2"))
+UPDATE_BASELINES = os.getenv("BENCH_UPDATE_BASELINES") == "1"
+
+RECENT_READINGS_SQL = text("""
+    SELECT d.device_id, r.timestamp, r.pm2_5, r.pm10
+    FROM fact_device_readings r
+    JOIN dim_device d ON r.device_key = d.device_key
+    WHERE r.timestamp >= NOW() - INTERVAL '30 days'
+    ORDER BY r.timestamp DESC
+    LIMIT 1000
+""")
+
+EXECUTEMANY_INSERT_SQL = text("""
+    INSERT INTO fact_device_readings
+    (device_key, timestamp, pm2_5, pm10, battery_voltage)
+    VALUES (:device_key, to_timestamp(:timestamp), :pm2_5, :pm10, :battery_voltage)
+    ON CONFLICT DO NOTHING
+""")
+
+
+def _synthetic_readings(scale, count):
+    # Stamped in the future so none of them collide with seeded rows
+    base = int(time.time()) + 86400
+    return [
+        {
+            "device_key": 1 + i % scale.devices,
+            "timestamp": base + (i // scale.devices) * 60,
+            "pm2_5": 10.5 + (i % 10),
+            "pm10": 20.5 + (i % 15),
+            "battery_voltage": 3.8 - (i % 10) * 0.01
+        }
+        for i in range(count)
+    ]
+
+
+def case_devices_stats(conn, scale):
+    conn.execute(DEVICE_STATS_SQL).fetchall()
+
+
+def case_devices_list_full(conn, scale):
+    query, params = _device_list_query(list(DEVICE_LIST_COLUMNS), None, None)
+    conn.execute(query, params).fetchall()
+
+
+def case_devices_list_page(conn, scale):
+    query, params = _device_list_query(list(DEVICE_LIST_COLUMNS), scale.devices // 2, 500)
+    conn.execute(query, params).fetchall()
+
+
+def case_devices_list_projection(conn, scale):
+    query, params = _device_list_query(["device_id", "latitude", "longitude"], None, None)
+    conn.execute(query, params).fetchall()
+
+
+def case_devices_failures(conn, scale):
+    query, params = _device_failures_query(6, None, None)
+    conn.execute(query, params).fetchall()
+
+
+def case_devices_failures_filtered(conn, scale):
+    query, params = _device_failures_query(12, "airqo", "lowcost")
+    conn.execute(query, params).fetchall()
+
+
+def case_readings_recent_30d(conn, scale):
+    conn.execute(RECENT_READINGS_SQL).fetchall()
+
+
+def case_devices_performance_100(conn, scale):
+    device_ids = [f"bench-{d:06d}" for d in range(1, min(100, scale.devices) + 1)]
+    end = datetime.now(timezone.utc)
+    start, end = window_bucket(end - timedelta(days=30), end)
+    rows = conn.execute(HOURLY_READING_COUNTS_SQL, {"device_ids": device_ids, "start": start, "end": end}).fetchall()
+    summarise_hourly_counts(device_ids, rows, start, end)
+
+
+def case_readings_heatmap_90d(conn, scale):
+    end = datetime.now(timezone.utc)
+    query, params = _heatmap_query(["day_of_week", "hour_of_day"], "network", end - timedelta(days=90), end, "UTC")
+    conn.execute(query, params).fetchall()
+
+
+def case_fleet_completeness_365d(conn, scale):
+    end = datetime.now(timezone.utc)
+    start, end = window_bucket(end - timedelta(days=365), end)
+    device_ids = [f"bench-{d:06d}" for d in range(1, scale.devices + 1)]
+    rows = conn.execute(text(PRESENCE_ROWS_SQL.format(filters="")), {
+        "first_month": start.date().replace(day=1), "last_month": end.date(),
+    }).fetchall()
+    PresenceBitmaps.from_rows(device_ids, rows, start, end).fleet_completeness(24)
+
+
+def case_cohort_summary_50(conn, scale):
+    # 40 listed cohorts of 100 devices and every network and network/category filter
+    cohorts = parse_cohorts([
+        *({"device_ids": [f"bench-{d:06d}" for d in range(1 + i * 100, min((i + 1) * 100, scale.devices) + 1)]}
+          for i in range(40)),
+        *({"network": network} for network in ("airqo", "kcca", "iqair", "tahmo")),
+        *({"network": network, "category": category}
+          for network in ("airqo", "kcca") for category in ("lowcost", "bam", "gas")),
+    ])
+    start, end = completeness_window(24 * 7)
+    members = {row.cohort: row for row in conn.execute(RESOLVE_COHORTS_SQL, _resolve_params(cohorts)).fetchall()}
+    rows = conn.execute(COHORT_SUMMARY_SQL, {
+        "cohorts": [i for i in members for _ in members[i].device_keys],
+        "device_keys": [key for i in members for key in members[i].device_keys],
+        "start": start,
+        "end": end,
+        "max_readings": 24 * 7 * DEVICE_EXPECTED_READINGS_PER_HOUR,
+    }).fetchall()
+    device_ids = sorted({device_id for i in members for device_id in members[i].device_ids})
+    presence_rows = conn.execute(text(PRESENCE_ROWS_SQL.format(filters="AND d.device_id = ANY(:device_ids)")), {
+        "device_ids": device_ids, "first_month": start.date().replace(day=1), "last_month": end.date(),
+    }).fetchall()
+    presence = PresenceBitmaps.from_rows(device_ids, presence_rows, start, end)
+    for row in rows:
+        _summary(row, presence.subset(members[row.cohort].device_ids))
+
+
+def case_devices_map_index(conn, scale):
+    DeviceLocationIndex(conn.execute(DEVICE_LOCATIONS_SQL).fetchall())
+
+
+# Built once per scale; the viewport case times the queries against it
+_map_indexes = {}
+
+# Seeded devices sit between 5S-5N and 29E-36E
+MAP_VIEWPORTS = (
+    ((32.45, 0.2, 32.7, 0.45), 12),   # city
+    ((29.0, -5.0, 36.0, 5.0), 7),     # whole seeded region, clustered
+    ((-180.0, -85.0, 180.0, 85.0), 2),  # world, clustered
+)
+
+
+def case_devices_map_viewports(conn, scale):
+    index = _map_indexes.get(scale.name)
+    if index is None:
+        index = _map_indexes[scale.name] = DeviceLocationIndex(conn.execute(DEVICE_LOCATIONS_SQL).fetchall())
+    for bbox, zoom in MAP_VIEWPORTS:
+        index.viewport(*bbox, zoom)
+
+
+def case_sensor_health_shard_500(conn, scale):
+    keys = list(range(1, min(500, scale.devices) + 1))
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(hours=72)
+    for _, series in iter_device_series(conn, keys, start, end):
+        device_indicators(series, start.timestamp(), end.timestamp())
+
+
+def case_ingest_copy_50k(conn, scale):
+    load_batch(conn, _synthetic_readings(scale, 50000))
+
+
+def case_ingest_executemany_5k(conn, scale):
+    conn.execute(EXECUTEMANY_INSERT_SQL, _synthetic_readings(scale, 5000))
+
+
+CASES = {
+    "devices_stats": (case_devices_stats, BENCH_ITERATIONS),
+    "devices_list_full": (case_devices_list_full, BENCH_ITERATIONS),
+    "devices_list_page": (case_devices_list_page, BENCH_ITERATIONS),
+    "devices_list_projection": (case_devices_list_projection, BENCH_ITERATIONS),
+    "devices_failures": (case_devices_failures, BENCH_ITERATIONS),
+    "devices_failures_filtered": (case_devices_failures_filtered, BENCH_ITERATIONS),
+    "readings_recent_30d": (case_readings_recent_30d, BENCH_ITERATIONS),
+    "devices_performance_100": (case_devices_performance_100, BENCH_ITERATIONS),
+    "readings_heatmap_90d": (case_readings_heatmap_90d, BENCH_ITERATIONS),
+    "fleet_completeness_365d": (case_fleet_completeness_365d, BENCH_ITERATIONS),
+    "cohort_summary_50": (case_cohort_summary_50, BENCH_ITERATIONS),
+    "devices_map_index": (case_devices_map_index, BENCH_ITERATIONS),
+    "devices_map_viewports": (case_devices_map_viewports, BENCH_ITERATIONS),
+    "sensor_health_shard_500": (case_sensor_health_shard_500, max(3, BENCH_ITERATIONS // 4)),
+    "ingest_copy_50k": (case_ingest_copy_50k, max(3, BENCH_ITERATIONS // 4)),
+    "ingest_executemany_5k": (case_ingest_executemany_5k, max(3, BENCH_ITERATIONS // 4)),
+}
+
+
+def run_case(engine, scale, case, iterations):
+    """Time case over iterations, each in its own rolled-back transaction"""
+    timings = []
+    for iteration in range(BENCH_WARMUP + iterations):
+        with engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                start_time = time.perf_counter()
+                case(conn, scale)
+                elapsed = (time.perf_counter() - start_time) * 1000
+            finally:
+                trans.rollback()
+        if iteration >= BENCH_WARMUP:
+            timings.append(elapsed)
+
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "iterations": iterations,
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+
+def load_baselines(scale):
+    path = BASELINE_DIR / f"{scale.name}.json"
+    if not path.exists():
+        return {"scale": scale.name, "cases": {}}
+    return json.loads(path.read_text())
+
+
+def save_baseline(scale, name, result):
+    baselines = load_baselines(scale)
+    baselines["cases"][name] = result
+    BASELINE_DIR.mkdir(exist_ok=True)
+    path = BASELINE_DIR / f"{scale.name}.json"
+    path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_benchmark(name, bench_engine, bench_scale):
+    """Time one query or ingestion path and compare it with its baseline"""
+    case, iterations = CASES[name]
+    result = run_case(bench_engine, bench_scale, case, iterations)
+
+    print(f"{bench_scale.name}/{name}: "
+          f"p50 {result['p50_ms']:.2f}ms  p95 {result['p95_ms']:.2f}ms  p99 {result['p99_ms']:.2f}ms")
+
+    baseline = load_baselines(bench_scale)["cases"].get(name)
+    if UPDATE_BASELINES or baseline is None:
+        save_baseline(bench_scale, name, result)
+        return
+
+    for percentile in ("p50_ms", "p95_ms"):
+        limit = baseline[percentile] * (1 + BENCH_TOLERANCE) + BENCH_MIN_SLACK_MS
+        assert result[percentile] <= limit, (
+            f"{name} regressed: {percentile} {result[percentile]:.2f}ms exceeds "
+            f"baseline {baseline[percentile]:.2f}ms by more than {BENCH_TOLERANCE:.0%}"
+        )
@@ -131,4 +131,86 @@ def test_data_insertion_performance():
         """), {"device_key": device_key})
         
         # Assert reasonable performance
-        assert inserts_per_second > 1000, f"Insertion too slow: {inserts_per_second:.2f} inserts/second below 1000 threshold"
\ No newline at end of file
+        assert inserts_per_second > 1000, f"Insertion too slow: {inserts_per_second:.2f} inserts/second below 1000 threshold"
+
+def test_copy_ingestion_performance():
+    """Compare executemany INSERT against the COPY ingestion path"""
+    from app.ingestion import ensure_ingestion_tables, ingest_readings
+
+    with engine.begin() as conn:
+        ensure_ingestion_tables(conn)
+        # Duplicates are only detectable against a unique (device_key, timestamp)
+        # index, which plain schemas may lack until app.partitions migrate
+        has_unique_key = conn.execute(text("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_index i
+                JOIN pg_class t ON t.oid = i.indrelid
+                WHERE t.relname = 'fact_device_readings' AND i.indisunique
+            )
+        """)).scalar()
+        conn.execute(text("""
+            INSERT INTO dim_device (device_id, device_name, is_active, status)
+            VALUES ('perf-test-device', 'Performance Test Device', true, 'deployed')
+            ON CONFLICT (device_id) DO NOTHING
+        """))
+        device_key = conn.execute(text("""
+            SELECT device_key FROM dim_device WHERE device_id = 'perf-test-device'
+        """)).scalar()
+
+    if not device_key:
+        pytest.fail("Could not create test device")
+
+    timestamp_base = int(time.time())
+
+    def make_readings(count, offset):
+        return [
+            {
+                "device_key": device_key,
+                "timestamp": timestamp_base - ((offset + i) * 60),
+                "pm2_5": 10.5 + (i % 10),
+                "pm10": 20.5 + (i % 15),
+                "battery_voltage": 3.8 - (i % 10) * 0.01
+            }
+            for i in range(count)
+        ]
+
+    try:
+        # executemany path, same statement as test_data_insertion_performance
+        insert_rows = make_readings(10000, 0)
+        start_time = time.time()
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO fact_device_readings
+                (device_key, timestamp, pm2_5, pm10, battery_voltage)
+                VALUES (:device_key, to_timestamp(:timestamp), :pm2_5, :pm10, :battery_voltage)
+                ON CONFLICT DO NOTHING
+            """), insert_rows)
+        executemany_rate = len(insert_rows) / (time.time() - start_time)
+
+        # COPY path over a disjoint time range so nothing is a duplicate
+        copy_rows = make_readings(200000, len(insert_rows))
+        start_time = time.time()
+        report = ingest_readings(engine, copy_rows)
+        copy_rate = len(copy_rows) / (time.time() - start_time)
+
+        print("Ingestion Performance (rows/second):")
+        print(f"  executemany INSERT: {executemany_rate:.2f}")
+        print(f"  COPY + merge: {copy_rate:.2f}")
+        print(f"  Speedup: {copy_rate / executemany_rate:.1f}x")
+
+        assert report["accepted"] == len(copy_rows), f"COPY path dropped rows: {report}"
+        assert report["rejected"] == 0
+
+        # Re-sending the same batch must be reported as duplicates, not re-inserted
+        if has_unique_key:
+            replay = ingest_readings(engine, copy_rows[:1000])
+            assert replay["duplicates"] == 1000
+
+        assert copy_rate > 100000, f"COPY ingestion too slow: {copy_rate:.2f} rows/second below 100000 threshold"
+    finally:
+        with engine.begin() as conn:
+            for table in ("fact_device_readings", "device_latest_reading", "device_hourly_presence",
+                          "rollup_dirty_hours"):
+                conn.execute(text(f"""
+                    DELETE FROM {table} WHERE device_key = :device_key
+                """), {"device_key": device_key})
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from app.token_cache import UpstreamToken, VerifiedTokenCache
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_verified_claims_are_reused_until_expiry():
+    """Claims are served from the cache until the token's exp"""
+    clock = FakeClock()
+    cache = VerifiedTokenCache(max_entries=10, max_ttl=3600, clock=clock)
+    decoded = []
+
+    def decode(token):
+        decoded.append(token)
+        return {"sub": "user@example.com", "exp": clock.now + 60}
+
+    assert cache.verify("token-a", decode)["sub"] == "user@example.com"
+    assert cache.verify("token-a", decode)["sub"] == "user@example.com"
+    assert decoded == ["token-a"]
+
+    clock.now += 61
+    cache.verify("token-a", decode)
+    assert decoded == ["token-a", "token-a"]
+
+
+def test_rejected_tokens_are_not_cached():
+    """A token that fails verification fails again on the next request"""
+    cache = VerifiedTokenCache(max_entries=10)
+
+    def decode(token):
+        raise ValueError("Invalid token")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.verify("bad-token", decode)
+    assert len(cache) == 0
+
+
+def test_verified_cache_is_bounded():
+    """The least recently used token is evicted beyond max_entries"""
+    clock = FakeClock()
+    cache = VerifiedTokenCache(max_entries=2, clock=clock)
+    for token in ("a", "b"):
+        cache.put(token, {"exp": clock.now + 60})
+    cache.get("a")
+    cache.put("c", {"exp": clock.now + 60})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_upstream_token_refreshes_ahead_of_expiry():
+    """The token is reused, then refreshed once inside the refresh margin"""
+    clock = FakeClock()
+    fetched = []
+
+    def fetch():
+        fetched.append(clock.now)
+        return f"token-{len(fetched)}", 600
+
+    token = UpstreamToken(fetch, refresh_margin=60, clock=clock)
+    assert token.get() == "token-1"
+    clock.now += 500
+    assert token.get() == "token-1"
+    clock.now += 50
+    assert token.get() == "token-2"
+    assert len(fetched) == 2
+
+
+def test_upstream_token_keeps_valid_token_when_refresh_fails():
+    """A failed refresh ahead of expiry falls back to the current token"""
+    clock = FakeClock()
+    responses = iter([("token-1", 600)])
+
+    def fetch():
+        try:
+            return next(responses)
+        except StopIteration:
+            raise ConnectionError("upstream unavailable")
+
+    token = UpstreamToken(fetch, refresh_margin=60, clock=clock)
+    token.get()
+    clock.now += 580
+    assert token.get() == "token-1"
+    clock.now += 30
+    with pytest.raises(ConnectionError):
+        token.get()
+
+
+def test_upstream_token_fetch_is_single_flight():
+    """Concurrent callers with no valid token share one fetch"""
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return "token", 600
+
+    token = UpstreamToken(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(token.get())) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["token"] * 10
+    assert len(calls) == 1
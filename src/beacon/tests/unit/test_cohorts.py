@@ -0,0 +1,41 @@
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+from app.cohorts import _summary
+from app.performance import DEVICE_EXPECTED_READINGS_PER_HOUR
+from app.presence import MONTH_BITS, PresenceBitmaps
+
+START = datetime(2024, 3, 1, 0, tzinfo=timezone.utc)
+END = datetime(2024, 3, 1, 4, tzinfo=timezone.utc)
+
+
+def _row(total_devices, readings):
+    return SimpleNamespace(
+        total_devices=total_devices, active_devices=total_devices, online_devices=0,
+        offline_devices=total_devices, deployed_devices=total_devices, not_deployed_devices=0,
+        recalled_devices=0, latest_pm2_5_avg=None, latest_pm10_avg=None, last_reading_at=None,
+        readings=readings,
+    )
+
+
+def _presence():
+    bits = ["0"] * MONTH_BITS
+    for hour in (0, 1, 2, 3):
+        bits[hour] = "1"
+    rows = [SimpleNamespace(device_id="aq-001", month=date(2024, 3, 1), hours="".join(bits))]
+    return PresenceBitmaps.from_rows(["aq-001", "aq-002", "aq-003"], rows, START, END)
+
+
+def test_completeness_counts_readings_not_reporting_hours():
+    """A device reporting every hour at a quarter of the expected rate is 25% complete, 100% up"""
+    summary = _summary(_row(1, DEVICE_EXPECTED_READINGS_PER_HOUR), _presence().subset(["aq-001"]))
+    assert summary["uptime"] == 100.0
+    assert summary["data_completeness"] == 25.0
+
+
+def test_cohort_figures_cover_only_its_members():
+    """Uptime and completeness average over the cohort's own devices"""
+    summary = _summary(_row(2, 4 * DEVICE_EXPECTED_READINGS_PER_HOUR), _presence().subset(["aq-001", "aq-002"]))
+    assert summary["total_devices"] == 2
+    assert summary["uptime"] == 50.0
+    assert summary["data_completeness"] == 50.0
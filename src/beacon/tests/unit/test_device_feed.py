@@ -0,0 +1,131 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import app.device_feed
+from app.device_feed import DEVICE_STATE_SQL, NEW_FAILURES_SQL, DeviceChangeFeed
+
+
+class FakeResult:
+    def __init__(self, rows=(), value=None):
+        self._rows = list(rows)
+        self._value = value
+
+    def fetchall(self):
+        return self._rows
+
+    def scalar(self):
+        return self._value
+
+
+class FakeDatabase:
+    """Just enough of an async engine for the feed's three queries"""
+
+    def __init__(self):
+        self.now = datetime(2024, 3, 1, tzinfo=timezone.utc)
+        self.failures = []
+        self.device = {
+            "device_id": "aq-001", "network": "airqo", "category": "lowcost",
+            "status": "deployed", "is_active": True, "is_online": True,
+        }
+
+    def add_failure(self, timestamp):
+        self.failures.append(SimpleNamespace(
+            device_key=1, device_id="aq-001", timestamp=timestamp,
+            device_status="offline", failure_category="connectivity_issues",
+        ))
+
+    def connect(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        if statement is DEVICE_STATE_SQL:
+            return FakeResult([SimpleNamespace(**self.device)])
+        if statement is NEW_FAILURES_SQL:
+            sent = set(zip(params["sent_keys"], params["sent_timestamps"], params["sent_statuses"]))
+            rows = [
+                row for row in sorted(self.failures, key=lambda row: row.timestamp)
+                if row.timestamp > params["since"]
+                and (row.device_key, row.timestamp, row.device_status) not in sent
+            ]
+            return FakeResult(rows[:params["limit"]])
+        return FakeResult(value=self.now)
+
+
+def _drain(queue):
+    events = []
+    while not queue.empty():
+        message = queue.get_nowait()
+        event = message.split("\n")[1].removeprefix("event: ")
+        events.append((event, json.loads(message.split("data: ", 1)[1])))
+    return events
+
+
+def test_resubscribing_does_not_replay_failures_from_while_idle(monkeypatch):
+    """A restarted feed starts from a fresh first poll, not the old cursor"""
+    # Smaller than the idle backlog, so a stale cursor would page through it
+    monkeypatch.setattr(app.device_feed, "DEVICE_FEED_FAILURE_BATCH", 10)
+
+    async def scenario():
+        database = FakeDatabase()
+        feed = DeviceChangeFeed(engine=database, poll_seconds=0.01)
+
+        queue = await feed.subscribe()
+        await asyncio.sleep(0.05)
+        database.add_failure(database.now + timedelta(minutes=1))
+        await asyncio.sleep(0.05)
+        first = _drain(queue)
+        feed.unsubscribe(queue)
+
+        # A day of failures while nobody is connected
+        for minute in range(1, 100):
+            database.add_failure(database.now + timedelta(hours=2, minutes=minute))
+        database.now += timedelta(days=1)
+
+        queue = await feed.subscribe()
+        await asyncio.sleep(0.05)
+        idle = _drain(queue)
+        database.add_failure(database.now + timedelta(minutes=1))
+        await asyncio.sleep(0.05)
+        live = _drain(queue)
+        feed.unsubscribe(queue)
+        return first, idle, live
+
+    first, idle, live = asyncio.run(scenario())
+
+    assert [event for event, _ in first] == ["snapshot", "delta"]
+    assert len(first[1][1]["failures"]) == 1
+    assert [event for event, _ in idle] == ["snapshot"]
+    assert [event for event, _ in live] == ["delta"]
+    assert len(live[0][1]["failures"]) == 1
+
+
+def test_failures_sharing_a_timestamp_are_all_delivered_once():
+    """Paging past a timestamp does not drop its other events or repeat them"""
+    async def scenario():
+        database = FakeDatabase()
+        feed = DeviceChangeFeed(engine=database, poll_seconds=0.01)
+        queue = await feed.subscribe()
+        await asyncio.sleep(0.03)
+        at = database.now + timedelta(minutes=1)
+        database.add_failure(at)
+        await asyncio.sleep(0.03)
+        database.failures.append(SimpleNamespace(
+            device_key=2, device_id="aq-002", timestamp=at,
+            device_status="offline", failure_category="connectivity_issues",
+        ))
+        await asyncio.sleep(0.05)
+        events = _drain(queue)
+        feed.unsubscribe(queue)
+        return events
+
+    events = asyncio.run(scenario())
+    delivered = [failure["device_id"] for _, payload in events for failure in payload.get("failures", [])]
+    assert delivered == ["aq-001", "aq-002"]
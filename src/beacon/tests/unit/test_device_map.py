@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.device_map import DEVICE_STATUSES, DeviceLocationIndex
+
+
+def _rows(latitude, longitude):
+    return [
+        SimpleNamespace(
+            device_id=f"aq-{i:05d}", device_name=f"AirQo {i}", status=DEVICE_STATUSES[i % 3],
+            is_online=i % 2 == 0, latitude=lat, longitude=lon,
+        )
+        for i, (lat, lon) in enumerate(zip(latitude, longitude))
+    ]
+
+
+def _fleet():
+    # 2000 devices around Kampala spread over several index cells
+    rng = np.random.default_rng(7)
+    return _rows(rng.uniform(-1.5, 2.5, 2000), rng.uniform(30.5, 34.5, 2000))
+
+
+def test_query_matches_a_full_scan():
+    """The grid slices return exactly the devices inside the box"""
+    rows = _fleet()
+    index = DeviceLocationIndex(rows)
+    west, south, east, north = 31.2, -0.7, 33.4, 1.9
+    expected = {row.device_id for row in rows if south <= row.latitude <= north and west <= row.longitude <= east}
+    assert set(index.device_id[index.query(west, south, east, north)]) == expected
+
+
+def test_cluster_counts_sum_to_the_matched_total():
+    """Every matched device is in exactly one cluster or single-device feature"""
+    index = DeviceLocationIndex(_fleet())
+    body = index.viewport(31.0, -1.0, 34.0, 2.0, zoom=8, cluster=True)
+    features = body["features"]
+    assert body["clustered"] and body["total"] > 0
+    assert any(feature["type"] == "cluster" for feature in features)
+    assert sum(feature.get("count", 1) for feature in features) == body["total"]
+    clusters = [feature for feature in features if feature["type"] == "cluster"]
+    assert all(c["online"] + c["offline"] == c["count"] == sum(c["status"].values()) for c in clusters)
+
+
+def test_box_crossing_the_antimeridian_returns_both_sides():
+    """west > east selects from west to 180 and from -180 to east"""
+    # Fiji straddles 180; the Kampala device lies between east and west
+    index = DeviceLocationIndex(_rows([-17.0, -16.5, -17.2, -16.8, 0.3], [175.0, 178.5, -178.0, -175.0, 32.6]))
+    body = index.viewport(170.0, -20.0, -170.0, -10.0, zoom=4)
+    longitudes = sorted(feature["longitude"] for feature in body["features"])
+    assert body["total"] == 4
+    assert longitudes == [-178.0, -175.0, 175.0, 178.5]
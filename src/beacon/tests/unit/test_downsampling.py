@@ -0,0 +1,40 @@
+import numpy as np
+
+from app.downsampling import lttb
+
+
+def _series(n=1000):
+    x = np.arange(n, dtype=np.float64)
+    y = np.sin(x / 25) * 50 + np.random.default_rng(7).normal(0, 5, n)
+    return x, y
+
+
+def test_endpoints_are_always_kept():
+    """The first and last points survive any threshold"""
+    x, y = _series()
+    for threshold in (3, 10, 250, 999):
+        selected = lttb(x, y, threshold)
+        assert selected[0] == 0
+        assert selected[-1] == len(x) - 1
+
+
+def test_output_has_threshold_points_in_order():
+    """Exactly threshold distinct indices come back, ascending"""
+    x, y = _series()
+    selected = lttb(x, y, 100)
+    assert len(selected) == 100
+    assert np.all(np.diff(selected) > 0)
+
+
+def test_spikes_are_preserved():
+    """A single outlier is the most significant point of its bucket"""
+    x, y = np.arange(500, dtype=np.float64), np.zeros(500)
+    y[137] = 1000
+    assert 137 in lttb(x, y, 20)
+
+
+def test_short_series_are_returned_whole():
+    """Fewer points than the threshold are all kept"""
+    x, y = _series(50)
+    assert lttb(x, y, 100).tolist() == list(range(50))
+    assert lttb(x, y, 50).tolist() == list(range(50))
@@ -0,0 +1,70 @@
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.presence import MONTH_BITS, PresenceBitmaps
+
+# Four hours across the leap-day month boundary: Feb 29 22:00 to Mar 1 02:00
+START = datetime(2024, 2, 29, 22, tzinfo=timezone.utc)
+END = datetime(2024, 3, 1, 2, tzinfo=timezone.utc)
+
+
+def _row(device_id, month, hours):
+    bits = ["0"] * MONTH_BITS
+    for hour in hours:
+        bits[hour] = "1"
+    return SimpleNamespace(device_id=device_id, month=month, hours="".join(bits))
+
+
+def _bitmaps():
+    rows = [
+        # Hour 694 is Feb 29 22:00; 700 lies past February's 696 hours and
+        # must not leak into March
+        _row("aq-001", date(2024, 2, 1), [694, 700]),
+        _row("aq-001", date(2024, 3, 1), [1]),
+        _row("unknown", date(2024, 3, 1), [0]),
+    ]
+    return PresenceBitmaps.from_rows(["aq-001", "aq-002"], rows, START, END)
+
+
+def test_hours_are_decoded_across_a_month_boundary():
+    """Bits are placed by month offset; padding past a month's end is dropped"""
+    presence = _bitmaps()
+    assert presence.hours == 4
+    assert presence.device_bits("aq-001").tolist() == [True, False, False, True]
+    assert presence.hours_with_data().tolist() == [2, 0]
+    assert presence.uptime() == {"aq-001": 50.0, "aq-002": 0.0}
+
+
+def test_device_without_rows_has_an_empty_bitmap():
+    """A device with no stored months reports nothing and is one long gap"""
+    presence = _bitmaps()
+    assert not presence.device_bits("aq-002").any()
+    assert presence.gaps("aq-002") == [{"start": START, "end": END, "hours": 4}]
+
+
+def test_gaps_are_runs_of_missing_hours():
+    """Gaps start at the first missing hour and honour min_hours"""
+    presence = _bitmaps()
+    gap = {"start": datetime(2024, 2, 29, 23, tzinfo=timezone.utc),
+           "end": datetime(2024, 3, 1, 1, tzinfo=timezone.utc), "hours": 2}
+    assert presence.gaps("aq-001") == [gap]
+    assert presence.gaps("aq-001", min_hours=3) == []
+
+
+def test_fleet_completeness_averages_device_buckets():
+    """Each bucket is the mean device share; a short last bucket uses its own size"""
+    presence = _bitmaps()
+    assert presence.fleet_completeness(2).tolist() == [25.0, 25.0]
+    matrix = presence.completeness_matrix(3)
+    assert np.allclose(matrix, [[100 / 3, 100.0], [0.0, 0.0]])
+
+
+def test_any_and_all_reporting():
+    """Fleet-wide OR and AND over the packed hours"""
+    presence = _bitmaps()
+    any_bits = np.unpackbits(presence.any_reporting(), count=presence.hours)
+    all_bits = np.unpackbits(presence.all_reporting(), count=presence.hours)
+    assert any_bits.tolist() == [1, 0, 0, 1]
+    assert all_bits.tolist() == [0, 0, 0, 0]